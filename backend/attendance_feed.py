@@ -0,0 +1,167 @@
+import asyncio
+import json
+import threading
+import uuid
+from datetime import date, datetime
+from typing import Callable, Dict, List, Optional
+
+# --- SNAPSHOT /attendance/today (LOG TERAKHIR PER INTERN, IN-MEMORY) ---
+
+# Interval komentar keep-alive SSE (detik) agar proxy tidak memutus koneksi
+SSE_KEEPALIVE_SECONDS = 15.0
+
+
+class TodaySnapshot:
+    """
+    Snapshot log terakhir per intern untuk hari berjalan, dipelihara secara incremental.
+
+    Setiap log baru mengganti baris intern tersebut dan menaikkan `version`; daftar
+    terurut di-cache per versi sehingga GET /attendance/today tidak lagi menjalankan
+    window function di DB. Perubahan didorong ke pelanggan SSE sebagai delta.
+    """
+
+    def __init__(self, formatter: Callable[..., dict]):
+        # formatter(name, instansi, kategori, absent_at, image_url, type) -> baris JSON API
+        self.formatter = formatter
+        self._lock = threading.Lock()
+        self._day: Optional[date] = None
+        self._rows: Dict[str, dict] = {}
+        self._raw_times: Dict[str, datetime] = {}
+        self._version = 0
+        # Nonce per proses: `version` mulai dari 0 lagi setiap restart, jadi ETag lama dari
+        # klien tidak boleh cocok dengan snapshot baru yang kebetulan versinya sama
+        self._boot_id = uuid.uuid4().hex[:12]
+        self._sorted_cache = None
+        self._subscribers: List[asyncio.Queue] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop):
+        """Event loop tempat antrean pelanggan SSE hidup (dipanggil saat startup)."""
+        self._loop = loop
+
+    # --- ISI & PERUBAHAN ---
+
+    def load(self, day: date, rows):
+        """Mengganti isi snapshot dengan hasil query DB (startup / reconnect)."""
+        with self._lock:
+            self._day = day
+            self._rows = {}
+            self._raw_times = {}
+            for name, instansi, kategori, absent_at, image_url, log_type in rows:
+                self._rows[name] = self.formatter(name, instansi, kategori, absent_at, image_url, log_type)
+                self._raw_times[name] = absent_at
+            self._bump()
+            version, snapshot = self._version, self._sorted_locked()
+        self._publish({"event": "snapshot", "version": version, "rows": snapshot})
+
+    def apply(self, name: str, instansi: str, kategori: str, absent_at: datetime, image_url: str, log_type: str):
+        """Menerapkan satu log baru; diabaikan jika lebih lama dari baris yang ada (idempoten)."""
+        with self._lock:
+            if self._day is None or absent_at.date() > self._day:
+                self._reset_locked(absent_at.date())
+            if absent_at.date() != self._day:
+                return
+            current = self._raw_times.get(name)
+            if current is not None and current >= absent_at:
+                return
+            row = self.formatter(name, instansi, kategori, absent_at, image_url, log_type)
+            self._rows[name] = row
+            self._raw_times[name] = absent_at
+            self._bump()
+            version = self._version
+        self._publish({"event": "delta", "version": version, "row": row})
+
+    def clear(self, day: Optional[date] = None):
+        with self._lock:
+            self._reset_locked(day)
+            version = self._version
+        self._publish({"event": "snapshot", "version": version, "rows": []})
+
+    def _reset_locked(self, day: Optional[date]):
+        self._day = day
+        self._rows = {}
+        self._raw_times = {}
+        self._bump()
+
+    def _bump(self):
+        self._version += 1
+        self._sorted_cache = None
+
+    # --- BACA ---
+
+    def _sorted_locked(self) -> List[dict]:
+        if self._sorted_cache is None:
+            names = sorted(self._rows, key=lambda n: self._raw_times[n], reverse=True)
+            self._sorted_cache = [self._rows[n] for n in names]
+        return self._sorted_cache
+
+    def read(self, today: date):
+        """Mengembalikan (version, rows terurut terbaru dulu) untuk hari `today`."""
+        rolled = False
+        with self._lock:
+            if self._day != today:
+                self._reset_locked(today)
+                rolled = True
+            version, rows = self._version, self._sorted_locked()
+        if rolled:
+            self._publish({"event": "snapshot", "version": version, "rows": []})
+        return version, rows
+
+    def etag(self, version: int) -> str:
+        return f'W/"{self._boot_id}-{self._day}-{version}"'
+
+    # --- SERVER-SENT EVENTS ---
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=256)
+        with self._lock:
+            self._subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        with self._lock:
+            if queue in self._subscribers:
+                self._subscribers.remove(queue)
+
+    def _publish(self, message: dict):
+        if self._loop is None:
+            return
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for queue in subscribers:
+            # Bisa dipanggil dari thread executor DB / listener: serahkan ke event loop
+            self._loop.call_soon_threadsafe(self._offer, queue, message)
+
+    def _offer(self, queue: asyncio.Queue, message: dict):
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Klien terlalu lambat: paksa kirim ulang snapshot penuh
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait({"event": "resync"})
+
+    async def stream(self, today_fn: Callable[[], date]):
+        """Generator SSE: snapshot awal, lalu delta; keep-alive setiap SSE_KEEPALIVE_SECONDS."""
+        queue = self.subscribe()
+        try:
+            version, rows = self.read(today_fn())
+            yield format_sse("snapshot", {"version": version, "rows": rows})
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                # Pesan yang sama dibagikan ke semua pelanggan: jangan dimodifikasi
+                event = message["event"]
+                if event == "resync":
+                    version, rows = self.read(today_fn())
+                    event, message = "snapshot", {"version": version, "rows": rows}
+                yield format_sse(event, {k: v for k, v in message.items() if k != "event"})
+        finally:
+            self.unsubscribe(queue)
+
+
+def format_sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
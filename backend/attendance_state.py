@@ -0,0 +1,224 @@
+import json
+import os
+import select
+import threading
+import time
+from datetime import date, datetime
+from typing import Callable, Dict, NamedTuple, Optional, Union
+
+import psycopg2.extensions
+
+# --- KONFIGURASI ---
+DB_TABLE_LOGS = "attendance_logs"
+# Channel LISTEN/NOTIFY untuk menyinkronkan state antar worker (uvicorn/gunicorn multi-proses)
+ATTENDANCE_NOTIFY_CHANNEL = os.getenv("ATTENDANCE_NOTIFY_CHANNEL", "attendance_logged")
+# Namespace advisory lock (kunci pertama pg_advisory_xact_lock(int, int)) untuk penulisan log per intern
+ATTENDANCE_LOCK_NAMESPACE = 4201
+# Tabel satu baris berisi epoch reset: naik setiap log hari ini dihapus (reset manual / terjadwal)
+DB_TABLE_RESET_EPOCH = "attendance_reset_epoch"
+
+
+def ensure_reset_epoch_schema(cursor):
+    """Membuat tabel epoch reset (satu baris) jika belum ada."""
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {DB_TABLE_RESET_EPOCH} (
+            id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+            epoch BIGINT NOT NULL DEFAULT 0
+        );
+    """)
+    cursor.execute(f"INSERT INTO {DB_TABLE_RESET_EPOCH} (id, epoch) VALUES (1, 0) ON CONFLICT (id) DO NOTHING;")
+
+
+def read_reset_epoch(cursor) -> int:
+    cursor.execute(f"SELECT epoch FROM {DB_TABLE_RESET_EPOCH} WHERE id = 1")
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def bump_reset_epoch(cursor) -> int:
+    """Menaikkan epoch reset (dipanggil di transaksi yang sama dengan DELETE log)."""
+    cursor.execute(f"""
+        INSERT INTO {DB_TABLE_RESET_EPOCH} (id, epoch) VALUES (1, 1)
+        ON CONFLICT (id) DO UPDATE SET epoch = {DB_TABLE_RESET_EPOCH}.epoch + 1
+        RETURNING epoch
+    """)
+    return cursor.fetchone()[0]
+
+
+class DayEntry(NamedTuple):
+    """Log terakhir seorang intern pada hari berjalan."""
+    name: str
+    type: str
+    absent_at: datetime
+
+
+class TodayState:
+    """
+    State absensi hari ini di memori: intern_id -> log terakhir (tipe & waktu).
+
+    Cek duplikat IN/OUT cukup membaca dict ini tanpa query DB. State di-warm dari DB
+    saat startup, diperbarui setelah setiap log ter-commit, otomatis kosong saat
+    berganti hari, dan disinkronkan antar worker melalui NOTIFY (lihat StateListener).
+    `epoch` adalah epoch reset DB saat state terakhir dimuat/dikosongkan; duplikat dari
+    cache hanya berlaku jika epoch-nya masih sama dengan di DB.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._day: Optional[date] = None
+        self._entries: Dict[int, DayEntry] = {}
+        self.epoch: Optional[int] = None
+
+    def _roll(self, day: date):
+        # Dipanggil dengan _lock dipegang
+        if self._day != day:
+            self._day = day
+            self._entries = {}
+
+    def get(self, intern_id: int, day: date) -> Optional[DayEntry]:
+        with self._lock:
+            self._roll(day)
+            return self._entries.get(intern_id)
+
+    def record(self, intern_id: int, name: str, type_absensi: str, absent_at: datetime):
+        """Menyimpan log terbaru (diabaikan jika lebih tua dari yang sudah ada atau beda hari)."""
+        with self._lock:
+            if self._day is None or absent_at.date() > self._day:
+                self._roll(absent_at.date())
+            if absent_at.date() != self._day:
+                return
+            current = self._entries.get(intern_id)
+            if current is None or current.absent_at <= absent_at:
+                self._entries[intern_id] = DayEntry(name, type_absensi, absent_at)
+
+    def clear(self, day: Optional[date] = None, epoch: Optional[int] = None):
+        with self._lock:
+            self._day = day
+            self._entries = {}
+            if epoch is not None:
+                self.epoch = epoch
+
+    def warm(self, conn, day_start: datetime, day_end: datetime) -> int:
+        """Mengisi state dari log hari ini (satu query DISTINCT ON per intern)."""
+        with conn.cursor() as cursor:
+            epoch = read_reset_epoch(cursor)
+            cursor.execute(f"""
+                SELECT DISTINCT ON (intern_id) intern_id, intern_name, type, absent_at
+                FROM {DB_TABLE_LOGS}
+                WHERE absent_at >= %s AND absent_at < %s AND intern_id IS NOT NULL
+                ORDER BY intern_id, absent_at DESC
+            """, (day_start, day_end))
+            rows = cursor.fetchall()
+        with self._lock:
+            self._day = day_start.date()
+            self._entries = {row[0]: DayEntry(row[1], row[2], row[3]) for row in rows}
+            self.epoch = epoch
+        return len(rows)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def lock_intern_attendance(cursor, intern_id: int):
+    """Advisory lock per intern (berlaku sampai akhir transaksi): cek duplikat + insert antar worker jadi atomik."""
+    cursor.execute("SELECT pg_advisory_xact_lock(%s, %s)", (ATTENDANCE_LOCK_NAMESPACE, intern_id))
+
+
+class AttendanceEvent(NamedTuple):
+    """Isi NOTIFY satu log absensi (cukup untuk state duplikat & snapshot /attendance/today)."""
+    intern_id: int
+    name: str
+    type: str
+    absent_at: datetime
+    instansi: Optional[str] = None
+    kategori: Optional[str] = None
+    image_url: Optional[str] = None
+
+
+def notify_attendance(cursor, intern_id: int, name: str, type_absensi: str, absent_at: datetime,
+                      instansi: Optional[str] = None, kategori: Optional[str] = None, image_url: Optional[str] = None):
+    """NOTIFY dikirim saat commit; worker lain memperbarui state-nya lewat StateListener."""
+    payload = json.dumps({
+        "intern_id": intern_id, "name": name, "type": type_absensi, "absent_at": absent_at.isoformat(),
+        "instansi": instansi, "kategori": kategori, "image_url": image_url,
+    })
+    cursor.execute("SELECT pg_notify(%s, %s)", (ATTENDANCE_NOTIFY_CHANNEL, payload))
+
+
+class ResetEvent(NamedTuple):
+    """Isi NOTIFY reset: log hari `day` dihapus dan epoch reset DB naik ke `epoch`."""
+    day: date
+    epoch: int
+
+
+def notify_reset(cursor, day: date, epoch: int):
+    """NOTIFY reset: setiap worker mengosongkan state & snapshot hari ini (lihat StateListener)."""
+    payload = json.dumps({"event": "reset", "day": day.isoformat(), "epoch": epoch})
+    cursor.execute("SELECT pg_notify(%s, %s)", (ATTENDANCE_NOTIFY_CHANNEL, payload))
+
+
+def parse_notification(payload: str) -> Union[AttendanceEvent, ResetEvent]:
+    data = json.loads(payload)
+    if data.get("event") == "reset":
+        return ResetEvent(date.fromisoformat(data["day"]), int(data["epoch"]))
+    return AttendanceEvent(int(data["intern_id"]), data["name"], data["type"],
+                           datetime.fromisoformat(data["absent_at"]),
+                           data.get("instansi"), data.get("kategori"), data.get("image_url"))
+
+
+class StateListener:
+    """
+    Thread LISTEN pada koneksi khusus (di luar pool) yang meneruskan setiap NOTIFY
+    log absensi ke callback. Koneksi yang putus disambung ulang otomatis.
+    """
+
+    def __init__(self, connect: Callable, on_event: Callable, on_listen: Optional[Callable] = None,
+                 channel: str = ATTENDANCE_NOTIFY_CHANNEL):
+        self.connect = connect
+        self.on_event = on_event
+        self.on_listen = on_listen
+        self.channel = channel
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="attendance-listener", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 2.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = self.connect()
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {self.channel};")
+                if self.on_listen is not None:
+                    # Notifikasi selama koneksi putus hilang: state di-warm ulang dari DB
+                    self.on_listen()
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notification = conn.notifies.pop(0)
+                        try:
+                            self.on_event(notification.payload)
+                        except Exception as e:
+                            print(f"⚠️ [AttendanceState] Notifikasi tidak valid '{notification.payload}': {e}")
+            except Exception as e:
+                print(f"⚠️ [AttendanceState] Listener terputus: {e}. Menyambung ulang...")
+                time.sleep(2)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
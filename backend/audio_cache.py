@@ -0,0 +1,327 @@
+import os
+import queue
+import re
+import shutil
+import subprocess
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+# --- KONFIGURASI TTS (DIBACA DARI ENV) ---
+# Urutan backend TTS yang dicoba, dipisah koma. 'gtts' butuh internet; 'espeak' dan 'pyttsx3' offline.
+TTS_BACKENDS = [b.strip().lower() for b in os.getenv("TTS_BACKEND", "gtts,espeak").split(",") if b.strip()]
+TTS_LANG = os.getenv("TTS_LANG", "id")
+
+# --- PROMPT TETAP ---
+FIXED_PROMPTS = {
+    "S002": "Wajah tidak terdeteksi.",
+    "S003": "Wajah Anda belum terdaftar.",
+    "S004": "Kesalahan server terjadi.",
+    "S005": "Kesalahan tipe absensi.",
+    # Fallback generik selama audio per-intern belum selesai dirender
+    "S006": "Absensi berhasil dicatat.",
+    "S007": "Anda sudah melakukan absensi.",
+}
+
+# --- KOMPOSISI AUDIO PER INTERN ---
+# Setiap pesan = urutan klip frasa (dirender sekali untuk semua intern) + klip nama
+# (dirender sekali per intern). Jumlah render TTS ~ jumlah intern + jumlah frasa,
+# bukan jumlah intern x jumlah pesan.
+NAME = None # Penanda posisi klip nama di dalam template
+
+PHRASE_CLIPS = {
+    "P_selamat_datang": "Selamat datang,",
+    "P_maaf": "Maaf,",
+    "P_masuk_terlambat": "Absensi masuk Anda terlambat.",
+    "P_terima_kasih": "Terima kasih,",
+    "P_peringatan": "Peringatan,",
+    "P_pulang_cepat": "Anda Pulang Cepat.",
+    "P_sudah_absen_masuk": "Anda sudah Absen Masuk hari ini.",
+    "P_absensi_pulang": "Absensi Pulang",
+    "P_sudah_dicatat": "sudah dicatat.",
+}
+
+# Kunci pesan -> (urutan klip, prompt fallback jika belum ada klip sama sekali)
+INTERN_MESSAGES = {
+    "in": (["P_selamat_datang", NAME], "S006"),
+    "in_late": (["P_maaf", NAME, "P_masuk_terlambat"], "S006"),
+    "out": (["P_terima_kasih", NAME], "S006"),
+    "out_early": (["P_peringatan", NAME, "P_pulang_cepat"], "S006"),
+    "duplicate_in": ([NAME, "P_sudah_absen_masuk"], "S007"),
+    "duplicate_out": (["P_absensi_pulang", NAME, "P_sudah_dicatat"], "S007"),
+}
+
+# Subfolder milik cache di dalam folder audio. Hanya file di sini yang dirender, dipindai,
+# dan boleh dihapus; file lain di folder audio (audio lama / ditaruh manual) tidak disentuh.
+AUDIO_CACHE_SUBDIR = "tts"
+
+
+# --- BACKEND TTS (PLUGGABLE) ---
+
+class GTTSBackend:
+    """Google TTS (online). Menghasilkan MP3."""
+    name = "gtts"
+    extension = "mp3"
+
+    def available(self) -> bool:
+        try:
+            import gtts  # noqa: F401
+            return True
+        except ImportError:
+            return False
+
+    def render(self, text: str, path: Path):
+        from gtts import gTTS
+        gTTS(text=text, lang=TTS_LANG).save(str(path))
+
+
+class EspeakBackend:
+    """eSpeak NG (offline, CLI). Menghasilkan WAV."""
+    name = "espeak"
+    extension = "wav"
+
+    def _binary(self) -> Optional[str]:
+        return shutil.which("espeak-ng") or shutil.which("espeak")
+
+    def available(self) -> bool:
+        return self._binary() is not None
+
+    def render(self, text: str, path: Path):
+        subprocess.run([self._binary(), "-v", TTS_LANG, "-w", str(path), text],
+                       check=True, capture_output=True, timeout=30)
+
+
+class Pyttsx3Backend:
+    """pyttsx3 (offline, memakai engine TTS sistem). Menghasilkan WAV."""
+    name = "pyttsx3"
+    extension = "wav"
+
+    def __init__(self):
+        self._engine = None
+
+    def available(self) -> bool:
+        try:
+            import pyttsx3  # noqa: F401
+            return True
+        except ImportError:
+            return False
+
+    def render(self, text: str, path: Path):
+        if self._engine is None:
+            import pyttsx3
+            self._engine = pyttsx3.init()
+        self._engine.save_to_file(text, str(path))
+        self._engine.runAndWait()
+
+
+TTS_BACKEND_CLASSES = {cls.name: cls for cls in (GTTSBackend, EspeakBackend, Pyttsx3Backend)}
+
+
+def audio_key_for_name(name: str) -> str:
+    """Nama intern -> bagian aman untuk nama file ('A\\'yun Putri' -> 'a_yun_putri')."""
+    return re.sub(r"[^a-z0-9]+", "_", name.strip().lower()).strip("_")
+
+
+def name_clip_key(name: str) -> str:
+    return f"N_{audio_key_for_name(name)}"
+
+
+class AudioCache:
+    """
+    Cache audio TTS yang dirender sebelumnya.
+
+    Daftar track yang sudah ada di disk disimpan di memori (key -> nama file), sehingga
+    `/recognize` hanya melakukan lookup dict dan tidak pernah memanggil TTS. Track yang
+    belum ada dirender oleh satu worker thread di latar belakang; sementara itu dipakai
+    prompt fallback yang sudah ada (atau None jika belum ada sama sekali).
+
+    Pesan per intern tidak dirender utuh, melainkan dikirim sebagai playlist klip
+    (frasa + nama) yang diputar berurutan oleh frontend.
+    """
+
+    def __init__(self, directory: Path, backends: Iterable[str] = TTS_BACKENDS):
+        # Nama track = path relatif terhadap `directory` (yang di-mount di /audio)
+        self.directory = Path(directory) / AUDIO_CACHE_SUBDIR
+        self.backend_names = list(backends)
+        self._backends = None
+        self._tracks: Dict[str, str] = {}
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue" = queue.Queue()
+        self._worker = None
+        self._rendered = 0
+        self._failed = 0
+
+    # --- SIKLUS HIDUP ---
+
+    def start(self):
+        """Memindai track yang ada, memulai worker, dan mengantrekan prompt & frasa tetap."""
+        os.makedirs(self.directory, exist_ok=True)
+        self.scan()
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._render_loop, name="tts-render", daemon=True)
+            self._worker.start()
+        for key, text in list(FIXED_PROMPTS.items()) + list(PHRASE_CLIPS.items()):
+            self.request(key, text)
+
+    def stop(self, timeout: float = 5.0):
+        if self._worker is not None:
+            self._queue.put(None)
+            self._worker.join(timeout)
+            self._worker = None
+
+    def scan(self):
+        """Membangun ulang daftar track dari isi subfolder cache."""
+        tracks = {}
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.startswith("."):
+                key, _ = os.path.splitext(entry.name)
+                tracks[key] = f"{AUDIO_CACHE_SUBDIR}/{entry.name}"
+        with self._lock:
+            self._tracks = tracks
+
+    # --- LOOKUP (JALUR REQUEST, NON-BLOCKING) ---
+
+    def get(self, key: str) -> Optional[str]:
+        return self._tracks.get(key)
+
+    def track(self, key: str, text: Optional[str] = None, fallback: Optional[str] = None) -> Optional[str]:
+        """
+        Mengembalikan nama file track yang SUDAH ADA untuk `key`. Jika belum ada, render
+        dijadwalkan di latar belakang dan track `fallback` (jika ada) dikembalikan.
+        """
+        filename = self._tracks.get(key)
+        if filename is not None:
+            return filename
+        if text is None:
+            text = FIXED_PROMPTS.get(key)
+        if text is not None:
+            self.request(key, text)
+        return self._tracks.get(fallback) if fallback else None
+
+    def intern_playlist(self, name: str, message: str) -> List[str]:
+        """
+        Playlist (nama file, berurutan) untuk pesan `message` milik intern `name`.
+        Klip yang belum ada dilewati (dan dijadwalkan render); jika tidak ada satu pun
+        klip yang tersedia, dipakai prompt fallback generik.
+        """
+        clips, fallback = INTERN_MESSAGES[message]
+        playlist = []
+        for clip in clips:
+            if clip is NAME:
+                filename = self.track(name_clip_key(name), name)
+            else:
+                filename = self.track(clip, PHRASE_CLIPS[clip])
+            if filename:
+                playlist.append(filename)
+        if not playlist:
+            filename = self.track(fallback)
+            if filename:
+                playlist.append(filename)
+        return playlist
+
+    # --- PRE-RENDER ---
+
+    def request(self, key: str, text: str):
+        """Mengantrekan render `key` jika belum ada di disk atau di antrean."""
+        with self._lock:
+            if key in self._tracks or key in self._pending:
+                return
+            self._pending.add(key)
+        self._queue.put((key, text))
+
+    def prerender_intern(self, name: str):
+        self.request(name_clip_key(name), name)
+
+    def prerender_interns(self, names: Iterable[str]):
+        """Mengantrekan klip nama semua intern dan membuang klip nama intern yang sudah tidak ada."""
+        names = list(names)
+        for name in names:
+            self.prerender_intern(name)
+        self.prune(keep_names=names)
+
+    def prune(self, keep_names: Iterable[str]) -> int:
+        """
+        Menghapus klip nama intern yang tidak ada di `keep_names`. Hanya subfolder cache
+        yang dipindai, jadi file audio di luar cache tidak pernah dihapus.
+        Mengembalikan jumlah file yang dihapus.
+        """
+        keep_keys = {name_clip_key(name) for name in keep_names}
+        removed = 0
+        for entry in os.scandir(self.directory):
+            if not entry.is_file() or entry.name.startswith("."):
+                continue
+            key, _ = os.path.splitext(entry.name)
+            if key.startswith("N_") and key not in keep_keys:
+                try:
+                    os.remove(entry.path)
+                    removed += 1
+                except OSError:
+                    continue
+                with self._lock:
+                    self._tracks.pop(key, None)
+        if removed:
+            print(f"🧹 [TTS] {removed} file audio usang dihapus.")
+        return removed
+
+    # --- WORKER ---
+
+    def _available_backends(self):
+        if self._backends is None:
+            self._backends = []
+            for backend_name in self.backend_names:
+                cls = TTS_BACKEND_CLASSES.get(backend_name)
+                if cls is None:
+                    print(f"⚠️ [TTS] Backend tidak dikenal: {backend_name}")
+                    continue
+                backend = cls()
+                if backend.available():
+                    self._backends.append(backend)
+            if not self._backends:
+                print("⚠️ [TTS] Tidak ada backend TTS yang tersedia. Audio tidak akan dirender.")
+        return self._backends
+
+    def _render_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            key, text = item
+            try:
+                filename = self._render(key, text)
+                with self._lock:
+                    if filename:
+                        self._tracks[key] = filename
+            finally:
+                with self._lock:
+                    self._pending.discard(key)
+
+    def _render(self, key: str, text: str) -> Optional[str]:
+        for backend in self._available_backends():
+            filename = f"{key}.{backend.extension}"
+            final_path = self.directory / filename
+            tmp_path = self.directory / f".{filename}.tmp"
+            try:
+                backend.render(text, tmp_path)
+                # Rename atomik: file baru terlihat oleh /audio hanya setelah lengkap
+                os.replace(tmp_path, final_path)
+                self._rendered += 1
+                print(f"   -> 🔊 [TTS/{backend.name}] {filename}: '{text}'")
+                return f"{AUDIO_CACHE_SUBDIR}/{filename}"
+            except Exception as e:
+                print(f"⚠️ [TTS/{backend.name}] Gagal render {filename}: {e}")
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+        self._failed += 1
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "tracks": len(self._tracks),
+            "pending": len(self._pending),
+            "rendered": self._rendered,
+            "failed": self._failed,
+            "backends": [b.name for b in (self._backends or [])],
+        }
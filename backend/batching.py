@@ -0,0 +1,131 @@
+import asyncio
+import os
+from collections import Counter
+from typing import Callable, List
+
+import numpy as np
+
+# --- KONFIGURASI MICRO-BATCHING (DIBACA DARI ENV) ---
+# Jumlah maksimum crop wajah dalam satu forward pass model
+MICROBATCH_MAX_SIZE = int(os.getenv("MICROBATCH_MAX_SIZE", "8"))
+# Lama maksimum (milidetik) menunggu request lain sebelum batch dijalankan
+MICROBATCH_MAX_WAIT_MS = float(os.getenv("MICROBATCH_MAX_WAIT_MS", "10"))
+
+
+class MicroBatcher:
+    """
+    Penjadwal micro-batching untuk forward pass model embedding.
+
+    Crop wajah dari request yang datang bersamaan dikumpulkan hingga `max_batch_size`
+    item atau `max_wait_ms` milidetik, dijalankan sebagai satu batch di pool inferensi,
+    lalu hasilnya dibagikan kembali ke masing-masing request yang menunggu.
+    """
+
+    def __init__(self, batch_fn: Callable, pool, max_batch_size: int = MICROBATCH_MAX_SIZE,
+                 max_wait_ms: float = MICROBATCH_MAX_WAIT_MS):
+        self.batch_fn = batch_fn
+        self.pool = pool
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue = None
+        self._worker_task = None
+        # Event loop hanya menyimpan weak reference ke task: batch yang berjalan dipegang di sini
+        self._pending = set()
+        # --- METRIK ---
+        self._batches = 0
+        self._items = 0
+        self._max_seen = 0
+        self._histogram = Counter()
+
+    def start(self):
+        """Memulai loop pengumpul batch. Harus dipanggil dari dalam event loop (startup)."""
+        if self._worker_task is None:
+            self._queue = asyncio.Queue()
+            self._worker_task = asyncio.create_task(self._collect_loop())
+
+    async def stop(self):
+        if self._worker_task is not None:
+            self._worker_task.cancel()
+            try:
+                await self._worker_task
+            except asyncio.CancelledError:
+                pass
+            self._worker_task = None
+
+    async def embed(self, faces: List[np.ndarray]) -> list:
+        """Mengirim crop wajah satu request ke batcher dan menunggu embedding-nya."""
+        if len(faces) == 0:
+            return []
+        if self._worker_task is None:
+            # Batcher belum aktif (misal di luar server): jalankan langsung di pool
+            return await self.pool.run(self.batch_fn, faces)
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((faces, future))
+        return await future
+
+    async def _collect_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            entry = await self._queue.get()
+            batch = [entry]
+            item_count = len(entry[0])
+            deadline = loop.time() + self.max_wait
+
+            while item_count < self.max_batch_size:
+                timeout = deadline - loop.time()
+                try:
+                    if timeout <= 0:
+                        entry = self._queue.get_nowait()
+                    else:
+                        entry = await asyncio.wait_for(self._queue.get(), timeout)
+                except (asyncio.TimeoutError, asyncio.QueueEmpty):
+                    break
+                batch.append(entry)
+                item_count += len(entry[0])
+
+            # Batch berikutnya boleh mulai dikumpulkan selagi batch ini berjalan
+            task = asyncio.create_task(self._execute(batch))
+            self._pending.add(task)
+            task.add_done_callback(self._execute_done)
+
+    def _execute_done(self, task: asyncio.Task):
+        self._pending.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"❌ [MicroBatcher] Eksekusi batch gagal: {task.exception()!r}")
+
+    async def _execute(self, batch):
+        faces = [face for entry_faces, _ in batch for face in entry_faces]
+        self._record(len(faces))
+        try:
+            embeddings = await self.pool.run(self.batch_fn, faces)
+            if len(embeddings) != len(faces):
+                raise RuntimeError(f"Jumlah embedding ({len(embeddings)}) tidak sama dengan jumlah wajah ({len(faces)}).")
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        offset = 0
+        for entry_faces, future in batch:
+            count = len(entry_faces)
+            if not future.done():
+                future.set_result(embeddings[offset:offset + count])
+            offset += count
+
+    def _record(self, batch_size: int):
+        self._batches += 1
+        self._items += batch_size
+        self._max_seen = max(self._max_seen, batch_size)
+        self._histogram[batch_size] += 1
+
+    def stats(self) -> dict:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "batches": self._batches,
+            "items": self._items,
+            "avg_batch_size": round(self._items / self._batches, 3) if self._batches else 0.0,
+            "max_batch_size_seen": self._max_seen,
+            "batch_size_histogram": {str(size): count for size, count in sorted(self._histogram.items())},
+        }
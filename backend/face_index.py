@@ -0,0 +1,351 @@
+import os
+import threading
+from typing import List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+try:
+    from backend.vector_codec import decode_vectors_binary, Vector
+    from backend.vector_index import apply_search_params
+except ImportError:
+    from .vector_codec import decode_vectors_binary, Vector
+    from .vector_index import apply_search_params
+
+# --- KONFIGURASI ---
+DB_TABLE_CENTROIDS = "intern_centroids"
+DB_TABLE_EMBEDDINGS = "intern_embeddings"
+
+# --- KONFIGURASI PENCOCOKAN (DIBACA DARI ENV) ---
+# 'centroid' = satu rata-rata per intern; 'prototype' = embedding per gambar / prototipe k-means + voting
+MATCH_MODE = os.getenv("MATCH_MODE", "centroid").lower()
+# Jumlah tetangga terdekat yang ikut voting
+MATCH_TOP_K = int(os.getenv("MATCH_TOP_K", "5"))
+# Minimal suara untuk pemenang (dibatasi jumlah prototipe milik intern tersebut)
+MATCH_MIN_VOTES = int(os.getenv("MATCH_MIN_VOTES", "2"))
+# Selisih jarak minimal antara pemenang dan intern terdekat berikutnya
+MATCH_MARGIN = float(os.getenv("MATCH_MARGIN", "0.05"))
+# Jumlah prototipe k-means per intern; 0 = pakai semua embedding per gambar
+MATCH_PROTOTYPES_PER_INTERN = int(os.getenv("MATCH_PROTOTYPES_PER_INTERN", "0"))
+
+
+class MatchResult(NamedTuple):
+    """Hasil pencocokan satu embedding terhadap indeks centroid."""
+    intern_id: int
+    name: str
+    instansi: str
+    kategori: str
+    distance: float
+    accepted: bool = True # False jika voting/margin menolak hasil (ambigu)
+
+
+def l2_normalize(vectors: np.ndarray) -> np.ndarray:
+    """Normalisasi L2 per baris (float32). Baris dengan norma ~0 dibiarkan apa adanya."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms < 1e-6] = 1.0
+    return vectors / norms
+
+
+class CentroidIndex:
+    """
+    Snapshot indeks centroid in-memory (read-only setelah dibuat).
+
+    Centroid disimpan sebagai matriks float32 kontigu yang sudah dinormalisasi L2,
+    ditambah array paralel untuk intern_id/name/instansi/kategori. Pencocokan menjadi
+    satu perkalian matriks-vektor + argmin, tanpa query ke database.
+    """
+
+    def __init__(self, intern_ids: Sequence[int], names: Sequence[str], instansi: Sequence[str],
+                 kategori: Sequence[str], matrix: np.ndarray):
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if matrix.ndim == 1:
+            matrix = matrix.reshape(len(intern_ids), -1)
+        self.matrix = np.ascontiguousarray(l2_normalize(matrix))
+        self.intern_ids = np.asarray(intern_ids, dtype=np.int64)
+        self.names = list(names)
+        self.instansi = list(instansi)
+        self.kategori = list(kategori)
+
+    @classmethod
+    def empty(cls, dim: int = 0) -> "CentroidIndex":
+        return cls([], [], [], [], np.zeros((0, dim), dtype=np.float32))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def search(self, embedding) -> Optional[MatchResult]:
+        """Mencari centroid terdekat (jarak kosinus, sama seperti operator <=> pgvector)."""
+        return self.search_many([embedding])[0]
+
+    def search_many(self, embeddings) -> List[Optional[MatchResult]]:
+        """Mencocokkan banyak embedding sekaligus (mode multi-wajah): satu perkalian matriks-matriks."""
+        if len(self) == 0:
+            return [None] * len(embeddings)
+        queries = l2_normalize(np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1))
+        distances = 1.0 - queries @ self.matrix.T
+        best = np.argmin(distances, axis=1)
+        return [
+            MatchResult(
+                int(self.intern_ids[b]),
+                self.names[b],
+                self.instansi[b],
+                self.kategori[b],
+                float(distances[row, b]),
+            )
+            for row, b in enumerate(best)
+        ]
+
+    def with_centroid(self, intern_id: int, name: str, instansi: str, kategori: str, centroid) -> "CentroidIndex":
+        """Snapshot baru dengan centroid satu intern diganti/ditambahkan (copy-on-write)."""
+        centroid = np.asarray(centroid, dtype=np.float32).reshape(1, -1)
+        positions = np.flatnonzero(self.intern_ids == intern_id)
+        if len(positions):
+            pos = int(positions[0])
+            matrix = self.matrix.copy()
+            matrix[pos] = centroid[0]
+            names, instansi_list, kategori_list = list(self.names), list(self.instansi), list(self.kategori)
+            names[pos], instansi_list[pos], kategori_list[pos] = name, instansi, kategori
+            return CentroidIndex(self.intern_ids, names, instansi_list, kategori_list, matrix)
+        matrix = np.vstack([self.matrix, centroid]) if len(self) else centroid
+        return CentroidIndex(np.append(self.intern_ids, intern_id), self.names + [name],
+                             self.instansi + [instansi], self.kategori + [kategori], matrix)
+
+
+def kmeans_prototypes(vectors: np.ndarray, k: int, iterations: int = 10) -> np.ndarray:
+    """
+    Spherical k-means sederhana (deterministik) untuk meringkas embedding satu intern
+    menjadi `k` prototipe ternormalisasi. Jika jumlah vektor <= k, vektor dikembalikan apa adanya.
+    """
+    vectors = l2_normalize(vectors)
+    if k <= 0 or len(vectors) <= k:
+        return vectors
+
+    # Inisialisasi farthest-point: mulai dari vektor terdekat ke rata-rata
+    mean = l2_normalize(vectors.mean(axis=0))
+    chosen = [int(np.argmax(vectors @ mean))]
+    closest = 1.0 - vectors @ vectors[chosen[0]]
+    for _ in range(1, k):
+        chosen.append(int(np.argmax(closest)))
+        closest = np.minimum(closest, 1.0 - vectors @ vectors[chosen[-1]])
+    centers = vectors[chosen]
+
+    for _ in range(iterations):
+        labels = np.argmax(vectors @ centers.T, axis=1)
+        new_centers = np.zeros_like(centers)
+        np.add.at(new_centers, labels, vectors)
+        empty = ~np.any(new_centers, axis=1)
+        new_centers[empty] = centers[empty] # Cluster kosong mempertahankan pusat lamanya
+        new_centers = l2_normalize(new_centers)
+        if np.allclose(new_centers, centers):
+            break
+        centers = new_centers
+    return centers
+
+
+class PrototypeIndex:
+    """
+    Snapshot indeks multi-prototipe in-memory (read-only setelah dibuat).
+
+    Setiap intern diwakili beberapa vektor (embedding per gambar atau prototipe k-means)
+    yang disimpan berurutan per intern dalam satu matriks float32. Pencarian tetap satu
+    perkalian matriks-vektor; pemenang ditentukan dengan voting top-k dan dicek margin
+    jaraknya terhadap intern terdekat berikutnya.
+    """
+
+    def __init__(self, intern_ids: Sequence[int], names: Sequence[str], instansi: Sequence[str],
+                 kategori: Sequence[str], counts: Sequence[int], matrix: np.ndarray,
+                 top_k: int = MATCH_TOP_K, min_votes: int = MATCH_MIN_VOTES, margin: float = MATCH_MARGIN):
+        self.matrix = np.ascontiguousarray(l2_normalize(matrix))
+        self.intern_ids = np.asarray(intern_ids, dtype=np.int64)
+        self.names = list(names)
+        self.instansi = list(instansi)
+        self.kategori = list(kategori)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        # owner[i] = indeks intern pemilik baris ke-i; starts = baris awal tiap intern
+        self.owner = np.repeat(np.arange(len(self.counts)), self.counts)
+        self.starts = np.concatenate(([0], np.cumsum(self.counts)[:-1])).astype(np.int64) if len(self.counts) else self.counts
+        self.top_k = max(1, top_k)
+        self.min_votes = max(1, min_votes)
+        self.margin = max(0.0, margin)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def with_embedding(self, intern_id: int, name: str, instansi: str, kategori: str, embedding) -> "PrototypeIndex":
+        """Snapshot baru dengan satu embedding per gambar ditambahkan ke blok intern (copy-on-write)."""
+        vector = np.asarray(embedding, dtype=np.float32).reshape(1, -1)
+        positions = np.flatnonzero(self.intern_ids == intern_id)
+        names, instansi_list, kategori_list = list(self.names), list(self.instansi), list(self.kategori)
+        counts, intern_ids = self.counts.copy(), self.intern_ids
+        if len(positions):
+            pos = int(positions[0])
+            insert_at = int(self.starts[pos] + self.counts[pos])
+            counts[pos] += 1
+            names[pos], instansi_list[pos], kategori_list[pos] = name, instansi, kategori
+        else:
+            insert_at = self.matrix.shape[0]
+            intern_ids = np.append(intern_ids, intern_id)
+            counts = np.append(counts, 1)
+            names.append(name)
+            instansi_list.append(instansi)
+            kategori_list.append(kategori)
+        matrix = np.insert(self.matrix, insert_at, vector[0], axis=0) if self.matrix.size else vector
+        return PrototypeIndex(intern_ids, names, instansi_list, kategori_list, counts, matrix,
+                              top_k=self.top_k, min_votes=self.min_votes, margin=self.margin)
+
+    def search(self, embedding) -> Optional[MatchResult]:
+        """Voting top-k atas semua prototipe + cek margin ke intern terdekat berikutnya."""
+        return self.search_many([embedding])[0]
+
+    def search_many(self, embeddings) -> List[Optional[MatchResult]]:
+        """Seperti `search` untuk banyak embedding sekaligus: jarak dihitung dalam satu perkalian matriks."""
+        if len(self) == 0:
+            return [None] * len(embeddings)
+        queries = l2_normalize(np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1))
+        distances = 1.0 - queries @ self.matrix.T
+
+        # Jarak terbaik per intern (kolom sudah dikelompokkan per intern)
+        best_per_intern = np.minimum.reduceat(distances, self.starts, axis=1)
+
+        k = min(self.top_k, distances.shape[1])
+        neighbours = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        votes = np.zeros((len(queries), len(self)), dtype=np.int64)
+        np.add.at(votes, (np.arange(len(queries))[:, None], self.owner[neighbours]), 1)
+        return [self._decide(best_per_intern[row], votes[row], k) for row in range(len(queries))]
+
+    def _decide(self, best_per_intern: np.ndarray, votes: np.ndarray, k: int) -> MatchResult:
+        # Suara terbanyak menang; seri diputuskan oleh jarak terdekat
+        candidates = np.flatnonzero(votes == votes.max())
+        winner = int(candidates[np.argmin(best_per_intern[candidates])])
+        distance = float(best_per_intern[winner])
+
+        required_votes = min(self.min_votes, int(self.counts[winner]), k)
+        accepted = votes[winner] >= required_votes
+        if accepted and len(self) > 1:
+            runner_up = float(np.min(np.delete(best_per_intern, winner)))
+            accepted = (runner_up - distance) >= self.margin
+
+        return MatchResult(
+            int(self.intern_ids[winner]),
+            self.names[winner],
+            self.instansi[winner],
+            self.kategori[winner],
+            distance,
+            bool(accepted),
+        )
+
+
+# --- SNAPSHOT AKTIF (DITUKAR SECARA ATOMIK) ---
+_current_index = CentroidIndex.empty()
+_reload_lock = threading.Lock()
+
+
+def get_match_index():
+    """Mengembalikan snapshot indeks aktif. Pembacaan referensi bersifat atomik."""
+    return _current_index
+
+
+def load_centroid_index(conn) -> CentroidIndex:
+    """Membaca seluruh centroid dari database dan membangun snapshot indeks baru."""
+    with conn.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT intern_id, name, instansi, kategori, vector_send(embedding)
+            FROM {DB_TABLE_CENTROIDS}
+            ORDER BY intern_id
+        """)
+        rows = cursor.fetchall()
+
+    if not rows:
+        return CentroidIndex.empty()
+
+    intern_ids, names, instansi, kategori, vectors = zip(*rows)
+    matrix = decode_vectors_binary(vectors) # Format biner pgvector -> float32 tanpa parsing teks
+    return CentroidIndex(intern_ids, names, instansi, kategori, matrix)
+
+
+def load_prototype_index(conn, prototypes_per_intern: int = MATCH_PROTOTYPES_PER_INTERN) -> PrototypeIndex:
+    """Membaca semua embedding per gambar (satu query) dan membangun indeks multi-prototipe."""
+    with conn.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT intern_id, name, instansi, kategori, vector_send(embedding)
+            FROM {DB_TABLE_EMBEDDINGS}
+            ORDER BY intern_id
+        """)
+        rows = cursor.fetchall()
+
+    if not rows:
+        return PrototypeIndex([], [], [], [], [], np.zeros((0, 0), dtype=np.float32))
+
+    matrix = decode_vectors_binary([row[4] for row in rows])
+    ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+    ends = np.r_[starts[1:], len(rows)]
+
+    intern_ids, names, instansi, kategori, counts, blocks = [], [], [], [], [], []
+    for start, end in zip(starts, ends):
+        intern_id, name, inst, kat, _ = rows[start]
+        block = kmeans_prototypes(matrix[start:end], prototypes_per_intern)
+        intern_ids.append(intern_id)
+        names.append(name)
+        instansi.append(inst)
+        kategori.append(kat)
+        counts.append(len(block))
+        blocks.append(block)
+    return PrototypeIndex(intern_ids, names, instansi, kategori, counts, np.vstack(blocks))
+
+
+def load_match_index(conn, mode: str = MATCH_MODE):
+    """Membangun indeks sesuai MATCH_MODE ('centroid' atau 'prototype')."""
+    if mode == "prototype":
+        return load_prototype_index(conn)
+    return load_centroid_index(conn)
+
+
+def reload_match_index(conn):
+    """Memuat ulang indeks dari database lalu menukarnya dengan snapshot aktif."""
+    global _current_index
+    with _reload_lock:
+        new_index = load_match_index(conn)
+        _current_index = new_index
+    print(f"✅ [FaceIndex] Indeks {type(new_index).__name__} ({MATCH_MODE}) dimuat: {len(new_index)} wajah.")
+    return new_index
+
+
+def search_centroids_db(conn, embeddings) -> List[Optional[MatchResult]]:
+    """
+    Fallback pencocokan di DB saat snapshot in-memory belum termuat (misal gagal saat
+    startup): centroid terdekat per embedding lewat indeks ANN kosinus (<=>, lihat
+    vector_index.py) dengan parameter pencarian SET LOCAL. Harus dalam transaksi.
+    """
+    results = []
+    with conn.cursor() as cursor:
+        apply_search_params(cursor, local=True)
+        for embedding in embeddings:
+            query = Vector(l2_normalize(embedding).ravel())
+            cursor.execute(f"""
+                SELECT intern_id, name, instansi, kategori, embedding <=> %s::vector
+                FROM {DB_TABLE_CENTROIDS}
+                ORDER BY embedding <=> %s::vector
+                LIMIT 1
+            """, (query, query))
+            row = cursor.fetchone()
+            results.append(MatchResult(row[0], row[1], row[2], row[3], float(row[4])) if row else None)
+    return results
+
+
+def update_match_index(intern_id: int, name: str, instansi: str, kategori: str, centroid, embedding) -> bool:
+    """
+    Menerapkan satu embedding baru (index-on-upload) ke snapshot aktif tanpa membaca DB.
+    Mode centroid mengganti baris centroid intern; mode prototype tanpa k-means menambah
+    satu baris. Mengembalikan False jika indeks perlu dimuat ulang penuh (prototipe k-means).
+    """
+    global _current_index
+    with _reload_lock:
+        index = _current_index
+        if isinstance(index, CentroidIndex):
+            _current_index = index.with_centroid(intern_id, name, instansi, kategori, centroid)
+        elif isinstance(index, PrototypeIndex) and MATCH_PROTOTYPES_PER_INTERN <= 0:
+            _current_index = index.with_embedding(intern_id, name, instansi, kategori, embedding)
+        else:
+            return False
+    return True
@@ -0,0 +1,243 @@
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# --- KONFIGURASI PENULISAN GAMBAR (DIBACA DARI ENV) ---
+# Jumlah gambar maksimum per batch tulis (satu fsync direktori per batch)
+IMAGE_WRITE_BATCH_SIZE = int(os.getenv("IMAGE_WRITE_BATCH_SIZE", "16"))
+# Lama maksimum (milidetik) menunggu gambar lain sebelum batch ditulis
+IMAGE_WRITE_FLUSH_MS = float(os.getenv("IMAGE_WRITE_FLUSH_MS", "200"))
+# Jumlah percobaan ulang jika penulisan gagal
+IMAGE_WRITE_RETRIES = int(os.getenv("IMAGE_WRITE_RETRIES", "3"))
+# Kapasitas antrean (menahan memori); jika penuh, pemanggil menunggu (backpressure)
+IMAGE_QUEUE_SIZE = int(os.getenv("IMAGE_QUEUE_SIZE", "256"))
+
+# --- KONFIGURASI ENCODING GAMBAR ---
+# Kualitas JPEG dan sisi terpanjang (piksel) untuk gambar absensi yang disimpan
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+IMAGE_MAX_DIM = int(os.getenv("IMAGE_MAX_DIM", "1280"))
+# Thumbnail untuk halaman data
+THUMB_JPEG_QUALITY = int(os.getenv("THUMB_JPEG_QUALITY", "70"))
+THUMB_MAX_DIM = int(os.getenv("THUMB_MAX_DIM", "160"))
+# Subfolder thumbnail (di dalam folder gambar, dengan layout YYYY/MM/DD yang sama)
+THUMB_DIR_NAME = "thumbs"
+
+
+def sharded_path(filename: str, when: datetime) -> str:
+    """Path relatif ber-shard tanggal: 'YYYY/MM/DD/<filename>'."""
+    return f"{when:%Y/%m/%d}/{filename}"
+
+
+def thumbnail_path(relative_path: str) -> str:
+    return f"{THUMB_DIR_NAME}/{relative_path}"
+
+
+def _resize_max(image: np.ndarray, max_dim: int) -> np.ndarray:
+    height, width = image.shape[:2]
+    scale = max_dim / float(max(height, width))
+    if max_dim <= 0 or scale >= 1.0:
+        return image
+    size = (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+
+def encode_capture(data: bytes, image: Optional[np.ndarray] = None) -> Tuple[bytes, Optional[bytes]]:
+    """
+    Re-encode gambar absensi (JPEG, kualitas & dimensi maksimum terkonfigurasi) dan
+    membuat thumbnail-nya. Jika `image` (hasil decode jalur /recognize) diberikan, byte
+    tidak di-decode ulang. Jika gambar tidak bisa di-decode, byte asli disimpan apa
+    adanya tanpa thumbnail.
+    """
+    if image is None:
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        return data, None
+    ok, full = cv2.imencode(".jpg", _resize_max(image, IMAGE_MAX_DIM), [cv2.IMWRITE_JPEG_QUALITY, IMAGE_JPEG_QUALITY])
+    ok_thumb, thumb = cv2.imencode(".jpg", _resize_max(image, THUMB_MAX_DIM), [cv2.IMWRITE_JPEG_QUALITY, THUMB_JPEG_QUALITY])
+    full_bytes = full.tobytes() if ok else data
+    # Re-encode tidak boleh membuat file lebih besar dari aslinya
+    if len(full_bytes) > len(data):
+        full_bytes = data
+    return full_bytes, (thumb.tobytes() if ok_thumb else None)
+
+
+class ImageWrite(NamedTuple):
+    relative_path: str
+    data: bytes
+    attempt: int = 0
+    image: Optional[np.ndarray] = None # Array BGR yang sudah di-decode (opsional)
+
+
+class ImageWriteQueue:
+    """
+    Antrean persistensi gambar absensi di luar jalur request.
+
+    `submit` langsung mengembalikan URL gambar; satu worker thread mengumpulkan gambar
+    menjadi batch, me-re-encode + membuat thumbnail, menulisnya ke file sementara,
+    fsync, rename atomik, lalu fsync direktori sekali per batch. Penulisan yang gagal
+    dicoba ulang dengan jeda, dan `drain` dipanggil saat shutdown agar tidak ada
+    gambar yang hilang.
+    """
+
+    def __init__(self, directory: Path, url_prefix: str = "/images",
+                 batch_size: int = IMAGE_WRITE_BATCH_SIZE, flush_ms: float = IMAGE_WRITE_FLUSH_MS,
+                 retries: int = IMAGE_WRITE_RETRIES, queue_size: int = IMAGE_QUEUE_SIZE):
+        self.directory = Path(directory)
+        self.url_prefix = url_prefix.rstrip("/")
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(0.0, flush_ms) / 1000.0
+        self.retries = max(0, retries)
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max(1, queue_size))
+        self._worker = None
+        self._written = 0
+        self._failed = 0
+        self._retried = 0
+        self._batches = 0
+
+    # --- SIKLUS HIDUP ---
+
+    def start(self):
+        if self._worker is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._worker = threading.Thread(target=self._write_loop, name="image-writer", daemon=True)
+            self._worker.start()
+
+    def drain(self, timeout: float = 30.0):
+        """Menunggu semua gambar di antrean tertulis, lalu menghentikan worker (hook shutdown)."""
+        if self._worker is None:
+            return
+        self._queue.put(None)
+        self._worker.join(timeout)
+        if self._worker.is_alive():
+            print(f"⚠️ [ImageStore] Drain timeout, ~{self._queue.qsize()} gambar belum tertulis.")
+        self._worker = None
+
+    # --- JALUR REQUEST ---
+
+    def url_for(self, relative_path: str) -> str:
+        return f"{self.url_prefix}/{relative_path}"
+
+    def thumbnail_url_for(self, image_url: str) -> Optional[str]:
+        """URL thumbnail untuk URL gambar ber-shard; None untuk gambar lama (layout datar)."""
+        prefix = self.url_prefix + "/"
+        if not image_url or not image_url.startswith(prefix):
+            return None
+        relative_path = image_url[len(prefix):]
+        if relative_path.count("/") < 3: # Bukan YYYY/MM/DD/<file>
+            return None
+        return self.url_for(thumbnail_path(relative_path))
+
+    def submit(self, relative_path: str, data: bytes, image: Optional[np.ndarray] = None) -> str:
+        """
+        Mengantrekan gambar untuk ditulis dan langsung mengembalikan URL-nya. `image`
+        (opsional) adalah array yang sudah di-decode agar worker tidak men-decode ulang.
+        """
+        item = ImageWrite(relative_path, data, image=image)
+        if self._worker is None:
+            # Worker belum aktif (misal di luar server): tulis langsung
+            self._write_with_retry(self._encode_batch([item]))
+        else:
+            self._queue.put(item)
+        return self.url_for(relative_path)
+
+    # --- WORKER ---
+
+    def _write_loop(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._write_with_retry(self._encode_batch(batch))
+
+    def _encode_batch(self, batch: List[ImageWrite]) -> List[ImageWrite]:
+        """Gambar mentah -> daftar file yang ditulis (gambar ter-encode + thumbnail)."""
+        writes = []
+        for item in batch:
+            try:
+                full, thumb = encode_capture(item.data, item.image)
+            except Exception as e:
+                print(f"⚠️ [ImageStore] Re-encode gagal untuk {item.relative_path}, simpan asli: {e}")
+                full, thumb = item.data, None
+            writes.append(ImageWrite(item.relative_path, full))
+            if thumb is not None:
+                writes.append(ImageWrite(thumbnail_path(item.relative_path), thumb))
+        return writes
+
+    def _write_with_retry(self, batch: List[ImageWrite]):
+        failed = self._write_batch(batch)
+        while failed:
+            retry = [ImageWrite(w.relative_path, w.data, w.attempt + 1) for w in failed if w.attempt < self.retries]
+            for w in failed:
+                if w.attempt >= self.retries:
+                    self._failed += 1
+                    print(f"❌ [ImageStore] Gagal menyimpan {w.relative_path} setelah {w.attempt + 1} percobaan.")
+            if not retry:
+                return
+            self._retried += len(retry)
+            time.sleep(0.1 * (2 ** retry[0].attempt)) # Backoff eksponensial singkat
+            failed = self._write_batch(retry)
+
+    def _write_batch(self, batch: List[ImageWrite]) -> List[ImageWrite]:
+        """Menulis satu batch; mengembalikan item yang gagal."""
+        failed = []
+        directories = set()
+        for write in batch:
+            final_path = self.directory / write.relative_path
+            tmp_path = final_path.with_name(f".{final_path.name}.tmp")
+            try:
+                os.makedirs(final_path.parent, exist_ok=True)
+                with open(tmp_path, "wb") as f:
+                    f.write(write.data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, final_path)
+                directories.add(final_path.parent)
+                self._written += 1
+            except Exception as e:
+                print(f"⚠️ [ImageStore] Gagal menulis {write.relative_path} (percobaan {write.attempt + 1}): {e}")
+                failed.append(write)
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+        # Satu fsync per direktori per batch agar rename ikut persisten
+        for directory in directories:
+            try:
+                fd = os.open(directory, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            except OSError:
+                pass
+        self._batches += 1
+        return failed
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "written": self._written,
+            "failed": self._failed,
+            "retried": self._retried,
+            "batches": self._batches,
+        }
@@ -1,11 +1,19 @@
 import os
 import csv
 import sys
+import time
+import hashlib
+import argparse
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
-from deepface import DeepFace
+from typing import Any, Callable, ContextManager, Iterable, Iterator, List, NamedTuple, Optional, Tuple
 import numpy as np
 import psycopg2
 import psycopg2.extensions
+import psycopg2.extras
 
 # --- KONFIGURASI DAN IMPORT DENGAN KOREKSI PATH ---
 try:
@@ -18,10 +26,10 @@ try:
 
     # Coba import absolut dulu
     try:
-         from backend.utils import MODEL_NAME, EMBEDDING_DIM
+         from backend.utils import MODEL_NAME, EMBEDDING_DIM, detect_faces, embed_faces
     except ImportError:
          # Fallback ke import relatif jika dijalankan sebagai modul
-         from .utils import MODEL_NAME, EMBEDDING_DIM
+         from .utils import MODEL_NAME, EMBEDDING_DIM, detect_faces, embed_faces
 
 except ImportError as e:
     print(f"❌ FATAL ERROR: Gagal mengimpor utilitas atau menentukan root: {e}")
@@ -29,9 +37,22 @@ except ImportError as e:
     EMBEDDING_DIM = 512
     print(f"   -> Menggunakan fallback: MODEL_NAME='{MODEL_NAME}', EMBEDDING_DIM={EMBEDDING_DIM}")
 
+# Codec vektor bersama (pgvector <-> NumPy float32)
+try:
+    from backend.vector_codec import register_vector, lookup_vector_oid, decode_vectors_binary, copy_rows_binary, Vector
+except ImportError:
+    from .vector_codec import register_vector, lookup_vector_oid, decode_vectors_binary, copy_rows_binary, Vector
+
+try:
+    from backend.vector_index import rebuild_vector_indexes, VECTOR_INDEX_TYPE
+except ImportError:
+    from .vector_index import rebuild_vector_indexes, VECTOR_INDEX_TYPE
+
 # --- KONFIGURASI PROYEK ---
 CSV_MASTER_PATH = PROJECT_ROOT / "interns.csv"
 DATASET_PATH = PROJECT_ROOT / "data" / "dataset"
+# Ekstensi gambar yang dipindai indexer (juga satu-satunya yang diterima /upload_dataset)
+DATASET_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
 
 # --- KONFIGURASI DATABASE VEKTOR (MEMBACA DARI ENV) ---
 DB_HOST = os.getenv("DB_HOST", "localhost")
@@ -44,6 +65,23 @@ DB_PASSWORD = os.getenv("DB_PASSWORD", "deepfacepass")
 DB_TABLE_INTERNS = "interns"
 DB_TABLE_EMBEDDINGS = "intern_embeddings"
 DB_TABLE_CENTROIDS = "intern_centroids"
+DB_TABLE_MANIFEST = "dataset_manifest"
+
+# --- KONFIGURASI ENGINE INDEXING PARALEL ---
+# Jumlah proses deteksi wajah (tiap proses memuat detektornya sendiri)
+INDEX_WORKERS = int(os.getenv("INDEX_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+# Jumlah crop wajah per forward pass model embedding + per bulk insert
+INDEX_BATCH_SIZE = int(os.getenv("INDEX_BATCH_SIZE", "32"))
+# Detektor yang lebih akurat (tapi lebih lambat) untuk data referensi
+INDEX_DETECTOR_BACKEND = "retinaface"
+
+
+class IndexingError(Exception):
+    """Indexing tidak bisa dilanjutkan (DB, CSV master, atau folder dataset bermasalah)."""
+
+
+class IndexingCancelled(IndexingError):
+    """Indexing dihentikan atas permintaan (job dibatalkan)."""
 
 
 # --- FUNGSI UTILITY DATABASE ---
@@ -59,19 +97,7 @@ def connect_db():
             port=DB_PORT
         )
         try:
-            with conn.cursor() as cur:
-                cur.execute("SELECT oid FROM pg_type WHERE typname = 'vector'")
-                vector_oid = cur.fetchone()[0]
-
-            def cast_vector(data, cur):
-                if data is None: return None
-                cleaned_data = data.strip('{}[]')
-                return np.array([float(x.strip()) for x in cleaned_data.split(',')])
-
-            psycopg2.extensions.register_type(
-                psycopg2.extensions.new_type((vector_oid,), 'vector', cast_vector),
-                conn
-            )
+            register_vector(conn, lookup_vector_oid(conn))
         except Exception as e:
              print(f"   ⚠️ PERINGATAN: Gagal mendaftarkan tipe vector. Error: {e}")
 
@@ -79,29 +105,32 @@ def connect_db():
     except psycopg2.Error as e:
         print(f"❌ ERROR: Gagal koneksi ke Database: {e}")
         print(f"   -> Mencoba terhubung ke {DB_HOST}:{DB_PORT}...")
-        sys.exit(1) # Gagal keras agar subprocess mengembalikan error
+        raise IndexingError(f"Gagal koneksi ke Database: {e}")
 
-def upsert_intern_and_get_id(conn, name: str, instansi: str, kategori: str) -> int:
-    """Memastikan data intern ada di tabel 'interns' dan mengembalikan ID-nya (UPSERT)."""
+def upsert_interns(conn, interns: List[Tuple[str, str, str]]) -> dict:
+    """Memastikan semua intern ada di tabel 'interns' (satu UPSERT massal). Mengembalikan {name: id}."""
+    if not interns:
+        return {}
     cur = conn.cursor()
     try:
-        cur.execute(
+        rows = psycopg2.extras.execute_values(
+            cur,
             f"""
             INSERT INTO {DB_TABLE_INTERNS} (name, instansi, kategori)
-            VALUES (%s, %s, %s)
+            VALUES %s
             ON CONFLICT (name) DO UPDATE SET
                 instansi = EXCLUDED.instansi,
                 kategori = EXCLUDED.kategori
-            RETURNING id;
+            RETURNING id, name;
             """,
-            (name, instansi, kategori)
+            interns,
+            fetch=True
         )
-        intern_id = cur.fetchone()[0]
         conn.commit() # Commit setelah UPSERT berhasil
-        return intern_id
+        return {name: intern_id for intern_id, name in rows}
     except Exception as e:
         conn.rollback() # Rollback jika gagal
-        raise Exception(f"Gagal melakukan UPSERT intern {name}: {e}")
+        raise Exception(f"Gagal melakukan UPSERT intern: {e}")
     finally:
         cur.close()
 
@@ -111,7 +140,7 @@ def load_master_data():
     if not CSV_MASTER_PATH.exists():
          print(f"❌ ERROR: File Master CSV tidak ditemukan di: {CSV_MASTER_PATH}")
          print("   -> Pastikan file interns.csv ada di root proyek.")
-         sys.exit(1)
+         raise IndexingError(f"File Master CSV tidak ditemukan: {CSV_MASTER_PATH}")
     try:
         with open(CSV_MASTER_PATH, mode='r', encoding='utf-8') as file:
             reader = csv.DictReader(file)
@@ -126,219 +155,757 @@ def load_master_data():
         return master_data
     except Exception as e:
         print(f"❌ ERROR: Gagal memproses CSV: {e}")
-        sys.exit(1)
+        raise IndexingError(f"Gagal memproses CSV: {e}")
+
+def ensure_manifest_schema(conn):
+    """
+    Membuat tabel manifest dataset, kolom content_hash & kolom running sum centroid jika
+    belum ada (idempoten). Pada skema yang sudah lengkap hanya membaca katalog.
+    """
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {DB_TABLE_MANIFEST} (
+                file_path TEXT PRIMARY KEY,
+                intern_id INTEGER REFERENCES {DB_TABLE_INTERNS}(id) ON DELETE CASCADE,
+                file_size BIGINT NOT NULL,
+                mtime_ns BIGINT NOT NULL,
+                content_hash TEXT NOT NULL
+            );
+        """)
+        # ALTER TABLE / CREATE INDEX mengunci tabel vektor (memblokir lookup) walau objeknya
+        # sudah ada, jadi katalog dicek dulu dan DDL hanya dijalankan untuk yang belum ada
+        cur.execute("""
+            SELECT table_name, column_name FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = ANY(%s)
+        """, ([DB_TABLE_EMBEDDINGS, DB_TABLE_CENTROIDS],))
+        columns = set(cur.fetchall())
+        cur.execute("SELECT to_regclass('idx_embeddings_content_hash') IS NOT NULL")
+        has_hash_index = cur.fetchone()[0]
+
+        if (DB_TABLE_EMBEDDINGS, "content_hash") not in columns:
+            cur.execute(f"ALTER TABLE {DB_TABLE_EMBEDDINGS} ADD COLUMN IF NOT EXISTS content_hash TEXT;")
+        if not has_hash_index:
+            cur.execute(f"CREATE INDEX IF NOT EXISTS idx_embeddings_content_hash ON {DB_TABLE_EMBEDDINGS} (content_hash);")
+        if (DB_TABLE_CENTROIDS, "embedding_sum") not in columns:
+            cur.execute(f"ALTER TABLE {DB_TABLE_CENTROIDS} ADD COLUMN IF NOT EXISTS embedding_sum vector({EMBEDDING_DIM});")
+        if (DB_TABLE_CENTROIDS, "embedding_count") not in columns:
+            cur.execute(f"ALTER TABLE {DB_TABLE_CENTROIDS} ADD COLUMN IF NOT EXISTS embedding_count INTEGER NOT NULL DEFAULT 0;")
+    conn.commit()
+
+
+# --- MANIFEST & DETEKSI PERUBAHAN ---
+
+class DatasetFile(NamedTuple):
+    """Satu file gambar di disk beserta metadata stat-nya."""
+    folder: str
+    relative_path: str
+    absolute_path: str
+    size: int
+    mtime_ns: int
+
+
+def hash_file(absolute_path: str) -> str:
+    """SHA-256 isi file (dibaca per blok 1 MB)."""
+    digest = hashlib.sha256()
+    with open(absolute_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def scan_dataset() -> List[DatasetFile]:
+    """Memindai semua gambar di DATASET_PATH hanya dengan stat (tanpa membaca isi file)."""
+    files = []
+    with os.scandir(DATASET_PATH) as folders:
+        for folder in folders:
+            if not folder.is_dir() or folder.name.startswith('.'):
+                continue
+            with os.scandir(folder.path) as entries:
+                for entry in entries:
+                    if not entry.is_file() or not entry.name.lower().endswith(DATASET_IMAGE_EXTENSIONS):
+                        continue
+                    stat = entry.stat()
+                    # Gunakan path relatif dari PROJECT_ROOT untuk konsistensi
+                    relative_filepath = f"data/dataset/{folder.name}/{entry.name}"
+                    files.append(DatasetFile(folder.name, relative_filepath, entry.path, stat.st_size, stat.st_mtime_ns))
+    files.sort(key=lambda f: f.relative_path)
+    return files
+
+
+def load_manifest(conn) -> dict:
+    """{file_path: (intern_id, file_size, mtime_ns, content_hash)} dari tabel manifest."""
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT file_path, intern_id, file_size, mtime_ns, content_hash FROM {DB_TABLE_MANIFEST}")
+        return {row[0]: row[1:] for row in cur.fetchall()}
+
+
+def load_indexed_files(conn) -> dict:
+    """{file_path: (intern_id, content_hash)} untuk semua embedding yang tersimpan (tanpa vektor)."""
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT file_path, intern_id, content_hash FROM {DB_TABLE_EMBEDDINGS}")
+        return {row[0]: row[1:] for row in cur.fetchall()}
+
+
+class IndexPlan:
+    """Hasil diff antara isi dataset di disk dan manifest di DB."""
+
+    def __init__(self):
+        self.to_embed = []           # IndexJob: konten baru, perlu DeepFace
+        self.to_copy = []            # IndexJob: konten sudah pernah di-embed (rename/duplikat), salin vektor
+        self.stale_paths = []        # file_path yang embedding-nya harus dihapus (file hilang/berubah)
+        self.removed_paths = []      # file_path yang dihapus dari manifest (file hilang)
+        self.manifest_rows = []      # (file_path, intern_id, size, mtime_ns, hash) untuk file tanpa embedding baru
+        self.hash_backfill = []      # (content_hash, file_path) untuk embedding lama tanpa hash
+        self.affected_interns = set()
+        self.unchanged = 0
+
+    def has_changes(self) -> bool:
+        return bool(self.to_embed or self.to_copy or self.stale_paths or self.removed_paths
+                    or self.manifest_rows or self.hash_backfill)
+
+
+def plan_index_changes(conn, files: List[DatasetFile], master_data: dict, intern_ids: dict) -> IndexPlan:
+    """
+    Membandingkan file di disk dengan manifest (path, size, mtime, hash):
+      - size & mtime sama          -> dilewati tanpa membaca file
+      - hash sama, mtime berubah   -> hanya manifest yang diperbarui
+      - hash pernah di-embed       -> vektor disalin (rename / foto duplikat)
+      - hash baru                  -> di-embed ulang
+      - file hilang dari disk      -> embedding & manifest dihapus
+    """
+    plan = IndexPlan()
+    manifest = load_manifest(conn)
+    indexed = load_indexed_files(conn)
+    known_hashes = {content_hash for _, content_hash in indexed.values() if content_hash}
+    disk_paths = set()
+
+    for f in files:
+        disk_paths.add(f.relative_path)
+        metadata = master_data.get(f.folder)
+        if metadata is None:
+            continue # Folder tidak ada di CSV: tidak di-index, tapi juga tidak dihapus
+        intern_id = intern_ids[metadata['name_full']]
+
+        entry = manifest.get(f.relative_path)
+        if entry is not None and entry[1] == f.size and entry[2] == f.mtime_ns:
+            plan.unchanged += 1
+            continue
 
-def get_existing_file_paths(conn, intern_id: int) -> set:
-    """Mengambil semua path file yang sudah di-index untuk intern tertentu."""
-    cur = conn.cursor()
-    try:
-        cur.execute(f"SELECT file_path FROM {DB_TABLE_EMBEDDINGS} WHERE intern_id = %s", (intern_id,))
-        return {row[0] for row in cur.fetchall()}
-    finally:
-        cur.close()
+        content_hash = hash_file(f.absolute_path)
+        job = IndexJob(intern_id, metadata['name_full'], metadata['instansi'], metadata['kategori'],
+                       f.relative_path, f.absolute_path, content_hash, f.size, f.mtime_ns)
+        indexed_entry = indexed.get(f.relative_path)
+
+        if indexed_entry is not None and (indexed_entry[1] in (None, content_hash)) and (entry is None or entry[3] == content_hash):
+            # Konten tidak berubah (hanya mtime), atau embedding lama belum punya manifest
+            plan.manifest_rows.append((f.relative_path, intern_id, f.size, f.mtime_ns, content_hash))
+            if indexed_entry[1] is None:
+                plan.hash_backfill.append((content_hash, f.relative_path))
+            plan.unchanged += 1
+            continue
 
+        if indexed_entry is not None:
+            # Konten berubah: embedding lama untuk path ini dibuang
+            plan.stale_paths.append(f.relative_path)
+            plan.affected_interns.add(indexed_entry[0])
 
-# --- FUNGSI UTAMA (INCREMENTAL INDEXING) ---
+        plan.affected_interns.add(intern_id)
+        if content_hash in known_hashes:
+            plan.to_copy.append(job)
+        else:
+            plan.to_embed.append(job)
+            known_hashes.add(content_hash) # Duplikat berikutnya dalam run ini cukup disalin
 
-def index_data_incremental():
-    conn = connect_db()
-    cur = conn.cursor()
+    for path, (intern_id, _) in indexed.items():
+        if path not in disk_paths:
+            plan.stale_paths.append(path)
+            plan.affected_interns.add(intern_id)
+    plan.removed_paths = [path for path in manifest if path not in disk_paths]
+    return plan
 
-    try:
-        master_data = load_master_data()
-    except SystemExit:
-        conn.close()
+
+def upsert_manifest_rows(cur, rows: List[Tuple]):
+    if not rows:
         return
+    psycopg2.extras.execute_values(
+        cur,
+        f"""
+        INSERT INTO {DB_TABLE_MANIFEST} (file_path, intern_id, file_size, mtime_ns, content_hash)
+        VALUES %s
+        ON CONFLICT (file_path) DO UPDATE SET
+            intern_id = EXCLUDED.intern_id,
+            file_size = EXCLUDED.file_size,
+            mtime_ns = EXCLUDED.mtime_ns,
+            content_hash = EXCLUDED.content_hash
+        """,
+        rows
+    )
+
+
+def copy_known_embeddings(cur, jobs: List["IndexJob"]) -> Tuple[List["IndexJob"], List["IndexJob"]]:
+    """
+    Menyalin vektor dari embedding lain dengan content_hash yang sama, lalu mencatat
+    manifest HANYA untuk file yang benar-benar tersalin.
+
+    Returns:
+        Tuple[list, list]: (job tersalin, job tanpa sumber salinan).
+    """
+    copied, missing = [], []
+    for job in jobs:
+        cur.execute(f"""
+            INSERT INTO {DB_TABLE_EMBEDDINGS} (intern_id, name, instansi, kategori, file_path, embedding, content_hash)
+            SELECT %s, %s, %s, %s, %s, embedding, content_hash
+            FROM {DB_TABLE_EMBEDDINGS}
+            WHERE content_hash = %s AND file_path <> %s
+            LIMIT 1
+        """, (job.intern_id, job.name, job.instansi, job.kategori, job.relative_path, job.content_hash, job.relative_path))
+        (copied if cur.rowcount > 0 else missing).append(job)
+    upsert_manifest_rows(cur, [
+        (job.relative_path, job.intern_id, job.size, job.mtime_ns, job.content_hash) for job in copied
+    ])
+    return copied, missing
+
+
+def apply_plan_metadata(conn, plan: IndexPlan) -> Tuple[int, List["IndexJob"]]:
+    """
+    Menerapkan bagian plan yang tidak butuh model: hapus embedding basi, salin vektor
+    untuk konten yang sudah dikenal, dan perbarui manifest.
+
+    Returns:
+        Tuple[int, list]: (jumlah vektor disalin, job salinan yang sumbernya belum ada —
+        duplikat dari file baru di run ini; disalin lagi setelah fase embedding).
+    """
+    with conn.cursor() as cur:
+        # Tandai baris basi dulu; baris ini masih boleh jadi sumber salinan (kasus rename)
+        stale_ids = []
+        if plan.stale_paths:
+            cur.execute(f"SELECT id FROM {DB_TABLE_EMBEDDINGS} WHERE file_path = ANY(%s)", (plan.stale_paths,))
+            stale_ids = [row[0] for row in cur.fetchall()]
+        copied, pending = copy_known_embeddings(cur, plan.to_copy)
+        if stale_ids:
+            cur.execute(f"DELETE FROM {DB_TABLE_EMBEDDINGS} WHERE id = ANY(%s)", (stale_ids,))
+        if plan.removed_paths:
+            cur.execute(f"DELETE FROM {DB_TABLE_MANIFEST} WHERE file_path = ANY(%s)", (plan.removed_paths,))
+        if plan.hash_backfill:
+            psycopg2.extras.execute_batch(
+                cur, f"UPDATE {DB_TABLE_EMBEDDINGS} SET content_hash = %s WHERE file_path = %s", plan.hash_backfill
+            )
+        upsert_manifest_rows(cur, plan.manifest_rows)
+    conn.commit()
+    return len(copied), pending
+
+
+def copy_pending_embeddings(conn, jobs: List["IndexJob"]) -> Tuple[int, List["IndexJob"]]:
+    """Salinan yang ditunda setelah fase embedding. Mengembalikan (jumlah disalin, job yang harus di-embed)."""
+    with conn.cursor() as cur:
+        copied, missing = copy_known_embeddings(cur, jobs)
+    conn.commit()
+    return len(copied), missing
+
+
+# --- ENGINE INDEXING PARALEL ---
+# Tahap deteksi (decode + RetinaFace + alignment) berjalan di process pool, crop wajah
+# yang dihasilkan di-batch ke model MODEL_NAME, lalu embedding di-stream ke DB via COPY.
+
+class IndexJob(NamedTuple):
+    """Satu gambar dataset yang perlu di-embed."""
+    intern_id: int
+    name: str
+    instansi: str
+    kategori: str
+    relative_path: str
+    absolute_path: str
+    content_hash: str
+    size: int
+    mtime_ns: int
+
+
+def _detect_face_worker(absolute_filepath: str):
+    """
+    Dijalankan di proses worker: decode + deteksi + alignment satu gambar.
+    Mengembalikan (crop_wajah, None) atau (None, pesan_error).
+    """
+    try:
+        # Bytes + resolusi penuh: preprocessing identik dengan index-on-upload di /upload_dataset
+        image_bytes = Path(absolute_filepath).read_bytes()
+        faces = detect_faces(image_bytes, detector_backend=INDEX_DETECTOR_BACKEND, allow_downscale=False)
+        if not faces:
+            return None, "Wajah tidak terdeteksi"
+        return faces[0], None
+    except Exception as e:
+        return None, str(e)
 
 
-    print("==================================================")
-    print(f"🧠 SCRIPT INDEXING INCREMENTAL (DeepFace/{MODEL_NAME} - {EMBEDDING_DIM}D)")
-    print(f"   Dataset Path: {DATASET_PATH}")
-    print("==================================================")
+def run_inline(func, *args):
+    """Runner inferensi default (CLI): dijalankan langsung di thread pemanggil."""
+    return func(*args)
 
-    intern_ids_to_recalculate = set()
-    total_new_embeddings = 0
 
-    # 1. ITERASI DATASET DAN BUAT EMBEDDING BARU
-    print("✅ Memastikan data interns.csv terdaftar dan memproses embeddings baru...")
+def iter_detected_faces(jobs: List[IndexJob], workers: int,
+                        run_inference: Callable[..., Any] = run_inline) -> Iterator[Tuple[IndexJob, Optional[np.ndarray], Optional[str]]]:
+    """
+    Menghasilkan (job, crop, error) secara streaming, paralel jika workers > 1.
+    Deteksi serial di proses ini dijalankan lewat `run_inference`.
+    """
+    if workers <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            yield (job,) + run_inference(_detect_face_worker, job.absolute_path)
+        return
 
-    if not DATASET_PATH.exists() or not DATASET_PATH.is_dir():
-        print(f"❌ ERROR: Folder dataset tidak ditemukan di {DATASET_PATH}")
+    # 'spawn' karena TensorFlow tidak aman di-fork setelah diinisialisasi
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    # Hanya sejumlah kecil gambar yang diantrekan ke pool sekaligus (bukan seluruh dataset),
+    # sehingga pembatalan tidak perlu menunggu sisa deteksi
+    window = workers * 4
+    in_flight = deque()
+    try:
+        for job in jobs:
+            in_flight.append((job, pool.submit(_detect_face_worker, job.absolute_path)))
+            if len(in_flight) >= window:
+                done_job, future = in_flight.popleft()
+                yield (done_job,) + future.result()
+        while in_flight:
+            done_job, future = in_flight.popleft()
+            yield (done_job,) + future.result()
+    finally:
+        # Selesai, batal, atau gagal: deteksi yang belum berjalan dibuang, tidak ditunggu
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def embed_batch(batch: List[Tuple[IndexJob, np.ndarray]], run_inference: Callable[..., Any] = run_inline) -> list:
+    """Satu forward pass batch ke model lewat `run_inference`."""
+    embeddings = run_inference(embed_faces, [face for _, face in batch])
+    if len(embeddings) != len(batch):
+        raise Exception(f"Jumlah embedding ({len(embeddings)}) tidak sama dengan jumlah wajah ({len(batch)}).")
+    return embeddings
+
+
+def store_embedded_batch(conn, batch: List[Tuple[IndexJob, np.ndarray]], embeddings: list) -> int:
+    """Bulk insert embedding satu batch (COPY BINARY) beserta baris manifest-nya."""
+    if not batch:
+        return 0
+    rows = [
+        (job.intern_id, job.name, job.instansi, job.kategori, job.relative_path, embedding, job.content_hash)
+        for (job, _), embedding in zip(batch, embeddings)
+    ]
+    with conn.cursor() as cur:
+        copy_rows_binary(
+            cur, DB_TABLE_EMBEDDINGS,
+            ("intern_id", "name", "instansi", "kategori", "file_path", "embedding", "content_hash"),
+            ("int4", "text", "text", "text", "text", "vector", "text"),
+            rows
+        )
+        # Manifest ditulis di transaksi yang sama: file ini tidak akan diproses ulang
+        upsert_manifest_rows(cur, [
+            (job.relative_path, job.intern_id, job.size, job.mtime_ns, job.content_hash) for job, _ in batch
+        ])
+    conn.commit()
+    return len(rows)
+
+
+# --- CENTROID (SATU QUERY, SATU UPSERT) ---
+
+# Namespace advisory lock untuk penulisan centroid per intern (recompute & index-on-upload)
+CENTROID_LOCK_NAMESPACE = 4202
+
+
+def lock_intern_centroids(cur, intern_ids: Iterable[int]):
+    """Advisory lock centroid per intern (sampai akhir transaksi), selalu dengan urutan id naik agar tidak deadlock."""
+    for intern_id in sorted({intern_id for intern_id in intern_ids if intern_id is not None}):
+        cur.execute("SELECT pg_advisory_xact_lock(%s, %s)", (CENTROID_LOCK_NAMESPACE, intern_id))
+
+def recompute_centroids(conn, intern_ids: Optional[Iterable[int]] = None) -> Tuple[int, int]:
+    """
+    Menghitung ulang centroid (rata-rata embedding ternormalisasi L2) dalam satu pass:
+    satu SELECT untuk semua embedding terdampak, pengelompokan dengan np.add.reduceat,
+    lalu satu UPSERT massal. Jumlah & banyaknya embedding ikut disimpan (embedding_sum,
+    embedding_count) untuk pembaruan incremental saat upload. Centroid intern yang tidak
+    lagi punya embedding dihapus.
+
+    Args:
+        intern_ids: Intern yang dihitung ulang; None berarti semua intern.
+
+    Returns:
+        Tuple[int, int]: (jumlah centroid diperbarui, jumlah centroid dihapus).
+    """
+    id_filter = list(intern_ids) if intern_ids is not None else None
+    where = "WHERE intern_id = ANY(%s)" if id_filter is not None else ""
+    params = (id_filter,) if id_filter is not None else None
+
+    with conn.cursor() as cur:
+        # Upload yang sedang meng-update running sum intern yang sama ditunggu dulu (dan
+        # sebaliknya), agar hasil recompute tidak menimpa kontribusi embedding upload
+        if id_filter is None:
+            cur.execute(f"SELECT intern_id FROM {DB_TABLE_EMBEDDINGS} UNION SELECT intern_id FROM {DB_TABLE_CENTROIDS}")
+            lock_intern_centroids(cur, [row[0] for row in cur.fetchall()])
+        else:
+            lock_intern_centroids(cur, id_filter)
+        cur.execute(f"""
+            SELECT intern_id, name, instansi, kategori, vector_send(embedding)
+            FROM {DB_TABLE_EMBEDDINGS}
+            {where}
+            ORDER BY intern_id
+        """, params)
+        rows = cur.fetchall()
+
+        centroid_rows = []
+        if rows:
+            ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+            # Baris sudah terurut per intern_id: awal tiap grup = posisi id berubah
+            starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+            counts = np.diff(np.r_[starts, len(rows)])
+            embeddings = decode_vectors_binary([row[4] for row in rows])
+            sums = np.add.reduceat(embeddings, starts, axis=0)
+            means = sums / counts[:, None]
+
+            # Normalisasi Centroid (bagus untuk cosine distance); centroid ~0 dibiarkan
+            norms = np.linalg.norm(means, axis=1, keepdims=True)
+            means = np.where(norms > 1e-6, means / np.maximum(norms, 1e-6), means).astype(np.float32)
+
+            for start, centroid, total, count in zip(starts, means, sums.astype(np.float32), counts):
+                intern_id, name, instansi, kategori, _ = rows[start]
+                centroid_rows.append((intern_id, name, instansi, kategori, Vector(centroid), Vector(total), int(count)))
+
+            psycopg2.extras.execute_values(
+                cur,
+                f"""
+                INSERT INTO {DB_TABLE_CENTROIDS} (intern_id, name, instansi, kategori, embedding, embedding_sum, embedding_count)
+                VALUES %s
+                ON CONFLICT (intern_id) DO UPDATE SET
+                    embedding = EXCLUDED.embedding,
+                    embedding_sum = EXCLUDED.embedding_sum,
+                    embedding_count = EXCLUDED.embedding_count,
+                    name = EXCLUDED.name,
+                    instansi = EXCLUDED.instansi,
+                    kategori = EXCLUDED.kategori;
+                """,
+                centroid_rows,
+                template="(%s, %s, %s, %s, %s::vector, %s::vector, %s)"
+            )
+
+        # Hapus centroid yang tidak lagi punya embedding
+        remaining = [row[0] for row in centroid_rows]
+        if id_filter is not None:
+            cur.execute(
+                f"DELETE FROM {DB_TABLE_CENTROIDS} WHERE intern_id = ANY(%s) AND NOT (intern_id = ANY(%s))",
+                (id_filter, remaining)
+            )
+        else:
+            cur.execute(f"DELETE FROM {DB_TABLE_CENTROIDS} WHERE NOT (intern_id = ANY(%s))", (remaining,))
+        deleted = cur.rowcount
+    conn.commit()
+    return len(centroid_rows), deleted
+
+
+def add_embedding_incremental(conn, job: IndexJob, embedding) -> Tuple[np.ndarray, int]:
+    """
+    Menyimpan satu embedding baru (index-on-upload) dan memperbarui centroid intern
+    secara incremental: embedding_sum += embedding, embedding_count += 1, centroid =
+    normalisasi(sum / count). Embedding lama untuk path yang sama (file ditimpa)
+    dikurangkan. Centroid lama tanpa running sum dihitung sekali dari embedding intern
+    tersebut. Satu transaksi; tidak ada pemindaian dataset.
+
+    Returns:
+        Tuple[np.ndarray, int]: (centroid baru ternormalisasi, jumlah embedding intern).
+    """
+    embedding = np.asarray(embedding, dtype=np.float32).ravel()
+    with conn.cursor() as cur:
+        # Upload bersamaan (dan recompute_centroids) untuk intern yang sama diserialkan
+        lock_intern_centroids(cur, [job.intern_id])
+
+        cur.execute(f"DELETE FROM {DB_TABLE_EMBEDDINGS} WHERE file_path = %s RETURNING vector_send(embedding)",
+                    (job.relative_path,))
+        replaced = cur.fetchall()
+        cur.execute(f"""
+            INSERT INTO {DB_TABLE_EMBEDDINGS} (intern_id, name, instansi, kategori, file_path, embedding, content_hash)
+            VALUES (%s, %s, %s, %s, %s, %s::vector, %s)
+        """, (job.intern_id, job.name, job.instansi, job.kategori, job.relative_path, Vector(embedding), job.content_hash))
+        upsert_manifest_rows(cur, [(job.relative_path, job.intern_id, job.size, job.mtime_ns, job.content_hash)])
+
+        cur.execute(f"SELECT vector_send(embedding_sum), embedding_count FROM {DB_TABLE_CENTROIDS} WHERE intern_id = %s",
+                    (job.intern_id,))
+        row = cur.fetchone()
+        if row is not None and row[0] is not None and row[1] > 0:
+            total = decode_vectors_binary([row[0]])[0] + embedding
+            count = row[1] + 1
+            if replaced:
+                total -= decode_vectors_binary([r[0] for r in replaced]).sum(axis=0)
+                count -= len(replaced)
+        else:
+            # Intern baru atau centroid dari versi lama: running sum dibangun dari embedding yang ada
+            cur.execute(f"SELECT vector_send(embedding) FROM {DB_TABLE_EMBEDDINGS} WHERE intern_id = %s",
+                        (job.intern_id,))
+            vectors = decode_vectors_binary([r[0] for r in cur.fetchall()])
+            total, count = vectors.sum(axis=0), len(vectors)
+
+        total = np.asarray(total, dtype=np.float32)
+        centroid = total / max(count, 1)
+        norm = np.linalg.norm(centroid)
+        if norm > 1e-6:
+            centroid = centroid / norm
+        centroid = centroid.astype(np.float32)
+        cur.execute(f"""
+            INSERT INTO {DB_TABLE_CENTROIDS} (intern_id, name, instansi, kategori, embedding, embedding_sum, embedding_count)
+            VALUES (%s, %s, %s, %s, %s::vector, %s::vector, %s)
+            ON CONFLICT (intern_id) DO UPDATE SET
+                embedding = EXCLUDED.embedding,
+                embedding_sum = EXCLUDED.embedding_sum,
+                embedding_count = EXCLUDED.embedding_count,
+                name = EXCLUDED.name,
+                instansi = EXCLUDED.instansi,
+                kategori = EXCLUDED.kategori;
+        """, (job.intern_id, job.name, job.instansi, job.kategori, Vector(centroid), Vector(total), count))
+    conn.commit()
+    return centroid, count
+
+
+def recompute_all_centroids():
+    """Perintah mandiri: hitung ulang semua centroid dari tabel embedding."""
+    conn = connect_db()
+    try:
+        start_time = time.time()
+        updated, deleted = recompute_centroids(conn)
+        print(f"✅ {updated} centroid dihitung ulang, {deleted} centroid basi dihapus ({time.time() - start_time:.2f}s).")
+    finally:
         conn.close()
-        sys.exit(1)
 
-    processed_folders = 0
-    skipped_folders = 0
-    for folder_name in os.listdir(DATASET_PATH):
-        person_dir = DATASET_PATH / folder_name
 
-        if not os.path.isdir(person_dir) or folder_name.startswith('.'):
-            continue
+def reindex_vectors():
+    """Perintah maintenance: bangun ulang indeks ANN setelah bulk load."""
+    conn = connect_db()
+    try:
+        start_time = time.time()
+        rebuild_vector_indexes(conn)
+        print(f"✅ Indeks vektor ({VECTOR_INDEX_TYPE}) dibangun ulang dalam {time.time() - start_time:.2f}s.")
+    finally:
+        conn.close()
 
-        if folder_name not in master_data:
-            print(f"   ⚠️ PERINGATAN: Folder '{folder_name}' diabaikan (tidak ada di CSV).")
-            skipped_folders += 1
-            continue
 
-        processed_folders += 1
-        metadata = master_data[folder_name]
-        person_name = metadata['name_full']
-        instansi_value = metadata['instansi']
-        kategori_value = metadata['kategori']
+# --- FUNGSI UTAMA (INCREMENTAL INDEXING) ---
 
-        intern_id = None
-        embeddings_to_insert = []
-        person_new_count = 0
+def embed_jobs(connection: Callable[[], ContextManager], jobs: List[IndexJob], workers: int, batch_size: int,
+               report: dict, update: Callable[..., None], check_cancelled: Callable[[], None],
+               run_inference: Callable[..., Any] = run_inline) -> None:
+    """
+    Deteksi paralel + embedding batch + bulk insert; hitungan progres ditambahkan ke `report`.
+    Koneksi dipinjam per batch (setelah embedding selesai), bukan selama seluruh run.
+    """
+    if not jobs:
+        print("     [INFO] Tidak ada gambar baru yang perlu di-embed.")
+        return
+    # Bisa dipanggil lebih dari sekali per run (fallback salinan): hitungan dilanjutkan
+    base = {key: report[key] for key in ("processed", "embedded", "skipped")}
+    total_new_embeddings = 0
+    skipped_images = 0
+    start_time = time.time()
+    print(f"\n🚀 Memproses {len(jobs)} gambar baru...")
+    batch = []
+    failed_manifest_rows = []
+    detected = iter_detected_faces(jobs, workers, run_inference)
+    try:
+        for done, (job, face, error) in enumerate(detected, start=1):
+            if face is None:
+                print(f"     [SKIP] {job.relative_path}: {error}")
+                skipped_images += 1
+                # Dicatat di manifest agar tidak dicoba ulang selama file tidak berubah
+                failed_manifest_rows.append((job.relative_path, job.intern_id, job.size, job.mtime_ns, job.content_hash))
+            else:
+                batch.append((job, face))
 
-        try:
-            # A. UPSERT INTERN
-            intern_id = upsert_intern_and_get_id(conn, person_name, instansi_value, kategori_value)
-            intern_ids_to_recalculate.add(intern_id) # Tandai untuk hitung ulang centroid
+            if len(batch) >= batch_size or (done == len(jobs) and batch):
+                try:
+                    embeddings = embed_batch(batch, run_inference)
+                    with connection() as conn:
+                        total_new_embeddings += store_embedded_batch(conn, batch, embeddings)
+                except IndexingCancelled:
+                    raise
+                except Exception as db_e:
+                    print(f"❌ FATAL ERROR DB: Gagal menyimpan batch embeddings. Detail: {db_e}")
+                batch = []
+                elapsed = max(time.time() - start_time, 1e-6)
+                print(f"   ⏱️ {done}/{len(jobs)} gambar | {done / elapsed:.2f} gambar/detik")
+                update(processed=base["processed"] + done, embedded=base["embedded"] + total_new_embeddings,
+                       skipped=base["skipped"] + skipped_images)
+                # Batal hanya di batas batch: yang sudah ter-commit tetap tercatat di manifest
+                check_cancelled()
+    finally:
+        detected.close() # Menghentikan pool deteksi segera saat batal/gagal
+        if failed_manifest_rows:
+            with connection() as conn, conn.cursor() as manifest_cur:
+                upsert_manifest_rows(manifest_cur, failed_manifest_rows)
 
-            # B. Ambil list file yang sudah ada di DB
-            existing_paths = get_existing_file_paths(conn, intern_id)
-            print(f"\n   -> Memproses {person_name} (ID: {intern_id})... {len(existing_paths)} file sudah ada.")
+    elapsed = max(time.time() - start_time, 1e-6)
+    print(f"   ✅ {total_new_embeddings} embeddings BARU disimpan, {skipped_images} gambar dilewati "
+          f"dalam {elapsed:.2f}s ({len(jobs) / elapsed:.2f} gambar/detik).")
+    update(processed=base["processed"] + len(jobs), embedded=base["embedded"] + total_new_embeddings,
+           skipped=base["skipped"] + skipped_images)
 
-            # C. Proses gambar baru saja
-            image_files = [f for f in sorted(os.listdir(person_dir)) if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
-            print(f"     Ditemukan {len(image_files)} file gambar.")
 
-            for filename in image_files:
-                # Gunakan path relatif dari PROJECT_ROOT untuk konsistensi
-                relative_filepath = f"data/dataset/{folder_name}/{filename}"
-                absolute_filepath = str(PROJECT_ROOT / relative_filepath) # Path absolut untuk DeepFace
+@contextmanager
+def connection_scope(conn):
+    """Satu transaksi di atas koneksi milik pemanggil: commit jika sukses, rollback jika error."""
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        if not conn.closed: conn.rollback()
+        raise
+
+
+def index_data_incremental(workers: int = INDEX_WORKERS, batch_size: int = INDEX_BATCH_SIZE, conn=None,
+                           progress: Optional[Callable[..., None]] = None,
+                           should_cancel: Optional[Callable[[], bool]] = None,
+                           connection: Optional[Callable[[], ContextManager]] = None,
+                           run_inference: Callable[..., Any] = run_inline) -> dict:
+    """
+    Indexing incremental dataset. Dipanggil dari CLI maupun dari worker indexing in-process
+    (lihat index_jobs.py) yang meneruskan `connection` (factory transaksi pool, dipinjam per
+    fase/batch), `run_inference` (menjalankan deteksi/embedding lewat pool inferensi), callback
+    `progress` (hitungan terbaru per fase/batch) dan `should_cancel` (dicek di antara batch;
+    jika True, IndexingCancelled dilempar setelah batch terakhir ter-commit).
+
+    Returns:
+        dict: ringkasan hasil (jumlah file, embedding baru/disalin, dilewati, centroid).
+    """
+    report = {"phase": "scan", "files": 0, "to_embed": 0, "processed": 0, "embedded": 0,
+              "copied": 0, "skipped": 0, "centroids": 0}
+
+    def update(**changes):
+        report.update(changes)
+        if progress is not None:
+            progress(**report)
+
+    def check_cancelled():
+        if should_cancel is not None and should_cancel():
+            raise IndexingCancelled("Indexing dibatalkan.")
+
+    if connection is not None:
+        return _index_data_incremental(connection, workers, batch_size, report, update, check_cancelled, run_inference)
+
+    owns_conn = conn is None
+    if owns_conn:
+        conn = connect_db()
+    try:
+        return _index_data_incremental(lambda: connection_scope(conn), workers, batch_size, report, update,
+                                       check_cancelled, run_inference)
+    finally:
+        if owns_conn:
+            conn.close()
 
-                # Cek jika path RELATIF sudah ada
-                if relative_filepath in existing_paths:
-                    # print(f"     [SKIP] {filename} sudah di database.")
-                    continue
 
-                try:
-                    # print(f"     [PROSES] {filename}")
-                    representations = DeepFace.represent(
-                        img_path=absolute_filepath,
-                        model_name=MODEL_NAME,
-                        enforce_detection=True,
-                        detector_backend='retinaface' # Coba backend lain jika default gagal
-                    )
-
-                    if representations and len(representations) > 0 and "embedding" in representations[0]:
-                        embedding_vector = representations[0]["embedding"]
-                        vector_string = "[" + ",".join(map(str, embedding_vector)) + "]"
-                        # Simpan path RELATIF ke DB
-                        embeddings_to_insert.append((intern_id, person_name, instansi_value, kategori_value, relative_filepath, vector_string))
-                        person_new_count += 1
-                    else:
-                         print(f"     [SKIP] Tidak ada embedding dihasilkan untuk {filename}.")
-
-
-                except ValueError as ve:
-                     if 'Face could not be detected' in str(ve):
-                         print(f"     [SKIP] Wajah tidak terdeteksi di {filename}.")
-                     else:
-                         print(f"     [ERROR] Gagal memproses {filename}. Detail: {ve}")
-                except Exception as e:
-                    print(f"     [ERROR] Gagal memproses {filename}. Detail: {e}")
+def _index_data_incremental(connection, workers, batch_size, report, update, check_cancelled, run_inference) -> dict:
+    master_data = load_master_data()
 
-        except Exception as e:
-             conn.rollback()
-             print(f"❌ FATAL ERROR: Gagal memproses intern {person_name}. Detail: {e}")
-             continue # Lanjut ke folder berikutnya
-
-        # D. INSERT BATCH EMBEDDING BARU
-        if embeddings_to_insert:
-            insert_query = f"INSERT INTO {DB_TABLE_EMBEDDINGS} (intern_id, name, instansi, kategori, file_path, embedding) VALUES (%s, %s, %s, %s, %s, %s::vector)"
-            try:
-                cur.executemany(insert_query, embeddings_to_insert)
-                conn.commit()
-                total_new_embeddings += person_new_count
-                print(f"   ✅ Selesai: {person_new_count} embeddings BARU disimpan untuk {person_name}.")
-            except Exception as db_e:
-                conn.rollback()
-                print(f"❌ FATAL ERROR DB: Gagal menyimpan embeddings untuk {person_name}. Detail: {db_e}")
-        else:
-            if image_files: # Hanya cetak jika ada gambar tapi tidak ada yang baru
-                 print(f"     [INFO] Tidak ada embeddings baru yang diproses untuk {person_name}.")
-            else:
-                 print(f"     [INFO] Tidak ada file gambar ditemukan untuk {person_name}.")
+    print("==================================================")
+    print(f"🧠 SCRIPT INDEXING INCREMENTAL (DeepFace/{MODEL_NAME} - {EMBEDDING_DIM}D)")
+    print(f"   Dataset Path: {DATASET_PATH}")
+    print(f"   Worker deteksi: {workers} | Batch embedding: {batch_size}")
+    print("==================================================")
 
+    # 1. PINDAI DATASET & DIFF TERHADAP MANIFEST
+    print("✅ Memindai dataset dan membandingkan dengan manifest...")
 
-    print(f"\n✅ Selesai memproses {processed_folders} folder. {skipped_folders} folder diabaikan (tidak ada di CSV).")
+    if not DATASET_PATH.exists() or not DATASET_PATH.is_dir():
+        print(f"❌ ERROR: Folder dataset tidak ditemukan di {DATASET_PATH}")
+        raise IndexingError(f"Folder dataset tidak ditemukan: {DATASET_PATH}")
+
+    scan_start = time.time()
+    files = scan_dataset()
+    folders_on_disk = {f.folder for f in files}
+    skipped_folders = sorted(folders_on_disk - set(master_data))
+    for folder_name in skipped_folders:
+        print(f"   ⚠️ PERINGATAN: Folder '{folder_name}' diabaikan (tidak ada di CSV).")
+
+    with connection() as conn:
+        ensure_manifest_schema(conn)
+        intern_ids = upsert_interns(conn, [
+            (master_data[folder]['name_full'], master_data[folder]['instansi'], master_data[folder]['kategori'])
+            for folder in sorted(folders_on_disk & set(master_data))
+        ])
+        plan = plan_index_changes(conn, files, master_data, intern_ids)
+    intern_ids_to_recalculate = plan.affected_interns
+    print(f"   -> {len(files)} file dipindai dalam {time.time() - scan_start:.2f}s: "
+          f"{plan.unchanged} tidak berubah, {len(plan.to_embed)} perlu di-embed, "
+          f"{len(plan.to_copy)} disalin (hash sama), {len(plan.stale_paths)} embedding basi.")
+    update(files=len(files), to_embed=len(plan.to_embed))
+
+    if not plan.has_changes():
+        print("\n🎉 Dataset tidak berubah. Tidak ada yang perlu di-index.")
+        update(phase="done")
+        return report
+
+    check_cancelled()
+    try:
+        with connection() as conn:
+            copied_embeddings, pending_copies = apply_plan_metadata(conn, plan)
+        update(phase="embed", copied=copied_embeddings)
+
+        # 2. DETEKSI PARALEL + EMBEDDING BATCH + BULK INSERT
+        embed_jobs(connection, plan.to_embed, workers, batch_size, report, update, check_cancelled, run_inference)
+
+        # Duplikat dari file yang baru di-embed run ini: sumber salinannya baru ada sekarang
+        if pending_copies:
+            with connection() as conn:
+                copied, fallback_jobs = copy_pending_embeddings(conn, pending_copies)
+            copied_embeddings += copied
+            update(copied=copied_embeddings)
+            if fallback_jobs:
+                print(f"   ⚠️ {len(fallback_jobs)} file duplikat tanpa sumber salinan, di-embed langsung.")
+                update(to_embed=report["to_embed"] + len(fallback_jobs))
+                embed_jobs(connection, fallback_jobs, workers, batch_size, report, update, check_cancelled,
+                           run_inference)
+    except Exception:
+        # Batal atau gagal di tengah jalan: perubahan yang sudah ter-commit tidak akan
+        # dianggap berubah lagi oleh run berikutnya, jadi centroid intern terdampak tetap
+        # diperbarui sebelum berhenti.
+        try:
+            with connection() as conn:
+                recompute_centroids(conn, intern_ids_to_recalculate)
+        except Exception as e:
+            print(f"   ❌ ERROR: Gagal menghitung ulang centroid setelah indexing terhenti: {e}")
+        raise
+    total_new_embeddings = report["embedded"]
 
-    # 2. HITUNG ULANG CENTROID UNTUK SEMUA YANG TERDAMPAK
+    # 3. HITUNG ULANG CENTROID UNTUK SEMUA YANG TERDAMPAK
+    recalculated_count = 0
+    update(phase="centroid")
     if not intern_ids_to_recalculate:
         print("\n⚠️ Tidak ada data baru yang diproses atau intern yang terpengaruh. Perhitungan Centroid dilewati.")
     else:
         print("\n==================================================")
         print(f"🧠 MEMULAI PERHITUNGAN CENTROID ({len(intern_ids_to_recalculate)} intern)")
         print("==================================================")
-
-        recalculated_count = 0
-        for intern_id in intern_ids_to_recalculate:
-            cur.execute(f"""
-                SELECT name, instansi, kategori, embedding
-                FROM {DB_TABLE_EMBEDDINGS}
-                WHERE intern_id = %s
-            """, (intern_id,))
-
-            results = cur.fetchall()
-
-            if not results:
-                print(f"   ⚠️ Tidak ada embedding ditemukan untuk Intern ID {intern_id}. Centroid dilewati.")
-                continue
-
-            name, instansi, kategori = results[0][0], results[0][1], results[0][2]
-
-            try:
-                # results[i][3] sudah berupa numpy array karena registrasi tipe
-                embeddings_array = np.stack([res[3] for res in results])
-                if embeddings_array.ndim == 1: # Jika hanya 1 embedding
-                    embeddings_array = embeddings_array.reshape(1, -1)
-            except Exception as e:
-                print(f"   ❌ ERROR: Gagal stack embeddings untuk {name}. Error: {e}")
-                continue
-
-
-            centroid_vector = np.mean(embeddings_array, axis=0)
-
-            # Normalisasi Centroid (opsional tapi bagus untuk cosine distance)
-            norm = np.linalg.norm(centroid_vector)
-            if norm > 1e-6: # Hindari pembagian dengan nol
-                centroid_vector = centroid_vector / norm
-            else:
-                print(f"   ⚠️ Peringatan: Centroid untuk {name} mendekati nol. Normalisasi dilewati.")
-
-            centroid_str = "[" + ",".join(map(str, centroid_vector)) + "]"
-
-            # UPSERT Centroid ke Tabel intern_centroids
-            try:
-                cur.execute(
-                    f"""
-                    INSERT INTO {DB_TABLE_CENTROIDS} (intern_id, name, instansi, kategori, embedding)
-                    VALUES (%s, %s, %s, %s, %s::vector)
-                    ON CONFLICT (intern_id) DO UPDATE SET
-                        embedding = EXCLUDED.embedding,
-                        name = EXCLUDED.name,
-                        instansi = EXCLUDED.instansi,
-                        kategori = EXCLUDED.kategori;
-                    """,
-                    (intern_id, name, instansi, kategori, centroid_str)
-                )
-                conn.commit()
-                print(f"   ✅ Centroid {name} berhasil diperbarui dari {len(results)} embeddings.")
-                recalculated_count += 1
-            except Exception as e:
-                conn.rollback()
-                print(f"   ❌ ERROR: Gagal menyimpan centroid untuk {name}: {e}")
-
-    conn.close()
+        try:
+            with connection() as conn:
+                recalculated_count, deleted_count = recompute_centroids(conn, intern_ids_to_recalculate)
+            print(f"   ✅ {recalculated_count} centroid diperbarui, {deleted_count} centroid dihapus (tanpa embedding tersisa).")
+        except Exception as e:
+            print(f"   ❌ ERROR: Gagal menghitung ulang centroid: {e}")
 
     print("\n" + "="*50)
     print(f"🎉 ALUR KERJA LENGKAP!")
-    print(f"   Total {total_new_embeddings} embedding baru ditambahkan.")
+    print(f"   Total {total_new_embeddings} embedding baru ditambahkan, {copied_embeddings} disalin dari hash yang sama.")
     if intern_ids_to_recalculate:
         print(f"   Total {recalculated_count} centroid dihitung ulang/diperbarui.")
     print("="*50)
+    update(phase="done", centroids=recalculated_count)
+    return report
 
 if __name__ == "__main__":
-    index_data_incremental()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Indexing incremental dataset wajah ke PostgreSQL/pgvector.")
+    parser.add_argument("command", nargs="?", default="index", choices=["index", "recompute-centroids", "reindex"],
+                        help="'index' (default) untuk indexing incremental, 'recompute-centroids' untuk menghitung ulang "
+                             "semua centroid, 'reindex' untuk membangun ulang indeks ANN setelah bulk load.")
+    parser.add_argument("--workers", type=int, default=INDEX_WORKERS, help="Jumlah proses deteksi wajah paralel.")
+    parser.add_argument("--batch-size", type=int, default=INDEX_BATCH_SIZE, help="Jumlah wajah per batch embedding/insert.")
+    args = parser.parse_args()
+    try:
+        if args.command == "recompute-centroids":
+            recompute_all_centroids()
+        elif args.command == "reindex":
+            reindex_vectors()
+        else:
+            index_data_incremental(workers=args.workers, batch_size=max(1, args.batch_size))
+    except IndexingError as e:
+        print(f"❌ Indexing gagal: {e}")
+        sys.exit(1) # Gagal keras agar pemanggil CLI mendapat exit code error
\ No newline at end of file
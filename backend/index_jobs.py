@@ -0,0 +1,170 @@
+import os
+import queue
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+
+# --- KONFIGURASI WORKER INDEXING IN-PROCESS ---
+# Jumlah proses deteksi wajah untuk job dari API. Default 1: deteksi berjalan di proses
+# server dan memakai detektor yang sudah dimuat; >1 memakai ProcessPoolExecutor (spawn).
+INDEX_JOB_WORKERS = int(os.getenv("INDEX_JOB_WORKERS", "1"))
+# Jumlah job selesai yang riwayatnya tetap bisa dibaca lewat GET /index_jobs/{id}
+INDEX_JOB_HISTORY = int(os.getenv("INDEX_JOB_HISTORY", "20"))
+
+# Status job
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+
+class IndexingJob:
+    """Satu permintaan indexing beserta status dan progres terakhirnya."""
+
+    def __init__(self, kind: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.status = QUEUED
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+
+    @property
+    def active(self) -> bool:
+        return self.status in ACTIVE_STATUSES
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": dict(self.progress),
+            "result": self.result,
+            "error": self.error,
+            "cancel_requested": self.cancel_event.is_set(),
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class IndexJobManager:
+    """
+    Worker indexing jangka panjang di dalam proses server.
+
+    Menggantikan subprocess `python -m backend.index_data`: job dijalankan satu per satu
+    oleh satu thread yang memakai model, detektor, dan pool DB yang sudah dimuat.
+    `submit` bersifat single-flight — selama ada job yang antre/berjalan untuk jenis
+    yang sama, job itu yang dikembalikan. Pembatalan bersifat kooperatif (dicek di
+    antara batch oleh `runner`).
+    """
+
+    def __init__(self, runner: Callable, on_finished: Optional[Callable] = None, history: int = INDEX_JOB_HISTORY):
+        # runner(job) -> dict hasil; memanggil job.progress.update(...) dan mengecek job.cancel_event
+        self.runner = runner
+        # on_finished(job) dipanggil setelah job selesai apa pun statusnya: indexing commit per
+        # batch, jadi job yang gagal/dibatalkan pun mungkin sudah mengubah data
+        self.on_finished = on_finished
+        self.history = max(1, history)
+        self._jobs: "OrderedDict[str, IndexingJob]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue" = queue.Queue()
+        self._worker = None
+
+    # --- SIKLUS HIDUP ---
+
+    def start(self):
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._run_loop, name="index-worker", daemon=True)
+            self._worker.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Membatalkan job aktif dan menghentikan worker (hook shutdown)."""
+        with self._lock:
+            for job in self._jobs.values():
+                if job.active:
+                    job.cancel_event.set()
+        if self._worker is not None:
+            self._queue.put(None)
+            self._worker.join(timeout)
+            self._worker = None
+
+    # --- API JOB ---
+
+    def submit(self, kind: str = "index") -> Tuple[IndexingJob, bool]:
+        """Mengantrekan job baru. Mengembalikan (job, dibuat_baru)."""
+        with self._lock:
+            for job in self._jobs.values():
+                if job.kind == kind and job.active and not job.cancel_event.is_set():
+                    return job, False
+            job = IndexingJob(kind)
+            self._jobs[job.id] = job
+            self._trim()
+        self._queue.put(job)
+        return job, True
+
+    def get(self, job_id: str) -> Optional[IndexingJob]:
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[IndexingJob]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job.status == QUEUED:
+                job.status = CANCELLED
+                job.finished_at = time.time()
+            elif job.status == RUNNING:
+                job.cancel_event.set()
+        return job
+
+    def _trim(self):
+        # Dipanggil dengan _lock dipegang: buang riwayat job selesai tertua
+        finished = [job_id for job_id, job in self._jobs.items() if not job.active]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self._jobs[job_id]
+
+    # --- WORKER ---
+
+    def _run_loop(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            with self._lock:
+                if job.status != QUEUED: # Dibatalkan sebelum sempat berjalan
+                    continue
+                job.status = RUNNING
+                job.started_at = time.time()
+            print(f"🚀 [IndexJob {job.id}] Memulai job '{job.kind}'...")
+            try:
+                job.result = self.runner(job)
+                status = SUCCEEDED
+            except Exception as e:
+                if job.cancel_event.is_set():
+                    status = CANCELLED
+                    print(f"⏹️ [IndexJob {job.id}] Dibatalkan.")
+                else:
+                    status = FAILED
+                    job.error = str(e)
+                    print(f"❌ [IndexJob {job.id}] Gagal: {e}")
+                    traceback.print_exc()
+            if self.on_finished is not None:
+                try:
+                    self.on_finished(job)
+                except Exception as e:
+                    print(f"⚠️ [IndexJob {job.id}] Callback selesai gagal: {e}")
+            with self._lock:
+                job.status = status
+                job.finished_at = time.time()
+            if status == SUCCEEDED:
+                print(f"✅ [IndexJob {job.id}] Selesai dalam {job.finished_at - job.started_at:.2f}s.")
@@ -0,0 +1,79 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# --- KONFIGURASI WORKER INFERENSI (DIBACA DARI ENV) ---
+# Jumlah thread yang menjalankan DeepFace/TensorFlow secara paralel
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "2"))
+# Jumlah request yang boleh menunggu di antrean saat semua worker sibuk
+INFERENCE_QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", "8"))
+# Nilai header Retry-After (detik) saat antrean penuh
+INFERENCE_RETRY_AFTER = int(os.getenv("INFERENCE_RETRY_AFTER", "2"))
+
+
+class InferenceQueueFull(Exception):
+    """Antrean inferensi penuh; klien sebaiknya mencoba lagi setelah `retry_after` detik."""
+
+    def __init__(self, retry_after: int = INFERENCE_RETRY_AFTER):
+        super().__init__(f"Antrean inferensi penuh, coba lagi dalam {retry_after} detik.")
+        self.retry_after = retry_after
+
+
+class InferencePool:
+    """
+    Thread pool khusus inferensi dengan admission control.
+
+    Inferensi dijalankan di luar event loop sehingga endpoint lain tetap responsif.
+    Jumlah pekerjaan (berjalan + antre) dibatasi `workers + queue_size`; pekerjaan
+    tambahan langsung ditolak dengan InferenceQueueFull agar latensi tetap terprediksi.
+    """
+
+    def __init__(self, workers: int = INFERENCE_WORKERS, queue_size: int = INFERENCE_QUEUE_SIZE):
+        self.workers = max(1, workers)
+        self.queue_size = max(0, queue_size)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="inference")
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def capacity(self) -> int:
+        return self.workers + self.queue_size
+
+    def _release(self, _future):
+        # Dipanggil saat pekerjaan benar-benar selesai (bukan saat request dibatalkan)
+        with self._lock:
+            self._in_flight -= 1
+
+    def submit(self, func, *args, **kwargs):
+        """Mengantrekan pekerjaan ke pool; raise InferenceQueueFull jika kapasitas habis."""
+        with self._lock:
+            if self._in_flight >= self.capacity:
+                raise InferenceQueueFull()
+            self._in_flight += 1
+        try:
+            future = self._executor.submit(func, *args, **kwargs)
+        except Exception:
+            with self._lock:
+                self._in_flight -= 1
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    async def run(self, func, *args, **kwargs):
+        """Menjalankan `func` di pool inferensi dan menunggu hasilnya tanpa memblokir event loop."""
+        return await asyncio.wrap_future(self.submit(func, *args, **kwargs))
+
+    def stats(self) -> dict:
+        return {"workers": self.workers, "queue_size": self.queue_size, "in_flight": self._in_flight}
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+
+# Pool bersama untuk seluruh aplikasi
+inference_pool = InferencePool()
@@ -1,14 +1,20 @@
 import time
 import sys
-import subprocess
-from fastapi import BackgroundTasks
+import asyncio
 import os
 # from dotenv import load_dotenv # <-- DIHAPUS/KOMENTARI
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import psycopg2
 import psycopg2.extensions
+import psycopg2.pool
+import psycopg2.extras
 import numpy as np
 import shutil
 import uuid
+import hashlib
 
 # load_dotenv() # <-- DIHAPUS/KOMENTARI
 
@@ -25,33 +31,13 @@ from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 # ---
 
-# Import gTTS library for automatic Text-to-Speech generation
-try:
-    from gtts import gTTS
-except ImportError:
-    print("WARNING: gTTS library not found. Audio generation might fail.")
-
-    # DEFINE MOCK CLASS DAN FUNGSI DUMMY DI SINI DENGAN INDENTASI YANG BENAR
-    class MockTTS:
-        """Kelas dummy untuk menggantikan gTTS jika tidak ada."""
-        def __init__(self, text, lang):
-            self.text = text
-            self.lang = lang
-
-        def save(self, path):
-            print(f"Mock TTS save: (No TTS library installed) Text: {self.text}")
-
-    # Fungsi gTTS dummy yang mengembalikan MockTTS (Perbaikan Pylance)
-    def gTTS(text, lang='id'):
-        return MockTTS(text, lang)
-
 # Import library FastAPI
 from fastapi import FastAPI, File, UploadFile, HTTPException, Form
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.requests import Request
 from starlette.staticfiles import StaticFiles
 from starlette.status import HTTP_302_FOUND
-from starlette.responses import RedirectResponse, JSONResponse
+from starlette.responses import RedirectResponse, JSONResponse, Response, StreamingResponse
 
 # Import DeepFace (pastikan sudah terinstal: pip install deepface)
 try:
@@ -68,18 +54,60 @@ sys.path.insert(0, str(PROJECT_ROOT))
 # Impor fungsi dan konfigurasi dari file lain (asumsi ada di backend/utils.py)
 try:
     # Coba import absolut dulu (umumnya lebih baik)
-    from backend.utils import extract_face_features, DISTANCE_THRESHOLD, EMBEDDING_DIM
+    from backend.utils import (detect_faces, decode_and_detect, parse_face_box, embed_faces, warmup_models,
+                               DISTANCE_THRESHOLD, EMBEDDING_DIM)
 except ImportError:
     try:
          # Fallback ke import relatif jika dijalankan sebagai modul
-        from .utils import extract_face_features, DISTANCE_THRESHOLD, EMBEDDING_DIM
+        from .utils import (detect_faces, decode_and_detect, parse_face_box, embed_faces, warmup_models,
+                            DISTANCE_THRESHOLD, EMBEDDING_DIM)
     except ImportError:
          # Fallback terakhir jika utils.py tidak ditemukan
         print("⚠️ Peringatan: Gagal mengimpor utilitas (utils.py). Pastikan file ini ada di backend/utils.py.")
-        def extract_face_features(image_bytes): return []
+        def detect_faces(image_bytes): return []
+        def decode_and_detect(image_bytes, face_box=None): return None, []
+        def parse_face_box(value): return None
+        def embed_faces(faces): return []
+        def warmup_models(): return None
         DISTANCE_THRESHOLD = 0.5
         EMBEDDING_DIM = 512
 
+# Modul internal backend (tanpa dependensi model)
+try:
+    from backend.face_index import get_match_index, reload_match_index, update_match_index, search_centroids_db
+    from backend.inference import inference_pool, InferenceQueueFull
+    from backend.batching import MicroBatcher
+    from backend.audio_cache import AudioCache
+    from backend.image_store import ImageWriteQueue, sharded_path, THUMB_DIR_NAME
+    from backend.attendance_state import (TodayState, StateListener, lock_intern_attendance,
+                                          notify_attendance, parse_notification, notify_reset, ResetEvent,
+                                          ensure_reset_epoch_schema, read_reset_epoch, bump_reset_epoch)
+    from backend.attendance_feed import TodaySnapshot
+    from backend.index_jobs import IndexJobManager, INDEX_JOB_WORKERS
+    from backend.index_data import (index_data_incremental, add_embedding_incremental, IndexJob, IndexingCancelled,
+                                    INDEX_DETECTOR_BACKEND, DATASET_IMAGE_EXTENSIONS)
+    from backend.retention import (run_retention, ensure_archive_schema, create_attendance_logs_table,
+                                   ensure_log_partitions, migrate_attendance_logs, RETENTION_HOUR, RETENTION_MINUTE)
+    from backend.vector_codec import register_vector, lookup_vector_oid
+    from backend.vector_index import create_vector_indexes, apply_search_params
+except ImportError:
+    from .face_index import get_match_index, reload_match_index, update_match_index, search_centroids_db
+    from .inference import inference_pool, InferenceQueueFull
+    from .batching import MicroBatcher
+    from .audio_cache import AudioCache
+    from .image_store import ImageWriteQueue, sharded_path, THUMB_DIR_NAME
+    from .attendance_state import (TodayState, StateListener, lock_intern_attendance,
+                                   notify_attendance, parse_notification, notify_reset, ResetEvent,
+                                   ensure_reset_epoch_schema, read_reset_epoch, bump_reset_epoch)
+    from .attendance_feed import TodaySnapshot
+    from .index_jobs import IndexJobManager, INDEX_JOB_WORKERS
+    from .index_data import (index_data_incremental, add_embedding_incremental, IndexJob, IndexingCancelled,
+                             INDEX_DETECTOR_BACKEND, DATASET_IMAGE_EXTENSIONS)
+    from .retention import (run_retention, ensure_archive_schema, create_attendance_logs_table,
+                            ensure_log_partitions, migrate_attendance_logs, RETENTION_HOUR, RETENTION_MINUTE)
+    from .vector_codec import register_vector, lookup_vector_oid
+    from .vector_index import create_vector_indexes, apply_search_params
+
 # --- KONFIGURASI DB (DIBACA DARI ENV YANG DISUNTIK DOCKER) ---
 DB_HOST = os.getenv("DB_HOST", "localhost") # Akan menjadi 'postgres' di Docker
 DB_PORT = os.getenv("DB_PORT", "5432") # Akan menjadi '5432' di Docker
@@ -87,6 +115,19 @@ DB_NAME = os.getenv("DB_NAME", "intern_attendance_db")
 DB_USER = os.getenv("DB_USER", "macbookpro")
 DB_PASSWORD = os.getenv("DB_PASSWORD", "deepfacepass")
 
+# --- KONFIGURASI POOL KONEKSI ---
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10")) # Detik menunggu koneksi bebas
+db_pool = None      # Dibuat sekali oleh init_db_pool() saat startup
+# Executor DB terpisah: polling dashboard tidak bisa memakan slot milik kiosk.
+# Total worker sebaiknya <= DB_POOL_MAX agar kiosk selalu mendapat koneksi.
+DB_WORKERS = int(os.getenv("DB_WORKERS", "4"))
+DB_KIOSK_WORKERS = int(os.getenv("DB_KIOSK_WORKERS", "2"))
+db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
+kiosk_db_executor = ThreadPoolExecutor(max_workers=DB_KIOSK_WORKERS, thread_name_prefix="db-kiosk")
+vector_oid = None   # OID tipe 'vector', di-cache per proses
+
 # FOLDER UNTUK GAMBAR
 CAPTURED_IMAGES_DIR = PROJECT_ROOT / "backend" / "captured_images"
 FACES_DIR = PROJECT_ROOT / "data" / "dataset" # KRITIS: Path Dataset
@@ -102,6 +143,39 @@ DAILY_RESET_HOUR = 00 # Pukul 00:00
 DAILY_RESET_MINUTE = 00
 # ---
 
+# --- INDEX-ON-UPLOAD ---
+# Jika aktif, /upload_dataset langsung meng-embed gambar dan memperbarui centroid intern
+# (tanpa menunggu /run_indexing). Bisa juga diatur per request lewat field 'index_now'.
+INDEX_ON_UPLOAD = os.getenv("INDEX_ON_UPLOAD", "false").lower() in ("1", "true", "yes")
+
+# --- MODE MULTI-WAJAH /recognize ---
+# Jika aktif, semua wajah pada frame dicocokkan sekaligus dan dicatat dalam satu transaksi.
+# Bisa juga diatur per request lewat field 'multi_face'.
+RECOGNIZE_MULTI_FACE = os.getenv("RECOGNIZE_MULTI_FACE", "false").lower() in ("1", "true", "yes")
+# Batas wajah yang diproses per frame (sesuai urutan hasil deteksi)
+RECOGNIZE_MAX_FACES = int(os.getenv("RECOGNIZE_MAX_FACES", "10"))
+
+# --- MICRO-BATCHING EMBEDDING ---
+# Crop wajah dari kiosk yang request-nya bersamaan digabung dalam satu forward pass
+embedding_batcher = MicroBatcher(embed_faces, inference_pool)
+
+# --- CACHE AUDIO TTS ---
+# /recognize hanya memakai track yang sudah ada; render dilakukan worker latar belakang
+audio_cache = AudioCache(AUDIO_FILES_DIR)
+
+# --- PENYIMPANAN GAMBAR ABSENSI (ASINKRON) ---
+# URL gambar langsung dikembalikan; penulisan ke disk dilakukan worker latar belakang
+image_store = ImageWriteQueue(CAPTURED_IMAGES_DIR, url_prefix="/images")
+
+# --- STATE ABSENSI HARI INI (IN-MEMORY) ---
+# Cek duplikat IN/OUT tanpa query DB; disinkronkan antar worker via LISTEN/NOTIFY
+attendance_state = TodayState()
+attendance_listener = None
+
+# --- STATUS KESIAPAN (READINESS) ---
+# /readyz hanya melaporkan siap jika semua komponen bernilai True
+readiness = {"database": False, "face_index": False, "models": False}
+
 # --- INISIALISASI APLIKASI ---
 app = FastAPI(title="DeepFace Absensi API")
 app.add_middleware(
@@ -112,9 +186,27 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+class ImmutableStaticFiles(StaticFiles):
+    """
+    StaticFiles dengan header cache jangka panjang HANYA untuk path di bawah
+    `immutable_prefix` (thumbnail ber-shard yang tidak pernah diubah). Gambar penuh dan
+    path lama (layout datar) bisa ditimpa/dihapus, jadi tetap memakai cache default.
+    """
+
+    def __init__(self, *args, immutable_prefix: str, **kwargs):
+        self.immutable_prefix = immutable_prefix.strip("/") + "/"
+        super().__init__(*args, **kwargs)
+
+    async def get_response(self, path, scope):
+        response = await super().get_response(path, scope)
+        if response.status_code in (200, 304) and path.replace("\\", "/").startswith(self.immutable_prefix):
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+
 # Mount folder audio, images, dan faces
 app.mount("/audio", StaticFiles(directory=str(AUDIO_FILES_DIR), check_dir=True), name="generated_audio")
-app.mount("/images", StaticFiles(directory=str(CAPTURED_IMAGES_DIR), check_dir=True), name="captured_images")
+app.mount("/images", ImmutableStaticFiles(directory=str(CAPTURED_IMAGES_DIR), check_dir=True, immutable_prefix=THUMB_DIR_NAME),
+          name="captured_images")
 app.mount("/faces", StaticFiles(directory=str(FACES_DIR), check_dir=True), name="faces")
 
 
@@ -157,21 +249,6 @@ def format_time_to_hms(time_obj) -> str:
         except AttributeError:
              return str(time_obj)
 
-def generate_audio_file(filename: str, text: str):
-    """Menghasilkan dan menyimpan file audio MP3 menggunakan gTTS jika belum ada."""
-    audio_path = AUDIO_FILES_DIR / filename
-    os.makedirs(AUDIO_FILES_DIR, exist_ok=True)
-
-    if audio_path.exists():
-        return
-
-    try:
-        print(f"   -> 🔊 Generating TTS file: {filename} for text: '{text}'...")
-        tts = gTTS(text=text, lang='id')
-        tts.save(str(audio_path))
-    except Exception as e:
-        print(f"❌ ERROR: Gagal generate file audio {filename}. Pastikan Anda memiliki koneksi internet: {e}")
-
 # --- LOGIKA VALIDASI ABSENSI KRITIS (Waktu WIB) ---
 
 # Definisikan Aturan Jam Kerja
@@ -198,106 +275,118 @@ def check_attendance_status(kategori: str, type_absensi: str, log_time: datetime
 
 # --- FUNGSI DATABASE HELPERS (POSTGRESQL) ---
 
-def connect_db():
-    """Membuat koneksi ke Database Vektor/Log (PostgreSQL) dan mendaftarkan tipe vector."""
+class VectorConnectionPool(psycopg2.pool.ThreadedConnectionPool):
+    """
+    ThreadedConnectionPool yang mendaftarkan tipe vector sekali per koneksi baru dan
+    memblokir (bukan error) saat semua koneksi sedang dipakai.
+    """
+
+    def __init__(self, minconn, maxconn, *args, **kwargs):
+        self._slots = threading.BoundedSemaphore(maxconn)
+        super().__init__(minconn, maxconn, *args, **kwargs)
+
+    def _connect(self, key=None):
+        conn = super()._connect(key)
+        register_vector_type(conn)
+        # Default ef_search/probes per sesi; query tertentu bisa override dengan SET LOCAL
+        with conn.cursor() as cursor:
+            apply_search_params(cursor, local=False)
+        conn.commit()
+        return conn
+
+    def getconn(self, key=None):
+        if not self._slots.acquire(timeout=DB_POOL_TIMEOUT):
+            raise psycopg2.pool.PoolError(f"Pool koneksi habis (menunggu > {DB_POOL_TIMEOUT}s).")
+        try:
+            return super().getconn(key)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, key=None, close=False):
+        try:
+            super().putconn(conn, key, close)
+        finally:
+            self._slots.release()
+
+
+def register_vector_type(conn):
+    """Mendaftarkan caster pgvector -> NumPy float32 pada koneksi (OID di-cache per proses)."""
+    register_vector(conn, vector_oid)
+
+def init_db_pool():
+    """
+    Membuat pool koneksi bersama (sekali saat startup). Ekstensi vector dan OID tipe
+    'vector' hanya diperiksa sekali di sini, bukan di setiap koneksi.
+    """
+    global db_pool, vector_oid
+    if db_pool is not None:
+        return db_pool
+
     conn = None
     try:
         conn = psycopg2.connect(host=DB_HOST, database=DB_NAME, user=DB_USER, password=DB_PASSWORD, port=DB_PORT)
         with conn.cursor() as cur:
             cur.execute("CREATE EXTENSION IF NOT EXISTS vector;")
             conn.commit()
-            cur.execute("SELECT oid FROM pg_type WHERE typname = 'vector'")
-            row = cur.fetchone()
-            if not row:
-                raise Exception("❌ Ekstensi pgvector belum aktif di database.")
-            vector_oid = row[0]
-
-        def cast_vector(data, cur):
-            if data is None: return None
-            cleaned_data = data.strip('{}[]')
-            return np.array([float(x.strip()) for x in cleaned_data.split(',')])
-
-        psycopg2.extensions.register_type(
-            psycopg2.extensions.new_type((vector_oid,), 'vector', cast_vector),
-            conn
-        )
-        return conn
+        vector_oid = lookup_vector_oid(conn)
     except psycopg2.Error as e:
         print(f"❌ Gagal koneksi ke Database PostgreSQL: {e}")
-        print(f"   -> Mencoba terhubung ke {DB_HOST}:{DB_PORT}")
-        if conn: conn.close()
+        print(f"   -> Mencoba terhubung ke {DB_HOST}:{DB_PORT}")
         raise Exception("Database PostgreSQL tidak terhubung/konfigurasi salah.")
+    finally:
+        if conn: conn.close()
 
-def initialize_db():
-    """Memastikan tabel ada saat startup (SKEMA BENAR)."""
-    conn = None
-    try:
-        conn = connect_db()
-        cursor = conn.cursor()
-        cursor.execute("CREATE EXTENSION IF NOT EXISTS vector;")
+    db_pool = VectorConnectionPool(
+        DB_POOL_MIN, DB_POOL_MAX,
+        host=DB_HOST, database=DB_NAME, user=DB_USER, password=DB_PASSWORD, port=DB_PORT
+    )
+    print(f"✅ Pool koneksi PostgreSQL aktif ({DB_POOL_MIN}-{DB_POOL_MAX} koneksi).")
+    return db_pool
 
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS interns (
-                id SERIAL PRIMARY KEY,
-                name TEXT NOT NULL UNIQUE,
-                instansi TEXT,
-                kategori TEXT
-            );
-        """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS attendance_logs (
-                log_id SERIAL PRIMARY KEY,
-                intern_id INTEGER REFERENCES interns(id),
-                intern_name TEXT NOT NULL,
-                instansi TEXT,
-                kategori TEXT,
-                image_url TEXT,
-                absent_at TIMESTAMP WITHOUT TIME ZONE,
-                type TEXT NOT NULL DEFAULT 'IN'
-            );
-        """)
-        cursor.execute(f"""
-            CREATE TABLE IF NOT EXISTS intern_embeddings (
-                id SERIAL PRIMARY KEY,
-                intern_id INTEGER REFERENCES interns(id),
-                name TEXT NOT NULL,
-                instansi TEXT,
-                kategori TEXT,
-                embedding VECTOR({EMBEDDING_DIM}) NOT NULL,
-                file_path TEXT NOT NULL
-            );
-        """)
-        cursor.execute(f"""
-            CREATE TABLE IF NOT EXISTS intern_centroids (
-                id SERIAL PRIMARY KEY,
-                intern_id INTEGER UNIQUE REFERENCES interns(id),
-                name TEXT NOT NULL UNIQUE,
-                instansi TEXT,
-                kategori TEXT,
-                embedding VECTOR({EMBEDDING_DIM}) NOT NULL
-            );
-        """)
+def close_db_pool():
+    global db_pool
+    if db_pool is not None:
+        db_pool.closeall()
+        db_pool = None
 
-        # Memasukkan data awal interns (jika belum ada)
-        initial_interns = [
-            ('Said', 'Universitas Muhammadiyah Surabaya', 'Mahasiswa Internship'),
-            ('Muarif', 'Universitas Muhammadiyah Surabaya', 'Mahasiswa Internship'),
-            ('Nani', 'Universitas Muhammadiyah Surabaya', 'Mahasiswa Internship'),
-            ('Vinda', 'Universitas Muhammadiyah Surabaya', 'Mahasiswa Internship'),
-            ('Harun', 'Universitas Pakuan Bogor', 'Mahasiswa Internship'),
-            ('Pak Nugroho', 'IT Planning', 'General Manager'), # Update kategori
-            # Tambahkan intern lain dari CSV jika perlu
-            ('A\'yun', 'Universitas Muhammadiyah Surabaya', 'Mahasiswa Internship'),
-            ('Isra', 'Universitas Pakuan Bogor', 'Mahasiswa Internship'),
-            # ... (Lanjutkan sesuai interns.csv Anda)
-        ]
-        cursor.executemany("""
-            INSERT INTO interns (name, instansi, kategori)
-            VALUES (%s, %s, %s)
-            ON CONFLICT (name) DO NOTHING;
-        """, initial_interns)
+async def run_db(func, *args, executor=None, **kwargs):
+    """
+    Menjalankan fungsi DB (blocking psycopg2) di thread executor agar event loop tetap
+    bebas. Default memakai executor dashboard/admin; jalur kiosk memakai executor sendiri.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor or db_executor, functools.partial(func, *args, **kwargs))
 
+@contextmanager
+def db_transaction(conn=None):
+    """
+    Meminjam koneksi dari pool untuk satu transaksi: commit jika sukses, rollback jika
+    error, lalu dikembalikan ke pool. Jika `conn` diberikan, koneksi (dan transaksi)
+    milik pemanggil dipakai ulang apa adanya.
+    """
+    if conn is not None:
+        yield conn
+        return
+
+    if db_pool is None:
+        raise Exception("Pool koneksi database belum diinisialisasi.")
+    conn = db_pool.getconn()
+    try:
+        yield conn
         conn.commit()
+    except Exception:
+        if not conn.closed: conn.rollback()
+        raise
+    finally:
+        db_pool.putconn(conn, close=bool(conn.closed))
+
+def initialize_db():
+    """Memastikan tabel ada saat startup (SKEMA BENAR)."""
+    try:
+        init_db_pool()
+        with db_transaction() as conn:
+            _create_schema(conn.cursor())
         print(f"✅ PostgreSQL Database berhasil diinisialisasi.")
 
         os.makedirs(CAPTURED_IMAGES_DIR, exist_ok=True)
@@ -307,145 +396,410 @@ def initialize_db():
 
     except psycopg2.Error as e:
         print(f"❌ KRITIS: Gagal menginisialisasi tabel PostgreSQL: {e}")
-        if conn: conn.rollback()
         raise Exception(f"Gagal inisialisasi database PostgreSQL: {e}")
-    finally:
-        if conn: conn.close()
 
-def get_or_create_intern(name: str, instansi: str = "Intern", kategori: str = "Unknown"):
+def _create_schema(cursor):
+    """Membuat tabel yang belum ada dan data awal interns (idempoten)."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS interns (
+            id SERIAL PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE,
+            instansi TEXT,
+            kategori TEXT
+        );
+    """)
+    # Log absensi: partisi RANGE bulanan pada absent_at + indeks (intern_id, absent_at DESC)
+    today_wib = get_current_wib_datetime().date()
+    migrate_attendance_logs(cursor, today_wib) # Tabel lama tanpa partisi -> ber-partisi (sekali)
+    create_attendance_logs_table(cursor)
+    # Epoch reset bersama antar worker (validasi cache duplikat)
+    ensure_reset_epoch_schema(cursor)
+    ensure_log_partitions(cursor, today_wib)
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS intern_embeddings (
+            id SERIAL PRIMARY KEY,
+            intern_id INTEGER REFERENCES interns(id),
+            name TEXT NOT NULL,
+            instansi TEXT,
+            kategori TEXT,
+            embedding VECTOR({EMBEDDING_DIM}) NOT NULL,
+            file_path TEXT NOT NULL,
+            content_hash TEXT
+        );
+    """)
+    cursor.execute("ALTER TABLE intern_embeddings ADD COLUMN IF NOT EXISTS content_hash TEXT;")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_content_hash ON intern_embeddings (content_hash);")
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS intern_centroids (
+            id SERIAL PRIMARY KEY,
+            intern_id INTEGER UNIQUE REFERENCES interns(id),
+            name TEXT NOT NULL UNIQUE,
+            instansi TEXT,
+            kategori TEXT,
+            embedding VECTOR({EMBEDDING_DIM}) NOT NULL,
+            embedding_sum VECTOR({EMBEDDING_DIM}),
+            embedding_count INTEGER NOT NULL DEFAULT 0
+        );
+    """)
+    # Running sum & jumlah embedding untuk pembaruan centroid incremental (index-on-upload)
+    cursor.execute(f"ALTER TABLE intern_centroids ADD COLUMN IF NOT EXISTS embedding_sum VECTOR({EMBEDDING_DIM});")
+    cursor.execute("ALTER TABLE intern_centroids ADD COLUMN IF NOT EXISTS embedding_count INTEGER NOT NULL DEFAULT 0;")
+    # Manifest dataset (path, size, mtime, hash) untuk indexing incremental
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS dataset_manifest (
+            file_path TEXT PRIMARY KEY,
+            intern_id INTEGER REFERENCES interns(id) ON DELETE CASCADE,
+            file_size BIGINT NOT NULL,
+            mtime_ns BIGINT NOT NULL,
+            content_hash TEXT NOT NULL
+        );
+    """)
+    # Indeks ANN kosinus (HNSW/IVFFlat) untuk fallback pencarian centroid di DB (search_centroids_db)
+    create_vector_indexes(cursor)
+    # Arsip log absensi lama (partisi per bulan, diisi oleh job retensi)
+    ensure_archive_schema(cursor)
+
+    # Memasukkan data awal interns (jika belum ada)
+    initial_interns = [
+        ('Said', 'Universitas Muhammadiyah Surabaya', 'Mahasiswa Internship'),
+        ('Muarif', 'Universitas Muhammadiyah Surabaya', 'Mahasiswa Internship'),
+        ('Nani', 'Universitas Muhammadiyah Surabaya', 'Mahasiswa Internship'),
+        ('Vinda', 'Universitas Muhammadiyah Surabaya', 'Mahasiswa Internship'),
+        ('Harun', 'Universitas Pakuan Bogor', 'Mahasiswa Internship'),
+        ('Pak Nugroho', 'IT Planning', 'General Manager'), # Update kategori
+        # Tambahkan intern lain dari CSV jika perlu
+        ('A\'yun', 'Universitas Muhammadiyah Surabaya', 'Mahasiswa Internship'),
+        ('Isra', 'Universitas Pakuan Bogor', 'Mahasiswa Internship'),
+        # ... (Lanjutkan sesuai interns.csv Anda)
+    ]
+    cursor.executemany("""
+        INSERT INTO interns (name, instansi, kategori)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (name) DO NOTHING;
+    """, initial_interns)
+
+def get_or_create_intern(name: str, instansi: str = "Intern", kategori: str = "Unknown", conn=None):
     """Mendapatkan ID intern yang sudah ada atau membuat entri baru di PostgreSQL."""
-    conn = None
     try:
-        conn = connect_db()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, instansi, kategori FROM interns WHERE name = %s", (name,))
-        result = cursor.fetchone()
-        if result:
-            return result[0], result[1], result[2]
-        else:
+        with db_transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, instansi, kategori FROM interns WHERE name = %s", (name,))
+            result = cursor.fetchone()
+            if result:
+                return result[0], result[1], result[2]
             cursor.execute(
                 "INSERT INTO interns (name, instansi, kategori) VALUES (%s, %s, %s) RETURNING id",
                 (name, instansi, kategori)
             )
             intern_id = cursor.fetchone()[0]
-            conn.commit()
             return intern_id, instansi, kategori
     except Exception as e:
         print(f"❌ Gagal mendapatkan/membuat entri intern di PostgreSQL: {e}")
-        if conn: conn.rollback()
         raise Exception(f"Gagal mengelola data intern: {e}")
-    finally:
-        if conn: conn.close()
 
-def get_latest_attendance(intern_name: str) -> Optional[Dict[str, str]]:
+def get_today_bounds():
+    """
+    Rentang setengah-terbuka [00:00 hari ini, 00:00 besok) dalam WIB naive (konvensi kolom
+    absent_at). Dipakai sebagai filter sargable pengganti `absent_at::date = CURRENT_DATE`,
+    sehingga indeks & partition pruning bisa dipakai.
+    """
+    start = get_current_wib_datetime().replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+    return start, start + timedelta(days=1)
+
+def get_latest_attendance(intern_name: str, conn=None, intern_id: Optional[int] = None) -> Optional[Dict[str, str]]:
     """Mendapatkan log absensi terakhir untuk intern hari ini (IN/OUT)."""
-    conn = None
+    day_start, day_end = get_today_bounds()
+    # intern_id (jika diketahui) memakai indeks (intern_id, absent_at DESC)
+    key_column, key_value = ("intern_id", intern_id) if intern_id is not None else ("intern_name", intern_name)
     try:
-        conn = connect_db()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            SELECT intern_name, type, absent_at
-            FROM attendance_logs
-            WHERE intern_name = %s AND absent_at::date = CURRENT_DATE
-            ORDER BY absent_at DESC
-            LIMIT 1
-            """,
-            (intern_name,)
-        )
-        result = cursor.fetchone()
-        if result:
-            return {"name": result[0], "type": result[1], "absent_at": result[2].isoformat()}
-        return None
+        with db_transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                SELECT intern_name, type, absent_at
+                FROM attendance_logs
+                WHERE {key_column} = %s AND absent_at >= %s AND absent_at < %s
+                ORDER BY absent_at DESC
+                LIMIT 1
+                """,
+                (key_value, day_start, day_end)
+            )
+            result = cursor.fetchone()
+            if result:
+                return {"name": result[0], "type": result[1], "absent_at": result[2].isoformat()}
+            return None
     except Exception as e:
         print(f"❌ Gagal memeriksa log absensi terakhir: {e}")
         return None
-    finally:
-        if conn: conn.close()
 
 
-def log_attendance(intern_name: str, instansi: str, kategori: str, image_url: str, type_absensi: str):
-    """Mencatat log absensi ke database PostgreSQL (dengan jenis 'IN' atau 'OUT')."""
-    conn = None
+def log_attendance(intern_name: str, instansi: str, kategori: str, image_url: str, type_absensi: str,
+                   intern_id: Optional[int] = None, conn=None, absent_at: Optional[datetime] = None):
+    """
+    Mencatat log absensi ke database PostgreSQL (dengan jenis 'IN' atau 'OUT').
+    Jika `intern_id` sudah diketahui (misal dari indeks wajah), lookup intern dilewati.
+    Worker lain diberi tahu lewat NOTIFY saat transaksi ter-commit.
+    """
     try:
-        intern_id, _, _ = get_or_create_intern(intern_name, instansi, kategori)
-        conn = connect_db()
-        cursor = conn.cursor()
-        wib_time = get_current_wib_datetime().replace(tzinfo=None)
-        cursor.execute(
-            "INSERT INTO attendance_logs (intern_id, intern_name, instansi, kategori, image_url, absent_at, type) VALUES (%s, %s, %s, %s, %s, %s, %s)",
-            (intern_id, intern_name, instansi, kategori, image_url, wib_time, type_absensi)
-        )
-        conn.commit()
-        return intern_id
+        with db_transaction(conn) as conn:
+            if intern_id is None:
+                intern_id, _, _ = get_or_create_intern(intern_name, instansi, kategori, conn=conn)
+            cursor = conn.cursor()
+            wib_time = absent_at or get_current_wib_datetime().replace(tzinfo=None)
+            cursor.execute(
+                "INSERT INTO attendance_logs (intern_id, intern_name, instansi, kategori, image_url, absent_at, type) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                (intern_id, intern_name, instansi, kategori, image_url, wib_time, type_absensi)
+            )
+            notify_attendance(cursor, intern_id, intern_name, type_absensi, wib_time,
+                              instansi=instansi, kategori=kategori, image_url=image_url)
+            return intern_id
     except Exception as e:
         print(f"❌ Gagal mencatat log absensi: {e}")
-        if conn: conn.rollback()
         return None
-    finally:
-        if conn: conn.close()
+
+def record_attendance(intern_id: int, name: str, instansi: str, kategori: str, type_absensi: str,
+                      clean_name: str, image_bytes: bytes, image=None):
+    """
+    Cek duplikat + catat log. Duplikat dideteksi dari state in-memory (tanpa query DB);
+    jika bukan duplikat, cek ulang + insert dilakukan dalam SATU transaksi di bawah
+    advisory lock per intern agar konsisten antar worker. Gambar diantrekan ke
+    image_store setelah commit (tidak menunggu disk).
+
+    Returns:
+        tuple: (latest_log, is_duplicate, image_url)
+    """
+    now_wib = get_current_wib_datetime() # Gunakan WIB
+    absent_at = now_wib.replace(tzinfo=None)
+
+    cached = attendance_state.get(intern_id, absent_at.date())
+    if cached is not None and cached.type == type_absensi and attendance_state_is_current():
+        return {"name": cached.name, "type": cached.type, "absent_at": cached.absent_at.isoformat()}, True, ""
+
+    image_url = ""
+    image_filename = None
+    logged = False
+    with db_transaction() as conn:
+        lock_intern_attendance(conn.cursor(), intern_id)
+        latest_log = get_latest_attendance(name, conn=conn, intern_id=intern_id)
+        is_duplicate = bool(latest_log and latest_log['type'] == type_absensi)
+
+        if not is_duplicate:
+            timestamp = now_wib.strftime("%Y%m%d_%H%M%S")
+            # Layout ber-shard YYYY/MM/DD agar satu folder tidak menampung semua gambar
+            image_filename = sharded_path(f"{timestamp}_{clean_name}_{type_absensi}.jpg", now_wib)
+            image_url = image_store.url_for(image_filename)
+            logged = log_attendance(name, instansi, kategori, image_url, type_absensi,
+                                    intern_id=intern_id, conn=conn, absent_at=absent_at) is not None
+
+    # Transaksi sudah ter-commit: perbarui state lokal, lalu gambar ditulis di latar belakang
+    if logged:
+        attendance_state.record(intern_id, name, type_absensi, absent_at)
+        today_snapshot.apply(name, instansi, kategori, absent_at, image_url, type_absensi)
+        image_store.submit(image_filename, image_bytes, image=image)
+    elif latest_log:
+        # State lokal tertinggal dari worker lain: sinkronkan dari hasil DB
+        attendance_state.record(intern_id, name, latest_log['type'], datetime.fromisoformat(latest_log['absent_at']))
+    return latest_log, is_duplicate, image_url
+
+def record_attendance_batch(matches, type_absensi: str, image_bytes: bytes, image=None):
+    """
+    Versi multi-wajah dari record_attendance: semua intern yang dikenali pada satu frame
+    dicek duplikatnya dan dicatat dalam SATU transaksi (advisory lock per intern dengan
+    urutan intern_id tetap agar tidak deadlock, satu query log terakhir, satu INSERT
+    massal). Semua log memakai satu gambar frame yang sama.
+
+    Args:
+        matches: list (intern_id, name, instansi, kategori) — boleh berisi intern yang sama.
+
+    Returns:
+        list of tuple: (latest_log, is_duplicate, image_url) per elemen `matches`.
+    """
+    now_wib = get_current_wib_datetime()
+    absent_at = now_wib.replace(tzinfo=None)
+    outcomes = [None] * len(matches)
+
+    pending = {} # intern_id -> indeks pertama di matches
+    # Duplikat dari cache hanya dipakai jika tidak ada reset yang terlewat (satu cek per frame)
+    use_cache = any(
+        cached is not None and cached.type == type_absensi
+        for cached in (attendance_state.get(match[0], absent_at.date()) for match in matches)
+    ) and attendance_state_is_current()
+    for i, (intern_id, name, instansi, kategori) in enumerate(matches):
+        cached = attendance_state.get(intern_id, absent_at.date()) if use_cache else None
+        if cached is not None and cached.type == type_absensi:
+            outcomes[i] = ({"name": cached.name, "type": cached.type, "absent_at": cached.absent_at.isoformat()}, True, "")
+        else:
+            pending.setdefault(intern_id, i)
+
+    logged = []
+    if pending:
+        timestamp = now_wib.strftime("%Y%m%d_%H%M%S")
+        image_filename = sharded_path(f"{timestamp}_group_{uuid.uuid4().hex[:8]}_{type_absensi}.jpg", now_wib)
+        image_url = image_store.url_for(image_filename)
+        intern_ids = sorted(pending)
+        with db_transaction() as conn:
+            cursor = conn.cursor()
+            for intern_id in intern_ids:
+                lock_intern_attendance(cursor, intern_id)
+            cursor.execute("""
+                SELECT DISTINCT ON (intern_id) intern_id, intern_name, type, absent_at
+                FROM attendance_logs
+                WHERE intern_id = ANY(%s) AND absent_at >= %s AND absent_at < %s
+                ORDER BY intern_id, absent_at DESC
+            """, (intern_ids,) + get_today_bounds())
+            latest = {row[0]: {"name": row[1], "type": row[2], "absent_at": row[3].isoformat()} for row in cursor.fetchall()}
+
+            rows = []
+            for intern_id in intern_ids:
+                i = pending[intern_id]
+                latest_log = latest.get(intern_id)
+                if latest_log and latest_log['type'] == type_absensi:
+                    outcomes[i] = (latest_log, True, "")
+                    continue
+                _, name, instansi, kategori = matches[i]
+                rows.append((intern_id, name, instansi, kategori, image_url, absent_at, type_absensi))
+                outcomes[i] = (latest_log, False, image_url)
+            if rows:
+                psycopg2.extras.execute_values(
+                    cursor,
+                    "INSERT INTO attendance_logs (intern_id, intern_name, instansi, kategori, image_url, absent_at, type) VALUES %s",
+                    rows
+                )
+                for intern_id, name, instansi, kategori, _, _, _ in rows:
+                    notify_attendance(cursor, intern_id, name, type_absensi, absent_at,
+                                      instansi=instansi, kategori=kategori, image_url=image_url)
+            logged = rows
+
+        # Transaksi sudah ter-commit: perbarui state lokal, lalu satu gambar frame ditulis di latar belakang
+        for intern_id, name, instansi, kategori, _, _, _ in logged:
+            attendance_state.record(intern_id, name, type_absensi, absent_at)
+            today_snapshot.apply(name, instansi, kategori, absent_at, image_url, type_absensi)
+        if logged:
+            image_store.submit(image_filename, image_bytes, image=image)
+
+    # Intern yang muncul lebih dari sekali pada frame memakai hasil kemunculan pertamanya
+    for i, (intern_id, _, _, _) in enumerate(matches):
+        if outcomes[i] is None:
+            outcomes[i] = outcomes[pending[intern_id]]
+    return outcomes
+
+def warm_attendance_state():
+    """Mengisi state absensi & snapshot hari ini dari DB (startup & setiap listener tersambung ulang)."""
+    day_start, day_end = get_today_bounds()
+    with db_transaction() as conn:
+        count = attendance_state.warm(conn, day_start, day_end)
+    today_snapshot.load(day_start.date(), fetch_today_attendance_rows())
+    print(f"✅ [AttendanceState] State hari ini dimuat: {count} intern.")
+
+def attendance_state_is_current() -> bool:
+    """
+    Memastikan state in-memory tidak melewatkan reset (NOTIFY bisa hilang saat listener
+    tersambung ulang): epoch reset di DB dibandingkan dengan epoch state (satu baris PK).
+    Jika berbeda, state & snapshot dimuat ulang dan False dikembalikan.
+    """
+    with db_transaction() as conn:
+        epoch = read_reset_epoch(conn.cursor())
+    if epoch == attendance_state.epoch:
+        return True
+    print(f"⚠️ [AttendanceState] Epoch reset berubah ({attendance_state.epoch} -> {epoch}). Memuat ulang state...")
+    warm_attendance_state()
+    return False
+
+def apply_attendance_notification(payload: str):
+    """Callback NOTIFY dari worker lain (atau worker ini sendiri; idempoten)."""
+    event = parse_notification(payload)
+    if isinstance(event, ResetEvent):
+        # Reset dari worker mana pun: cache duplikat & snapshot hari itu tidak berlaku lagi
+        attendance_state.clear(epoch=event.epoch)
+        today_snapshot.clear(event.day)
+        return
+    attendance_state.record(event.intern_id, event.name, event.type, event.absent_at)
+    today_snapshot.apply(event.name, event.instansi, event.kategori, event.absent_at, event.image_url, event.type)
+
+def start_attendance_listener():
+    global attendance_listener
+    attendance_listener = StateListener(
+        connect=lambda: psycopg2.connect(host=DB_HOST, database=DB_NAME, user=DB_USER, password=DB_PASSWORD, port=DB_PORT),
+        on_event=apply_attendance_notification,
+        on_listen=warm_attendance_state,
+    )
+    attendance_listener.start()
 
 def reset_attendance_logs():
     """Menghapus SEMUA log absensi HARI INI dari tabel attendance_logs."""
-    conn = None
     try:
-        conn = connect_db()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM attendance_logs WHERE absent_at::date = CURRENT_DATE")
-        deleted_count = cursor.rowcount
-        conn.commit()
+        day_start, day_end = get_today_bounds()
+        with db_transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM attendance_logs WHERE absent_at >= %s AND absent_at < %s", (day_start, day_end))
+            deleted_count = cursor.rowcount
+            # Epoch naik + NOTIFY di transaksi yang sama: worker lain mengosongkan cache-nya
+            epoch = bump_reset_epoch(cursor)
+            notify_reset(cursor, day_start.date(), epoch)
+        attendance_state.clear(epoch=epoch) # Duplikat hari ini tidak berlaku lagi
+        today_snapshot.clear(day_start.date())
         print(f"✅ [SCHEDULER] RESET ABSENSI BERHASIL: {deleted_count} log hari ini dihapus.")
         return deleted_count
     except Exception as e:
         print(f"❌ Gagal mereset log absensi PostgreSQL: {e}")
-    finally:
-        if conn: conn.close()
 
-# --- FUNGSI SUBPROCESS YANG DIPERBAIKI (SANGAT KRITIS) ---
+def run_retention_job():
+    """Job retensi harian: arsipkan log lama & bersihkan gambar lama, lalu laporkan ruang yang dibebaskan."""
+    try:
+        with db_transaction() as conn:
+            report = run_retention(conn, CAPTURED_IMAGES_DIR, get_current_wib_datetime().replace(tzinfo=None))
+        print(f"✅ [SCHEDULER] RETENSI SELESAI: {report['logs_archived']} log diarsipkan, "
+              f"{report['images']['files_removed']} file gambar dihapus ({report['megabytes_reclaimed']} MB dibebaskan).")
+        return report
+    except Exception as e:
+        print(f"❌ [SCHEDULER] Job retensi gagal: {e}")
+        raise
+
+def reload_face_index():
+    """Memuat ulang indeks wajah in-memory (centroid/prototipe) dari database (swap atomik)."""
+    with db_transaction() as conn:
+        index = reload_match_index(conn)
+    # Audio sapaan intern yang baru di-index dirender lebih dulu, bukan saat absen pertama
+    audio_cache.prerender_interns(index.names)
+    return index
+
+# --- WORKER INDEXING IN-PROCESS ---
 
-def run_indexing_subprocess():
+def run_index_inference(job, func, *args):
     """
-    Fungsi wrapper yang akan dijalankan oleh Background Task.
-    Meneruskan env var yang benar ke subprocess.
+    Menjalankan deteksi/embedding job indexing lewat inference_pool (admission control yang
+    sama dengan /recognize). Job hanya masuk saat ada worker menganggur dan tidak memakai slot
+    antrean kiosk; selama pool sibuk, job menunggu (bisa dibatalkan).
     """
-    print("🚀 [Background Task] Memulai subprocess index_data.py...")
-    try:
-        command = [sys.executable, "-u", "-m", "backend.index_data"]
-
-        # --- PERUBAHAN KRITIS: Teruskan Environment Variables ---
-        current_env = os.environ.copy()
-        current_env["DB_HOST"] = DB_HOST
-        current_env["DB_PORT"] = DB_PORT
-        current_env["DB_NAME"] = DB_NAME
-        current_env["DB_USER"] = DB_USER
-        current_env["DB_PASSWORD"] = DB_PASSWORD
-        # Juga teruskan PYTHONPATH jika ada, penting untuk import
-        if 'PYTHONPATH' in os.environ:
-             current_env['PYTHONPATH'] = os.environ['PYTHONPATH']
-        # ----------------------------------------------------
-
-        process = subprocess.run(
-            command,
-            cwd=str(PROJECT_ROOT),
-            capture_output=True,
-            text=True,
-            check=True,
-            env=current_env  # <<< Menggunakan env yang dimodifikasi
-        )
+    while True:
+        if job.cancel_event.is_set():
+            raise IndexingCancelled("Indexing dibatalkan.")
+        if inference_pool.in_flight < inference_pool.workers:
+            try:
+                return inference_pool.submit(func, *args).result()
+            except InferenceQueueFull:
+                pass
+        time.sleep(0.05)
 
-        print("✅ [Background Task] Indexing Selesai.")
-        print(process.stdout)
+def run_index_job(job):
+    """
+    Menjalankan indexing incremental di thread worker indexing: model & detektor yang
+    sudah dimuat dipakai ulang (tanpa subprocess baru), inferensi lewat inference_pool,
+    dan koneksi pool dipinjam per fase/batch.
+    """
+    return index_data_incremental(
+        workers=INDEX_JOB_WORKERS,
+        connection=db_transaction,
+        run_inference=functools.partial(run_index_inference, job),
+        progress=lambda **counts: job.progress.update(counts),
+        should_cancel=job.cancel_event.is_set,
+    )
 
-    except subprocess.CalledProcessError as e:
-        print(f"❌ [Background Task] Indexing Gagal (Error Subprocess):")
-        print("================== STANDARD ERROR (stderr) ==================")
-        print(e.stderr)
-        print("================== STANDARD OUTPUT (stdout) ==================")
-        print(e.stdout)
-        print("===========================================================")
+def finish_index_job(job):
+    reload_face_index() # Centroid baru langsung dipakai oleh /recognize
+    readiness["face_index"] = True
 
-    except Exception as e:
-        print(f"❌ [Background Task] Gagal menjalankan subprocess: {e}")
+index_jobs = IndexJobManager(run_index_job, on_finished=finish_index_job)
 
 # --- STARTUP EVENT (VERSI DEPLOY) ---
 
@@ -464,6 +818,7 @@ async def startup_event():
         try:
             initialize_db() # Coba inisialisasi
             connected = True # Jika berhasil, setel flag
+            readiness["database"] = True
             print("✅ [Startup] Inisialisasi database BERHASIL.")
             
         except Exception as e:
@@ -477,6 +832,21 @@ async def startup_event():
                 # Hentikan aplikasi jika gagal total, tapi jangan sys.exit
                 raise e # Biarkan FastAPI menangani error startup
 
+    # --- STATE ABSENSI HARI INI (WARM + LISTEN/NOTIFY ANTAR WORKER) ---
+    today_snapshot.bind_loop(asyncio.get_running_loop())
+    start_attendance_listener()
+
+    # --- CACHE AUDIO (SCAN TRACK + PRE-RENDER PROMPT TETAP) ---
+    audio_cache.start()
+    image_store.start()
+
+    # --- MUAT INDEKS CENTROID IN-MEMORY ---
+    try:
+        reload_face_index()
+        readiness["face_index"] = True
+    except Exception as e:
+        print(f"⚠️ [Startup] Gagal memuat indeks centroid: {e}")
+
     # --- LOGIKA PENJADWALAN ---
     # Kode ini hanya akan berjalan jika 'initialize_db()' berhasil
     global scheduler
@@ -487,132 +857,317 @@ async def startup_event():
         id='daily_attendance_reset',
         name='Daily Absensi Log Reset'
     )
+    scheduler.add_job(
+        run_retention_job,
+        CronTrigger(hour=RETENTION_HOUR, minute=RETENTION_MINUTE, timezone=str(local_tz)),
+        id='daily_retention',
+        name='Daily Retention (Archive Logs & Prune Images)'
+    )
     scheduler.start()
     print(f"✅ Penjadwalan reset absensi harian ({DAILY_RESET_HOUR}:{DAILY_RESET_MINUTE} WIB) aktif.")
+    embedding_batcher.start()
+    index_jobs.start()
+    print(f"✅ Pool inferensi aktif ({inference_pool.workers} worker, antrean {inference_pool.queue_size}).")
+    print(f"✅ Micro-batching aktif (maks {embedding_batcher.max_batch_size} wajah / {embedding_batcher.max_wait * 1000:.0f} ms).")
+
+    # --- PEMANASAN MODEL ---
+    # Berjalan di background: /healthz langsung hidup, /readyz menunggu warm-up selesai
+    asyncio.create_task(warmup_inference())
     print("✅ Startup event selesai. Server siap menerima koneksi.")
 
+async def warmup_inference():
+    """Membangun model & detektor lalu menjalankan inferensi dummy di pool inferensi."""
+    start_time = time.time()
+    print("🔥 [Warm-up] Memuat model dan detektor wajah...")
+    try:
+        await inference_pool.run(warmup_models)
+        readiness["models"] = True
+        print(f"✅ [Warm-up] Model siap dalam {time.time() - start_time:.2f}s.")
+    except Exception as e:
+        print(f"❌ [Warm-up] Gagal memanaskan model: {e}")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Menghentikan scheduler dan pool inferensi dengan rapi."""
+    if scheduler:
+        scheduler.shutdown(wait=False)
+    await embedding_batcher.stop()
+    index_jobs.stop()
+    audio_cache.stop()
+    image_store.drain() # Pastikan semua gambar absensi tertulis sebelum proses berhenti
+    if attendance_listener:
+        attendance_listener.stop()
+    inference_pool.shutdown(wait=False)
+    db_executor.shutdown(wait=True)
+    kiosk_db_executor.shutdown(wait=True)
+    close_db_pool()
+
+# --- ENDPOINTS HEALTH CHECK (LOAD BALANCER) ---
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: proses hidup dan event loop merespons."""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: DB terhubung, indeks dimuat, dan model sudah di-warm-up."""
+    ready = all(readiness.values())
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": "ready" if ready else "not_ready", "checks": readiness}
+    )
+
+@app.get("/metrics/inference")
+async def inference_metrics():
+    """Metrik pool inferensi dan ukuran batch yang tercapai."""
+    return {"pool": inference_pool.stats(), "batching": embedding_batcher.stats()}
+
+@app.get("/metrics/images")
+async def image_metrics():
+    """Status antrean penulisan gambar absensi."""
+    return image_store.stats()
+
+@app.get("/metrics/audio")
+async def audio_metrics():
+    """Status cache audio TTS (jumlah track, antrean render)."""
+    return audio_cache.stats()
+
 # --- ENDPOINTS DATA COLLECTOR ---
 
 @app.post("/upload_dataset")
-async def upload_dataset(name: str = Form(...), instansi: str = Form("Intern"), kategori: str = Form("Unknown"), file: UploadFile = File(...)):
-    """Menerima file gambar, menyimpan di folder dataset, dan mendaftarkan intern jika belum ada."""
+async def upload_dataset(name: str = Form(...), instansi: str = Form("Intern"), kategori: str = Form("Unknown"),
+                         file: UploadFile = File(...), index_now: Optional[bool] = Form(None)):
+    """
+    Menerima file gambar, menyimpan di folder dataset, dan mendaftarkan intern jika belum ada.
+    Dengan index-on-upload (INDEX_ON_UPLOAD atau index_now=true), gambar langsung di-embed
+    dan centroid intern diperbarui sehingga wajah bisa dikenali tanpa /run_indexing.
+    """
     clean_name = name.strip()
     if not clean_name:
         raise HTTPException(status_code=400, detail="Nama tidak boleh kosong.")
+    # Hanya ekstensi yang dipindai indexer; file lain tersimpan tapi tidak akan pernah di-index
+    if Path(file.filename or "").suffix.lower() not in DATASET_IMAGE_EXTENSIONS:
+        raise HTTPException(status_code=400, detail=f"Format file tidak didukung. Gunakan: {', '.join(DATASET_IMAGE_EXTENSIONS)}.")
     try:
-        intern_id, instansi_reg, kategori_reg = get_or_create_intern(clean_name, instansi, kategori)
+        intern_id, instansi_reg, kategori_reg = await run_db(get_or_create_intern, clean_name, instansi, kategori)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Gagal memproses intern ID: {e}")
 
-    face_folder = FACES_DIR / clean_name
-    os.makedirs(face_folder, exist_ok=True)
-    file_path = face_folder / file.filename
+    file_path = FACES_DIR / clean_name / file.filename
     try:
         image_bytes = await file.read()
-        with open(file_path, "wb") as f:
-            f.write(image_bytes)
+        await run_db(save_dataset_image, file_path, image_bytes)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Gagal menyimpan file gambar: {e}")
     print(f"✅ FILE DATASET TERSIMPAN: {clean_name} - {file.filename}")
-    return {"status": "success", "message": f"Gambar tersimpan di folder {clean_name}."}
 
+    if not (INDEX_ON_UPLOAD if index_now is None else index_now):
+        return {"status": "success", "message": f"Gambar tersimpan di folder {clean_name}.", "indexed": False}
+
+    try:
+        # Resolusi penuh, sama persis dengan _detect_face_worker di indexing batch
+        faces = await inference_pool.run(detect_faces, image_bytes, detector_backend=INDEX_DETECTOR_BACKEND,
+                                         allow_downscale=False)
+        if not faces:
+            return {"status": "success", "indexed": False,
+                    "message": f"Gambar tersimpan di folder {clean_name}, tetapi wajah tidak terdeteksi sehingga belum di-index."}
+        embedding = (await embedding_batcher.embed(faces[:1]))[0]
+        stat = file_path.stat()
+        job = IndexJob(intern_id, clean_name, instansi_reg, kategori_reg,
+                       f"data/dataset/{clean_name}/{file.filename}", str(file_path),
+                       hashlib.sha256(image_bytes).hexdigest(), stat.st_size, stat.st_mtime_ns)
+        centroid, count = await run_db(index_uploaded_embedding, job, embedding)
+    except InferenceQueueFull as e:
+        return {"status": "success", "indexed": False,
+                "message": f"Gambar tersimpan di folder {clean_name}; server sibuk, jalankan indexing nanti ({e})."}
+    except Exception as e:
+        print(f"❌ Gagal index-on-upload untuk {clean_name}: {e}")
+        return {"status": "success", "indexed": False,
+                "message": f"Gambar tersimpan di folder {clean_name}, tetapi gagal di-index: {e}"}
+
+    if not update_match_index(intern_id, clean_name, instansi_reg, kategori_reg, centroid, embedding):
+        await run_db(reload_face_index) # Prototipe k-means perlu dibangun ulang
+    audio_cache.prerender_intern(clean_name)
+    print(f"✅ INDEX-ON-UPLOAD: {clean_name} kini punya {count} embedding.")
+    return {"status": "success", "indexed": True, "embedding_count": count,
+            "message": f"Gambar tersimpan dan langsung di-index untuk {clean_name} ({count} gambar)."}
+
+
+def save_dataset_image(file_path: Path, image_bytes: bytes):
+    """Menulis file gambar dataset ke disk (blocking, dijalankan di executor)."""
+    os.makedirs(file_path.parent, exist_ok=True)
+    with open(file_path, "wb") as f:
+        f.write(image_bytes)
+
+def index_uploaded_embedding(job, embedding):
+    """Menyimpan embedding upload + update centroid incremental dalam satu transaksi pool."""
+    with db_transaction() as conn:
+        return add_embedding_incremental(conn, job, embedding)
 
 # --- ENDPOINTS ABSENSI ---
 
+def search_face_db(emb_list):
+    with db_transaction() as conn:
+        return search_centroids_db(conn, emb_list)
+
+async def match_embeddings(emb_list):
+    """
+    Pencocokan utama di indeks in-memory (satu perkalian matriks). Selama indeks belum
+    berhasil dimuat, pencarian jatuh ke DB (indeks ANN centroid) agar kiosk tetap jalan.
+    """
+    index = get_match_index()
+    if len(index) == 0 and not readiness["face_index"]:
+        return await run_db(search_face_db, emb_list, executor=kiosk_db_executor)
+    return index.search_many(emb_list)
+
+def attendance_phrase(kategori: str, type_absensi: str, log_time: datetime):
+    """Status kepatuhan + frasa audio untuk log yang baru dicatat."""
+    attendance_status_result = check_attendance_status(kategori, type_absensi, log_time)
+    if type_absensi == 'IN':
+        phrase = "in" if attendance_status_result != "Terlambat" else "in_late"
+    else:
+        phrase = "out" if attendance_status_result != "Pulang Cepat" else "out_early"
+    return attendance_status_result, phrase
+
+async def recognize_faces_multi(emb_list, type_absensi: str, image_bytes: bytes, decoded_image, start_time: float):
+    """
+    Mode multi-wajah /recognize: semua embedding dicocokkan dalam satu query matriks
+    (search_many), intern yang dikenali dicatat dalam satu transaksi, lalu hasil
+    dikembalikan per wajah (urutan sama dengan urutan deteksi).
+    """
+    emb_list = emb_list[:max(1, RECOGNIZE_MAX_FACES)]
+    results = await match_embeddings(emb_list)
+    if not any(results):
+        return {"status": "error", "message": "Sistem kosong, lakukan indexing.", "track_id": audio_cache.track("S003"), "image_url": ""}
+
+    accepted = [(i, r) for i, r in enumerate(results) if r and r[4] <= DISTANCE_THRESHOLD and r[5]]
+    outcomes = {}
+    if accepted:
+        batch = await run_db(
+            record_attendance_batch, [r[:4] for _, r in accepted], type_absensi, image_bytes,
+            image=decoded_image, executor=kiosk_db_executor
+        )
+        outcomes = {i: outcome for (i, _), outcome in zip(accepted, batch)}
+
+    current_log_time = get_current_wib_datetime()
+    elapsed_time = time.time() - start_time
+    faces, playlist, seen = [], [], set()
+    for i, result in enumerate(results):
+        if i not in outcomes:
+            distance = f"{result[4]:.4f}" if result else None
+            faces.append({"index": i, "status": "unrecognized", "distance": distance})
+            continue
+        intern_id, name, instansi, kategori, distance, _ = result
+        latest_log, is_duplicate, image_url = outcomes[i]
+        face = {"index": i, "name": name, "instansi": instansi, "kategori": kategori,
+                "distance": f"{distance:.4f}", "type": type_absensi}
+        if is_duplicate:
+            face.update(status="duplicate", log_time=format_time_to_hms(latest_log['absent_at']))
+            phrase = f"duplicate_{type_absensi.lower()}"
+        else:
+            attendance_status_result, phrase = attendance_phrase(kategori, type_absensi, current_log_time)
+            face.update(status="success", image_url=image_url, log_time=format_time_to_hms(current_log_time),
+                        attendance_status=attendance_status_result)
+        faces.append(face)
+        # Satu pengumuman per intern walau wajahnya terdeteksi dua kali
+        if intern_id not in seen:
+            seen.add(intern_id)
+            playlist.extend(audio_cache.intern_playlist(name, phrase))
+
+    recognized = sum(1 for face in faces if face["status"] != "unrecognized")
+    print(f"✅ DETEKSI MULTI-WAJAH: {recognized}/{len(faces)} dikenali ({type_absensi}) | Latensi: {elapsed_time:.2f}s")
+    if not recognized:
+        playlist = [audio_cache.track("S003")]
+    return {"status": "multi", "type": type_absensi, "count": len(faces), "recognized": recognized, "faces": faces,
+            "latency": f"{elapsed_time:.2f}s", "track_id": playlist[0] if playlist else None, "playlist": playlist}
+
 @app.post("/recognize")
-async def recognize_face(file: UploadFile = File(...), type_absensi: str = Form(...)):
-    """Endpoint utama untuk deteksi wajah dan pencocokan cepat."""
+async def recognize_face(file: UploadFile = File(...), type_absensi: str = Form(...), face_box: Optional[str] = Form(None),
+                         multi_face: Optional[bool] = Form(None)):
+    """
+    Endpoint utama untuk deteksi wajah dan pencocokan cepat.
+    Kiosk boleh mengirim crop wajah yang sudah diperkecil + `face_box` ('x,y,w,h' dalam
+    piksel crop); detektor lalu hanya dijalankan di sekitar box (atau dilewati).
+    Dengan `multi_face` (atau RECOGNIZE_MULTI_FACE), semua wajah pada frame diproses
+    sekaligus dan respons berisi daftar hasil per wajah (status "multi").
+    """
     start_time = time.time()
     image_bytes = await file.read()
     type_absensi = type_absensi.upper()
     image_url_for_db = ""
 
     if type_absensi not in ['IN', 'OUT']:
-        generate_audio_file("S005.mp3", "Kesalahan tipe absensi.")
         raise HTTPException(status_code=400, detail="Invalid type_absensi.")
 
-    emb_list = extract_face_features(image_bytes)
+    # Deteksi berjalan di pool terpisah agar event loop tidak terblokir;
+    # forward pass model di-batch bersama request kiosk lain
+    try:
+        # Satu kali decode (resolusi tereduksi untuk frame besar); array dipakai ulang saat menyimpan gambar
+        decoded_image, faces = await inference_pool.run(decode_and_detect, image_bytes, parse_face_box(face_box))
+        emb_list = await embedding_batcher.embed(faces)
+    except InferenceQueueFull as e:
+        print(f"⚠️ Antrean inferensi penuh ({inference_pool.in_flight}/{inference_pool.capacity}). Request ditolak.")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except Exception as e:
+        print(f"❌ ERROR Ekstraksi Fitur: {e}")
+        decoded_image, emb_list = None, []
     if not emb_list:
-        generate_audio_file("S002.mp3", "Wajah tidak terdeteksi.")
-        return {"status": "error", "message": "Wajah tidak terdeteksi.", "track_id": "S002.mp3", "image_url": image_url_for_db}
+        return {"status": "error", "message": "Wajah tidak terdeteksi.", "track_id": audio_cache.track("S002"), "image_url": image_url_for_db}
     new_embedding = emb_list[0]
 
-    conn = None
+    if RECOGNIZE_MULTI_FACE if multi_face is None else multi_face:
+        try:
+            return await recognize_faces_multi(emb_list, type_absensi, image_bytes, decoded_image, start_time)
+        except Exception as e:
+            print(f"❌ ERROR PENCARIAN/ABSENSI MULTI-WAJAH: {e}")
+            return {"status": "error", "message": f"Kesalahan server: {str(e)}", "track_id": audio_cache.track("S004"), "image_url": image_url_for_db}
+
     try:
-        conn = connect_db()
-        cursor = conn.cursor()
-        vector_string = "[" + ",".join(map(str, new_embedding)) + "]"
-        cursor.execute(f"""
-            SELECT name, instansi, kategori, embedding <=> '{vector_string}'::vector AS distance
-            FROM intern_centroids
-            ORDER BY distance ASC
-            LIMIT 1
-        """)
-        result = cursor.fetchone()
+        # Pencocokan di memori: satu perkalian matriks-vektor, tanpa query DB (fallback DB jika indeks belum termuat)
+        result = (await match_embeddings([new_embedding]))[0]
 
         if result:
-            name, instansi, kategori, distance = result
+            intern_id, name, instansi, kategori, distance, accepted = result
             elapsed_time = time.time() - start_time
 
-            if distance <= DISTANCE_THRESHOLD:
-                latest_log = get_latest_attendance(name)
-                if latest_log and latest_log['type'] == type_absensi:
+            if distance <= DISTANCE_THRESHOLD and accepted:
+                # Cek duplikat + simpan log (satu transaksi) di executor DB khusus kiosk
+                clean_name = name.strip().replace(' ', '_').replace('.', '').replace('/', '_').replace('\\', '_').lower()
+                latest_log, is_duplicate, image_url_for_db = await run_db(
+                    record_attendance, intern_id, name, instansi, kategori, type_absensi, clean_name, image_bytes,
+                    image=decoded_image, executor=kiosk_db_executor
+                )
+
+                if is_duplicate:
                     print(f"✅ DUPLIKAT ABSENSI: {name} | Sudah Absen {type_absensi}.")
-                    audio_filename = f"duplicate_{type_absensi.lower()}_{name.replace(' ', '_')}.mp3"
-                    message_text = f"{name}, Anda sudah Absen Masuk hari ini." if type_absensi == 'IN' else f"Absensi Pulang {name} sudah dicatat."
-                    generate_audio_file(audio_filename, message_text)
+                    playlist = audio_cache.intern_playlist(name, f"duplicate_{type_absensi.lower()}")
                     log_time_display = format_time_to_hms(latest_log['absent_at'])
-                    return {"status": "duplicate", "name": name, "instansi": instansi, "kategori": kategori, "distance": f"{distance:.4f}", "latency": f"{elapsed_time:.2f}s", "track_id": audio_filename, "type": type_absensi, "log_time": log_time_display}
+                    return {"status": "duplicate", "name": name, "instansi": instansi, "kategori": kategori, "distance": f"{distance:.4f}", "latency": f"{elapsed_time:.2f}s", "track_id": playlist[0] if playlist else None, "playlist": playlist, "type": type_absensi, "log_time": log_time_display}
 
-                timestamp = get_current_wib_datetime().strftime("%Y%m%d_%H%M%S") # Gunakan WIB
-                clean_name = name.strip().replace(' ', '_').replace('.', '').replace('/', '_').replace('\\', '_').lower()
-                image_filename = f"{timestamp}_{clean_name}_{type_absensi}.jpg"
-                image_path = CAPTURED_IMAGES_DIR / image_filename
-                temp_image_url = ""
-                try:
-                    with open(image_path, "wb") as f: f.write(image_bytes)
-                    temp_image_url = f"/images/{image_filename}"
-                except Exception as file_error:
-                    print(f"   ❌ GAGAL SIMPAN GAMBAR: {name}. Error: {file_error}")
-                image_url_for_db = temp_image_url
-
-                log_attendance(name, instansi, kategori, image_url_for_db, type_absensi)
                 current_log_time = get_current_wib_datetime()
                 log_time_display = format_time_to_hms(current_log_time)
-                attendance_status_result = check_attendance_status(kategori, type_absensi, current_log_time)
-
-                if type_absensi == 'IN':
-                    message_text = f"Selamat datang, {name}." if attendance_status_result != "Terlambat" else f"Maaf, {name}. Absensi masuk Anda terlambat."
-                else:
-                    message_text = f"Terima kasih, {name}." if attendance_status_result != "Pulang Cepat" else f"Peringatan, {name}. Anda Pulang Cepat."
+                attendance_status_result, phrase = attendance_phrase(kategori, type_absensi, current_log_time)
 
                 print(f"✅ DETEKSI BERHASIL: {name} ({type_absensi}) | Status: {attendance_status_result} | Jarak: {distance:.4f} | Latensi: {elapsed_time:.2f}s")
-                audio_filename = f"log_{clean_name}_{type_absensi.lower()}.mp3"
-                generate_audio_file(audio_filename, message_text)
+                playlist = audio_cache.intern_playlist(name, phrase)
 
-                return {"status": "success", "name": name, "instansi": instansi, "kategori": kategori, "distance": f"{distance:.4f}", "latency": f"{elapsed_time:.2f}s", "track_id": audio_filename, "type": type_absensi, "image_url": image_url_for_db, "log_time": log_time_display, "attendance_status": attendance_status_result}
+                return {"status": "success", "name": name, "instansi": instansi, "kategori": kategori, "distance": f"{distance:.4f}", "latency": f"{elapsed_time:.2f}s", "track_id": playlist[0] if playlist else None, "playlist": playlist, "type": type_absensi, "image_url": image_url_for_db, "log_time": log_time_display, "attendance_status": attendance_status_result}
             else:
-                print(f"❌ DETEKSI GAGAL: Jarak Terlalu Jauh ({distance:.4f}) | Latensi: {elapsed_time:.2f}s")
-                generate_audio_file("S003.mp3", "Wajah Anda belum terdaftar.")
-                return {"status": "unrecognized", "message": "Wajah Anda Belum Terdaftar", "track_id": "S003.mp3", "image_url": image_url_for_db}
+                reason = "Jarak Terlalu Jauh" if distance > DISTANCE_THRESHOLD else f"Ambigu (voting/margin, kandidat {name})"
+                print(f"❌ DETEKSI GAGAL: {reason} ({distance:.4f}) | Latensi: {elapsed_time:.2f}s")
+                return {"status": "unrecognized", "message": "Wajah Anda Belum Terdaftar", "track_id": audio_cache.track("S003"), "image_url": image_url_for_db}
         else:
-            generate_audio_file("S003.mp3", "Wajah Anda belum terdaftar.")
-            return {"status": "error", "message": "Sistem kosong, lakukan indexing.", "track_id": "S003.mp3", "image_url": image_url_for_db}
+            return {"status": "error", "message": "Sistem kosong, lakukan indexing.", "track_id": audio_cache.track("S003"), "image_url": image_url_for_db}
     except Exception as e:
         print(f"❌ ERROR PENCARIAN/ABSENSI: {e}")
-        generate_audio_file("S004.mp3", "Kesalahan server terjadi.")
-        return {"status": "error", "message": f"Kesalahan server: {str(e)}", "track_id": "S004.mp3", "image_url": image_url_for_db}
-    finally:
-        if conn: conn.close()
+        return {"status": "error", "message": f"Kesalahan server: {str(e)}", "track_id": audio_cache.track("S004"), "image_url": image_url_for_db}
 
 # --- ENDPOINTS DATA (data.html) ---
 
-@app.get("/attendance/today")
-async def get_today_attendance():
-    """Mendapatkan daftar log absensi unik terakhir hari ini."""
-    conn = None
-    try:
-        conn = connect_db()
+def fetch_today_attendance_rows():
+    """Mengambil log terakhir per intern untuk hari ini (blocking, dijalankan di executor DB)."""
+    with db_transaction() as conn:
         cursor = conn.cursor()
         cursor.execute("""
             WITH LatestAttendance AS (
@@ -620,41 +1175,70 @@ async def get_today_attendance():
                     log_id, intern_name, instansi, kategori, image_url, absent_at, type,
                     ROW_NUMBER() OVER(PARTITION BY intern_name ORDER BY absent_at DESC) as rn
                 FROM attendance_logs
-                WHERE absent_at::date = CURRENT_DATE
+                WHERE absent_at >= %s AND absent_at < %s
             )
             SELECT intern_name, instansi, kategori, absent_at, image_url, type
             FROM LatestAttendance
             WHERE rn = 1
             ORDER BY absent_at DESC;
-        """)
-        results = cursor.fetchall()
-        attendance_list = []
-        for name, instansi, kategori, time_obj, image_url, log_type in results:
-            log_datetime_wib = time_obj # Asumsi DB menyimpan UTC atau tanpa TZ
-            # Jika DB menyimpan tanpa TZ, kita anggap itu UTC lalu konversi ke WIB
-            # Jika sudah ada TZ, astimezone akan menanganinya
-            if time_obj.tzinfo is None or time_obj.tzinfo.utcoffset(time_obj) is None:
-                log_datetime_wib = pytz.utc.localize(time_obj).astimezone(local_tz)
-            else:
-                log_datetime_wib = time_obj.astimezone(local_tz)
-
-            status_kepatuhan = check_attendance_status(kategori, log_type, log_datetime_wib)
-            status_display = f"MASUK ({status_kepatuhan})" if log_type == 'IN' else f"PULANG ({status_kepatuhan})"
-            attendance_list.append({
-                "name": name,
-                "instansi": instansi,
-                "kategori": kategori,
-                "status": status_display,
-                "timestamp": format_time_to_hms(log_datetime_wib), # Gunakan WIB yang sudah dikonversi
-                "distance": 0.0000,
-                "image_path": image_url
-            })
-        return attendance_list
+        """, get_today_bounds())
+        return cursor.fetchall()
+
+def format_attendance_row(name, instansi, kategori, time_obj, image_url, log_type) -> dict:
+    """Satu log absensi -> baris JSON untuk /attendance/today (dan event SSE)."""
+    log_datetime_wib = time_obj # Asumsi DB menyimpan UTC atau tanpa TZ
+    # Jika DB menyimpan tanpa TZ, kita anggap itu UTC lalu konversi ke WIB
+    # Jika sudah ada TZ, astimezone akan menanganinya
+    if time_obj.tzinfo is None or time_obj.tzinfo.utcoffset(time_obj) is None:
+        log_datetime_wib = pytz.utc.localize(time_obj).astimezone(local_tz)
+    else:
+        log_datetime_wib = time_obj.astimezone(local_tz)
+
+    status_kepatuhan = check_attendance_status(kategori, log_type, log_datetime_wib)
+    status_display = f"MASUK ({status_kepatuhan})" if log_type == 'IN' else f"PULANG ({status_kepatuhan})"
+    return {
+        "name": name,
+        "instansi": instansi,
+        "kategori": kategori,
+        "status": status_display,
+        "timestamp": format_time_to_hms(log_datetime_wib), # Gunakan WIB yang sudah dikonversi
+        "distance": 0.0000,
+        "image_path": image_url,
+        "thumbnail_path": image_store.thumbnail_url_for(image_url)
+    }
+
+# --- SNAPSHOT /attendance/today (IN-MEMORY) ---
+# Dipelihara incremental dari record_attendance & NOTIFY; GET tidak lagi menyentuh DB
+today_snapshot = TodaySnapshot(format_attendance_row)
+
+def get_today_date() -> date:
+    return get_today_bounds()[0].date()
+
+@app.get("/attendance/today")
+async def get_today_attendance(request: Request):
+    """
+    Mendapatkan daftar log absensi unik terakhir hari ini dari snapshot in-memory.
+    Mendukung ETag/If-None-Match: jika tidak ada perubahan, dikembalikan 304 tanpa body.
+    """
+    try:
+        version, attendance_list = today_snapshot.read(get_today_date())
+        etag = today_snapshot.etag(version)
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+            return Response(status_code=304, headers=headers)
+        return JSONResponse(content=attendance_list, headers=headers)
     except Exception as e:
         print(f"❌ Error mengambil daftar absensi hari ini: {e}")
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        if conn: conn.close()
+
+@app.get("/attendance/stream")
+async def stream_today_attendance():
+    """Server-Sent Events: snapshot awal lalu delta setiap ada log absensi baru."""
+    return StreamingResponse(
+        today_snapshot.stream(get_today_date),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 # --- ENDPOINTS PENGATURAN (settings.html) ---
 
@@ -662,7 +1246,7 @@ async def get_today_attendance():
 async def reset_daily_attendance():
     """Menghapus semua log absensi hari ini (Manual Trigger)."""
     try:
-        deleted_count = reset_attendance_logs()
+        deleted_count = await run_db(reset_attendance_logs)
         return JSONResponse(content={
             "status": "success",
             "message": f"Berhasil mereset log absensi hari ini. {deleted_count} log dihapus.",
@@ -672,40 +1256,65 @@ async def reset_daily_attendance():
         print(f"❌ Error saat mereset absensi: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.delete("/delete_face/{name}")
-async def delete_face(name: str):
-    """Menghapus data wajah dari database dan file dari disk."""
-    conn = None
+@app.post("/retention/run")
+async def run_retention_now():
+    """Menjalankan job retensi sekarang (Manual Trigger) dan mengembalikan laporan ruang yang dibebaskan."""
     try:
-        conn = connect_db()
+        report = await run_db(run_retention_job)
+        return {"status": "success", "report": report}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Job retensi gagal: {e}")
+
+def delete_intern_data(name: str) -> Optional[int]:
+    """
+    Menghapus intern beserta embedding & centroid-nya, lalu memuat ulang indeks wajah.
+    Mengembalikan jumlah vektor yang dihapus, atau None jika intern tidak ditemukan.
+    """
+    with db_transaction() as conn:
         cursor = conn.cursor()
         # Dapatkan intern_id sebelum menghapus
         cursor.execute("SELECT id FROM interns WHERE name = %s", (name,))
         result = cursor.fetchone()
         if not result:
-            raise HTTPException(status_code=404, detail="Intern tidak ditemukan.")
+            return None
         intern_id = result[0]
 
         # Hapus dari tabel anak dulu
         cursor.execute("DELETE FROM intern_centroids WHERE intern_id = %s", (intern_id,))
         cursor.execute("DELETE FROM intern_embeddings WHERE intern_id = %s", (intern_id,))
         deleted_vectors = cursor.rowcount
+        cursor.execute("DELETE FROM dataset_manifest WHERE intern_id = %s", (intern_id,))
         # Hapus log absensi? (Opsional, mungkin ingin disimpan)
         # cursor.execute("DELETE FROM attendance_logs WHERE intern_id = %s", (intern_id,))
 
         # Hapus dari tabel induk
         cursor.execute("DELETE FROM interns WHERE id = %s", (intern_id,))
-        conn.commit()
+
+    # Wajah yang dihapus tidak boleh lagi dikenali oleh indeks in-memory
+    reload_face_index()
+    return deleted_vectors
+
+def delete_face_folder(name: str) -> bool:
+    """Menghapus folder dataset wajah dari disk."""
+    face_folder = FACES_DIR / name
+    if face_folder.exists() and face_folder.is_dir():
+        try:
+            shutil.rmtree(face_folder)
+            return True
+        except Exception as e:
+            print(f"❌ Gagal menghapus folder file wajah {name}: {e}")
+    return False
+
+@app.delete("/delete_face/{name}")
+async def delete_face(name: str):
+    """Menghapus data wajah dari database dan file dari disk."""
+    try:
+        deleted_vectors = await run_db(delete_intern_data, name)
+        if deleted_vectors is None:
+            raise HTTPException(status_code=404, detail="Intern tidak ditemukan.")
 
         # Hapus folder gambar
-        face_folder = FACES_DIR / name
-        file_deleted = False
-        if face_folder.exists() and face_folder.is_dir():
-            try:
-                shutil.rmtree(face_folder)
-                file_deleted = True
-            except Exception as e:
-                print(f"❌ Gagal menghapus folder file wajah {name}: {e}")
+        file_deleted = await run_db(delete_face_folder, name)
 
         print(f"✅ Hapus Wajah Berhasil: {name}. Vektor dihapus: {deleted_vectors}. File dihapus: {file_deleted}")
         return {"status": "success", "message": f"Data wajah '{name}' berhasil dihapus."}
@@ -714,46 +1323,58 @@ async def delete_face(name: str):
         raise http_exc # Re-raise HTTPException
     except Exception as e:
         print(f"❌ Error menghapus data wajah {name}: {e}")
-        if conn: conn.rollback()
         raise HTTPException(status_code=500, detail=f"Gagal menghapus data wajah: {e}")
-    finally:
-        if conn: conn.close()
 
 # --- ENDPOINTS LAINNYA ---
+@app.post("/index_jobs", status_code=202)
+async def create_index_job():
+    """
+    Mengantrekan job indexing incremental. Single-flight: jika sudah ada job yang antre
+    atau berjalan, job tersebut yang dikembalikan (deduplicated=True).
+    """
+    job, created = index_jobs.submit("index")
+    if created:
+        print(f"✅ [API] Job indexing {job.id} di-antrekan (queued)...")
+    return {**job.to_dict(), "deduplicated": not created}
+
+@app.get("/index_jobs/{job_id}")
+async def get_index_job(job_id: str):
+    """Status dan progres job indexing."""
+    job = index_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job indexing '{job_id}' tidak ditemukan.")
+    return job.to_dict()
+
+@app.delete("/index_jobs/{job_id}")
+async def cancel_index_job(job_id: str):
+    """Membatalkan job indexing (job yang berjalan berhenti di batas batch berikutnya)."""
+    job = index_jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job indexing '{job_id}' tidak ditemukan.")
+    return job.to_dict()
+
 @app.post("/run_indexing")
-async def run_indexing_endpoint(background_tasks: BackgroundTasks):
-    """Memicu proses indexing di background."""
-    try:
-        background_tasks.add_task(run_indexing_subprocess)
-        print("✅ [API] Proses indexing telah di-antrekan (queued)...")
-        return {"status": "queued", "message": "Proses indexing telah dimulai di background."}
-    except Exception as e:
-        print(f"❌ [API] Gagal memulai background task: {e}")
-        raise HTTPException(status_code=500, detail=f"Gagal memulai indexing task: {e}")
+async def run_indexing_endpoint():
+    """Kompatibilitas lama: sama dengan POST /index_jobs."""
+    job, created = index_jobs.submit("index")
+    message = "Proses indexing telah dimulai di background." if created else "Proses indexing sudah berjalan."
+    return {"status": "queued", "message": message, "job_id": job.id, "deduplicated": not created}
 
 @app.post("/reload_db")
 async def reload_db():
-    """Simulasi muat ulang/sinkronisasi DB."""
-    conn = None
+    """Memuat ulang indeks wajah in-memory dari database."""
     try:
-        conn = connect_db()
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(DISTINCT name) FROM intern_centroids")
-        total_unique_faces = cursor.fetchone()[0]
-        print(f"✅ RELOAD SIMULASI BERHASIL. Total {total_unique_faces} wajah unik terindeks.")
-        return {"status": "success", "message": "Sinkronisasi berhasil (Simulasi)", "total_faces": total_unique_faces}
+        index = await run_db(reload_face_index)
+        total_unique_faces = len(index)
+        print(f"✅ RELOAD BERHASIL. Total {total_unique_faces} wajah unik terindeks.")
+        return {"status": "success", "message": "Sinkronisasi berhasil", "total_faces": total_unique_faces}
     except Exception as e:
-        print(f"❌ Error saat simulasi reload database: {e}")
+        print(f"❌ Error saat reload database: {e}")
         raise HTTPException(status_code=500, detail=f"Gagal reload database: {e}")
-    finally:
-        if conn: conn.close()
 
-@app.get("/list_faces")
-async def list_registered_faces():
-    """Mengambil daftar nama dan jumlah gambar."""
-    conn = None
-    try:
-        conn = connect_db()
+def fetch_registered_faces():
+    """Menghitung jumlah embedding per nama (blocking, dijalankan di executor DB)."""
+    with db_transaction() as conn:
         cursor = conn.cursor()
         cursor.execute("""
             SELECT name, COUNT(*)
@@ -761,14 +1382,18 @@ async def list_registered_faces():
             GROUP BY name
             ORDER BY name ASC
         """)
-        results = cursor.fetchall()
+        return cursor.fetchall()
+
+@app.get("/list_faces")
+async def list_registered_faces():
+    """Mengambil daftar nama dan jumlah gambar."""
+    try:
+        results = await run_db(fetch_registered_faces)
         faces_list = [{"name": name, "count": count} for name, count in results]
         return {"status": "success", "faces": faces_list}
     except Exception as e:
         print(f"❌ Error mengambil daftar wajah terdaftar: {e}")
         raise HTTPException(status_code=500, detail=f"Gagal mengambil daftar wajah: {e}")
-    finally:
-        if conn: conn.close()
 
 # --- APP.MOUNT INI HARUS DI POSISI TERAKHIR (FALLBACK) ---
 app.mount("/", StaticFiles(directory=str(FRONTEND_STATIC_DIR), html=True), name="frontend") # Tambahkan html=True
\ No newline at end of file
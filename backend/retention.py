@@ -0,0 +1,323 @@
+import os
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import List, Optional
+
+try:
+    from backend.image_store import THUMB_DIR_NAME
+except ImportError:
+    from .image_store import THUMB_DIR_NAME
+
+# --- KONFIGURASI RETENSI (DIBACA DARI ENV) ---
+# Log absensi lebih tua dari ini dipindah dari tabel aktif ke tabel arsip
+RETENTION_LOG_DAYS = int(os.getenv("RETENTION_LOG_DAYS", "35"))
+# Gambar absensi ukuran penuh lebih tua dari ini dihapus (thumbnail tetap disimpan)
+RETENTION_IMAGE_DAYS = int(os.getenv("RETENTION_IMAGE_DAYS", "90"))
+# Thumbnail (dan gambar lama tanpa shard) lebih tua dari ini ikut dihapus
+RETENTION_THUMB_DAYS = int(os.getenv("RETENTION_THUMB_DAYS", "365"))
+# Jadwal job retensi harian (WIB)
+RETENTION_HOUR = int(os.getenv("RETENTION_HOUR", "2"))
+RETENTION_MINUTE = int(os.getenv("RETENTION_MINUTE", "30"))
+
+DB_TABLE_LOGS = "attendance_logs"
+DB_TABLE_ARCHIVE = "attendance_logs_archive"
+LOG_COLUMNS = "log_id, intern_id, intern_name, instansi, kategori, image_url, absent_at, type"
+
+
+# --- TABEL LOG AKTIF (PARTISI PER BULAN) ---
+# Partisi dibuat untuk bulan berjalan + beberapa bulan ke depan saat startup dan oleh job harian
+LOG_PARTITION_MONTHS_AHEAD = int(os.getenv("LOG_PARTITION_MONTHS_AHEAD", "2"))
+
+
+def create_attendance_logs_table(cursor):
+    """Membuat tabel attendance_logs ber-partisi RANGE (absent_at) beserta indeksnya (idempoten)."""
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {DB_TABLE_LOGS} (
+            log_id SERIAL,
+            intern_id INTEGER REFERENCES interns(id) ON DELETE CASCADE,
+            intern_name TEXT NOT NULL,
+            instansi TEXT,
+            kategori TEXT,
+            image_url TEXT,
+            absent_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            type TEXT NOT NULL DEFAULT 'IN',
+            PRIMARY KEY (log_id, absent_at)
+        ) PARTITION BY RANGE (absent_at);
+    """)
+    # Partisi cadangan: insert tidak pernah gagal walau partisi bulan belum dibuat
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {DB_TABLE_LOGS}_default PARTITION OF {DB_TABLE_LOGS} DEFAULT;")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{DB_TABLE_LOGS}_intern_absent ON {DB_TABLE_LOGS} (intern_id, absent_at DESC);")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{DB_TABLE_LOGS}_name_absent ON {DB_TABLE_LOGS} (intern_name, absent_at DESC);")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{DB_TABLE_LOGS}_absent ON {DB_TABLE_LOGS} (absent_at DESC);")
+
+
+def ensure_log_partitions(cursor, today: date, months_ahead: int = LOG_PARTITION_MONTHS_AHEAD):
+    """Memastikan partisi bulan berjalan s/d `months_ahead` bulan ke depan tersedia."""
+    month = _month_start(today)
+    for _ in range(max(0, months_ahead) + 1):
+        ensure_month_partition(cursor, DB_TABLE_LOGS, month)
+        month = _next_month(month)
+
+
+def is_partitioned(cursor, table: str) -> bool:
+    cursor.execute("""
+        SELECT EXISTS (
+            SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid
+            WHERE c.relname = %s
+        )
+    """, (table,))
+    return cursor.fetchone()[0]
+
+
+def migrate_attendance_logs(cursor, today: date):
+    """
+    Migrasi satu kali: tabel attendance_logs lama (tanpa partisi) diganti tabel
+    ber-partisi, data lama disalin ke partisi bulanannya, dan sequence log_id dilanjutkan.
+    """
+    cursor.execute("SELECT to_regclass(%s)", (DB_TABLE_LOGS,))
+    if cursor.fetchone()[0] is None or is_partitioned(cursor, DB_TABLE_LOGS):
+        return
+    print(f"🛠️ Migrasi '{DB_TABLE_LOGS}' ke tabel ber-partisi bulanan...")
+    legacy = f"{DB_TABLE_LOGS}_legacy"
+    cursor.execute(f"ALTER TABLE {DB_TABLE_LOGS} RENAME TO {legacy};")
+    cursor.execute(f"ALTER TABLE {legacy} ALTER COLUMN log_id DROP DEFAULT;")
+    cursor.execute(f"ALTER SEQUENCE IF EXISTS {DB_TABLE_LOGS}_log_id_seq RENAME TO {legacy}_log_id_seq;")
+    create_attendance_logs_table(cursor)
+
+    # Partisi hanya untuk bulan yang benar-benar berisi data (bukan rentang MIN..MAX)
+    for month in distinct_months(cursor, legacy):
+        ensure_month_partition(cursor, DB_TABLE_LOGS, month)
+    ensure_log_partitions(cursor, today)
+
+    # Baris lama tanpa absent_at masuk partisi DEFAULT dengan timestamp epoch (tidak dibuatkan
+    # partisi bulanan); job arsip memindahkannya dalam satu langkah bulan 1970-01
+    cursor.execute(f"""
+        INSERT INTO {DB_TABLE_LOGS} ({LOG_COLUMNS})
+        SELECT log_id, intern_id, intern_name, instansi, kategori, image_url,
+               COALESCE(absent_at, TIMESTAMP '1970-01-01'), type
+        FROM {legacy}
+    """)
+    migrated = cursor.rowcount
+    cursor.execute(f"""
+        SELECT setval(pg_get_serial_sequence('{DB_TABLE_LOGS}', 'log_id'),
+                      GREATEST((SELECT COALESCE(MAX(log_id), 0) FROM {DB_TABLE_LOGS}), 1))
+    """)
+    cursor.execute(f"DROP TABLE {legacy} CASCADE;")
+    print(f"✅ Migrasi selesai: {migrated} log dipindahkan ke partisi bulanan.")
+
+
+def drop_expired_log_partitions(cursor, cutoff: datetime) -> int:
+    """Menghapus partisi bulanan attendance_logs yang seluruh rentangnya < cutoff (sudah diarsipkan)."""
+    cursor.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = %s
+    """, (DB_TABLE_LOGS,))
+    dropped = 0
+    for (name,) in cursor.fetchall():
+        suffix = name[len(DB_TABLE_LOGS) + 1:]
+        try:
+            month = datetime.strptime(suffix, "%Y_%m").date()
+        except ValueError:
+            continue # Partisi DEFAULT / nama lain
+        if _next_month(month) <= cutoff.date():
+            cursor.execute(f"DROP TABLE IF EXISTS {name};")
+            dropped += 1
+    return dropped
+
+
+# --- ARSIP LOG ABSENSI (PARTISI PER BULAN) ---
+
+def ensure_archive_schema(cursor):
+    """Membuat tabel arsip ber-partisi RANGE (absent_at) jika belum ada."""
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {DB_TABLE_ARCHIVE} (
+            log_id INTEGER NOT NULL,
+            intern_id INTEGER,
+            intern_name TEXT NOT NULL,
+            instansi TEXT,
+            kategori TEXT,
+            image_url TEXT,
+            absent_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            type TEXT NOT NULL,
+            archived_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT LOCALTIMESTAMP
+        ) PARTITION BY RANGE (absent_at);
+    """)
+    cursor.execute(f"""
+        CREATE INDEX IF NOT EXISTS idx_{DB_TABLE_ARCHIVE}_intern_absent
+        ON {DB_TABLE_ARCHIVE} (intern_id, absent_at DESC);
+    """)
+
+
+def _month_start(value) -> date:
+    return date(value.year, value.month, 1)
+
+
+def _next_month(value: date) -> date:
+    return date(value.year + value.month // 12, value.month % 12 + 1, 1)
+
+
+def distinct_months(cursor, table: str, before: Optional[datetime] = None) -> List[date]:
+    """Bulan-bulan (tanggal 1) yang memiliki baris di `table`, opsional hanya absent_at < before."""
+    where, params = ("WHERE absent_at < %s", (before,)) if before is not None else ("WHERE absent_at IS NOT NULL", None)
+    cursor.execute(f"""
+        SELECT DISTINCT date_trunc('month', absent_at)::date AS month
+        FROM {table}
+        {where}
+        ORDER BY month
+    """, params)
+    return [row[0] for row in cursor.fetchall()]
+
+
+def ensure_month_partition(cursor, table: str, month: date) -> str:
+    """
+    Membuat partisi bulanan `table_YYYY_MM` untuk bulan `month` (idempoten).
+    Jika baris bulan tsb sudah terlanjur masuk partisi DEFAULT, pembuatan dilewati
+    (dengan peringatan) tanpa membatalkan transaksi pemanggil.
+    """
+    name = f"{table}_{month:%Y_%m}"
+    cursor.execute("SAVEPOINT ensure_partition")
+    try:
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table}
+            FOR VALUES FROM ('{month.isoformat()}') TO ('{_next_month(month).isoformat()}');
+        """)
+        cursor.execute("RELEASE SAVEPOINT ensure_partition")
+    except Exception as e:
+        cursor.execute("ROLLBACK TO SAVEPOINT ensure_partition")
+        print(f"⚠️ Gagal membuat partisi {name}: {e}")
+    return name
+
+
+def ensure_archive_partition(cursor, month: date) -> str:
+    return ensure_month_partition(cursor, DB_TABLE_ARCHIVE, month)
+
+
+def archive_attendance_logs(conn, cutoff: datetime) -> int:
+    """
+    Memindahkan log dengan absent_at < cutoff ke tabel arsip, satu bulan per transaksi
+    (DELETE ... RETURNING langsung di-INSERT ke partisi arsip). Mengembalikan jumlah baris.
+    """
+    with conn.cursor() as cursor:
+        ensure_archive_schema(cursor)
+        # Hanya bulan yang berisi log: baris legacy epoch (1970) tidak memicu ratusan partisi kosong
+        months = distinct_months(cursor, DB_TABLE_LOGS, before=cutoff)
+    conn.commit()
+    if not months:
+        return 0
+
+    moved = 0
+    for month in months:
+        upper = min(datetime.combine(_next_month(month), datetime.min.time()), cutoff)
+        with conn.cursor() as cursor:
+            ensure_archive_partition(cursor, month)
+            cursor.execute(f"""
+                WITH moved AS (
+                    DELETE FROM {DB_TABLE_LOGS}
+                    WHERE absent_at >= %s AND absent_at < %s
+                    RETURNING {LOG_COLUMNS}
+                )
+                INSERT INTO {DB_TABLE_ARCHIVE} ({LOG_COLUMNS})
+                SELECT {LOG_COLUMNS} FROM moved
+            """, (datetime.combine(month, datetime.min.time()), upper))
+            moved += cursor.rowcount
+        conn.commit()
+
+    # Partisi bulanan yang sudah kosong seluruhnya dibuang dari tabel aktif
+    with conn.cursor() as cursor:
+        dropped = drop_expired_log_partitions(cursor, cutoff)
+    conn.commit()
+    if dropped:
+        print(f"   -> {dropped} partisi {DB_TABLE_LOGS} lama dihapus.")
+    return moved
+
+
+# --- PEMBERSIHAN GAMBAR ---
+
+def _shard_date(relative_dir: Path) -> Optional[date]:
+    """'YYYY/MM/DD' -> date, atau None jika bukan folder shard."""
+    parts = relative_dir.parts
+    if len(parts) != 3:
+        return None
+    try:
+        return date(int(parts[0]), int(parts[1]), int(parts[2]))
+    except ValueError:
+        return None
+
+
+def _remove_file(path: str, report: dict):
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+    except OSError:
+        return
+    report["files_removed"] += 1
+    report["bytes_reclaimed"] += size
+
+
+def prune_images(directory: Path, today: date, image_days: int = RETENTION_IMAGE_DAYS,
+                 thumb_days: int = RETENTION_THUMB_DAYS) -> dict:
+    """
+    Menghapus gambar penuh yang lebih tua dari `image_days` (thumbnail dipertahankan) dan
+    thumbnail yang lebih tua dari `thumb_days`. Umur dibaca dari path YYYY/MM/DD tanpa
+    stat per file; gambar lama berlayout datar memakai mtime dan batas `thumb_days`.
+    """
+    directory = Path(directory)
+    report = {"files_removed": 0, "bytes_reclaimed": 0, "dirs_removed": 0}
+    if not directory.exists():
+        return report
+    image_cutoff = today - timedelta(days=image_days)
+    thumb_cutoff = today - timedelta(days=thumb_days)
+
+    for root, dirs, files in os.walk(directory, topdown=False):
+        relative = Path(root).relative_to(directory)
+        is_thumb = relative.parts[:1] == (THUMB_DIR_NAME,)
+        shard_day = _shard_date(Path(*relative.parts[1:]) if is_thumb else relative)
+
+        if shard_day is not None:
+            if shard_day < (thumb_cutoff if is_thumb else image_cutoff):
+                for name in files:
+                    _remove_file(os.path.join(root, name), report)
+        elif root == str(directory):
+            # Gambar lama (sebelum layout ber-shard)
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    modified = date.fromtimestamp(os.path.getmtime(path))
+                except OSError:
+                    continue
+                if modified < thumb_cutoff:
+                    _remove_file(path, report)
+
+        if root != str(directory) and relative != Path(THUMB_DIR_NAME):
+            try:
+                os.rmdir(root) # Hanya berhasil jika folder sudah kosong
+                report["dirs_removed"] += 1
+            except OSError:
+                pass
+    return report
+
+
+# --- JOB RETENSI ---
+
+def run_retention(conn, images_dir: Path, now: datetime) -> dict:
+    """
+    Menjalankan seluruh kebijakan retensi dan mengembalikan laporannya.
+
+    Args:
+        now: Waktu lokal (WIB, naive) yang sama dengan konvensi kolom absent_at.
+    """
+    with conn.cursor() as cursor:
+        ensure_log_partitions(cursor, now.date())
+    conn.commit()
+    log_cutoff = datetime.combine(now.date() - timedelta(days=RETENTION_LOG_DAYS), datetime.min.time())
+    archived = archive_attendance_logs(conn, log_cutoff)
+    images = prune_images(images_dir, now.date())
+    return {
+        "log_cutoff": log_cutoff.isoformat(),
+        "logs_archived": archived,
+        "images": images,
+        "megabytes_reclaimed": round(images["bytes_reclaimed"] / (1024 * 1024), 2),
+    }
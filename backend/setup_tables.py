@@ -1,6 +1,7 @@
 import psycopg2
 import sys
 import os
+from datetime import date
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -12,9 +13,15 @@ try:
     # Coba import absolut
     try:
         from backend.utils import EMBEDDING_DIM
+        from backend.vector_index import create_vector_indexes, VECTOR_INDEX_TYPE
+        from backend.retention import ensure_archive_schema, create_attendance_logs_table, ensure_log_partitions, DB_TABLE_ARCHIVE
+        from backend.attendance_state import ensure_reset_epoch_schema
     except ImportError:
          # Fallback ke import relatif jika dijalankan sebagai modul
          from .utils import EMBEDDING_DIM
+         from .vector_index import create_vector_indexes, VECTOR_INDEX_TYPE
+         from .retention import ensure_archive_schema, create_attendance_logs_table, ensure_log_partitions, DB_TABLE_ARCHIVE
+         from .attendance_state import ensure_reset_epoch_schema
 
 except ImportError as e:
     print(f"❌ FATAL ERROR: Gagal mengimpor utilitas: {e}")
@@ -41,6 +48,7 @@ DB_TABLE_INTERNS = "interns"
 DB_TABLE_LOGS = "attendance_logs"
 DB_TABLE_EMBEDDINGS = "intern_embeddings"
 DB_TABLE_CENTROIDS = "intern_centroids"
+DB_TABLE_MANIFEST = "dataset_manifest"
 
 
 def connect_db():
@@ -79,6 +87,8 @@ def setup_database():
         cur.execute(f"DROP TABLE IF EXISTS {DB_TABLE_LOGS} CASCADE;") # Gunakan CASCADE
         cur.execute(f"DROP TABLE IF EXISTS {DB_TABLE_EMBEDDINGS} CASCADE;")
         cur.execute(f"DROP TABLE IF EXISTS {DB_TABLE_CENTROIDS} CASCADE;")
+        cur.execute(f"DROP TABLE IF EXISTS {DB_TABLE_MANIFEST} CASCADE;")
+        cur.execute(f"DROP TABLE IF EXISTS {DB_TABLE_ARCHIVE} CASCADE;")
         conn.commit()
         print("✅ Tabel anak dihapus.")
 
@@ -99,22 +109,18 @@ def setup_database():
         conn.commit()
         print(f"✅ Tabel '{DB_TABLE_INTERNS}' berhasil dibuat.")
 
-        print("   -> Membuat ulang tabel 'attendance_logs'...")
-        cur.execute(f"""
-            CREATE TABLE {DB_TABLE_LOGS} (
-                log_id SERIAL PRIMARY KEY,
-                intern_id INTEGER REFERENCES {DB_TABLE_INTERNS}(id) ON DELETE CASCADE, -- Tambah ON DELETE CASCADE
-                intern_name TEXT NOT NULL,
-                instansi TEXT,
-                kategori TEXT,
-                image_url TEXT,
-                absent_at TIMESTAMP WITHOUT TIME ZONE, -- Hapus DEFAULT LOCALTIMESTAMP
-                type TEXT NOT NULL DEFAULT 'IN'
-            );
-        """)
+        print("   -> Membuat ulang tabel 'attendance_logs' (partisi bulanan)...")
+        create_attendance_logs_table(cur)
+        ensure_log_partitions(cur, date.today())
+        ensure_reset_epoch_schema(cur)
         conn.commit()
         print(f"✅ Tabel '{DB_TABLE_LOGS}' berhasil dibuat.")
 
+        print("   -> Membuat ulang tabel arsip 'attendance_logs_archive' (partisi per bulan)...")
+        ensure_archive_schema(cur)
+        conn.commit()
+        print(f"✅ Tabel '{DB_TABLE_ARCHIVE}' berhasil dibuat.")
+
         print("   -> Membuat ulang tabel 'intern_embeddings'...")
         cur.execute(f"""
             CREATE TABLE {DB_TABLE_EMBEDDINGS} (
@@ -124,9 +130,11 @@ def setup_database():
                 instansi VARCHAR(100),
                 kategori VARCHAR(100),
                 file_path TEXT NOT NULL UNIQUE, -- Tambah UNIQUE constraint? Atau hapus jika path bisa sama?
-                embedding vector({EMBEDDING_DIM}) NOT NULL
+                embedding vector({EMBEDDING_DIM}) NOT NULL,
+                content_hash TEXT -- SHA-256 isi file sumber (lihat dataset_manifest)
             );
         """)
+        cur.execute(f"CREATE INDEX idx_embeddings_content_hash ON {DB_TABLE_EMBEDDINGS} (content_hash);")
         conn.commit()
         print(f"✅ Tabel '{DB_TABLE_EMBEDDINGS}' berhasil dibuat (vector size: {EMBEDDING_DIM}).")
 
@@ -138,12 +146,32 @@ def setup_database():
                 name TEXT NOT NULL UNIQUE,
                 instansi TEXT,
                 kategori TEXT,
-                embedding vector({EMBEDDING_DIM}) NOT NULL
+                embedding vector({EMBEDDING_DIM}) NOT NULL,
+                embedding_sum vector({EMBEDDING_DIM}), -- Running sum untuk update incremental
+                embedding_count INTEGER NOT NULL DEFAULT 0
             );
         """)
         conn.commit()
         print(f"✅ Tabel '{DB_TABLE_CENTROIDS}' berhasil dibuat.")
 
+        print("   -> Membuat ulang tabel 'dataset_manifest'...")
+        cur.execute(f"""
+            CREATE TABLE {DB_TABLE_MANIFEST} (
+                file_path TEXT PRIMARY KEY,
+                intern_id INTEGER REFERENCES {DB_TABLE_INTERNS}(id) ON DELETE CASCADE,
+                file_size BIGINT NOT NULL,
+                mtime_ns BIGINT NOT NULL,
+                content_hash TEXT NOT NULL
+            );
+        """)
+        conn.commit()
+        print(f"✅ Tabel '{DB_TABLE_MANIFEST}' berhasil dibuat.")
+
+        print(f"   -> Membuat indeks ANN ({VECTOR_INDEX_TYPE}, cosine) pada tabel centroid...")
+        create_vector_indexes(cur)
+        conn.commit()
+        print("✅ Indeks vektor berhasil dibuat.")
+
     except Exception as e:
         print(f"❌ ERROR FATAL: Gagal membuat/memperbarui tabel database: {e}")
         conn.rollback() # Rollback jika ada error
@@ -1,7 +1,9 @@
 import numpy as np
 import cv2 
-from deepface import DeepFace
 import os
+import math
+import struct
+import threading
 # import psycopg2 # Hapus import yang tidak digunakan jika koneksi DB di handle di file lain
 
 # --- KONFIGURASI KRITIS (Sumber Tunggal) ---
@@ -13,39 +15,158 @@ EMBEDDING_DIM = 512
 # Batas ambang jarak kosinus (Cosine Distance) untuk penentuan wajah dikenali
 # Wajah dikenali jika jarak <= DISTANCE_THRESHOLD
 DISTANCE_THRESHOLD = 0.40 
+# Backend detektor wajah untuk pengenalan real-time
+DETECTOR_BACKEND = "opencv"
+
+# --- FAST PATH CROP DARI KIOSK (BOUNDING BOX HINT) ---
+# 'narrow' (default) = detektor hanya dijalankan pada area sekitar box; tanpa wajah di area itu,
+#   tidak ada wajah yang diproses.
+# 'skip' = mode percaya penuh (opt-in): box dari klien langsung di-embed tanpa detektor. RISIKO:
+#   area apa pun yang dikirim klien (bukan wajah, box meleset, atau box yang sengaja dipalsukan)
+#   tetap di-embed dan dicocokkan ke galeri. Hanya untuk kiosk tepercaya dengan deteksi di perangkat.
+FACE_HINT_MODE = os.getenv("FACE_HINT_MODE", "narrow").lower()
+# Padding di sekeliling box (fraksi ukuran box) untuk mode 'narrow'
+FACE_HINT_PADDING = float(os.getenv("FACE_HINT_PADDING", "0.25"))
+# Sisi box minimal (piksel); box lebih kecil dianggap tidak valid
+FACE_HINT_MIN_SIZE = int(os.getenv("FACE_HINT_MIN_SIZE", "40"))
+
+# --- DECODE & DETEKSI RESOLUSI RENDAH ---
+# Detektor dijalankan satu kali pada salinan yang diperkecil ke sisi terpanjang ini
+DETECT_MAX_DIM = int(os.getenv("DETECT_MAX_DIM", "640"))
+# Frame besar di-decode langsung pada resolusi 1/2, 1/4, atau 1/8 (IMREAD_REDUCED_*) selama
+# sisi terpanjang hasilnya masih >= DECODE_MAX_DIM. Default = ukuran deteksi, sehingga frame
+# kiosk 1080p/1440p sudah di-decode pada 1/2 atau 1/4 resolusi.
+DECODE_MAX_DIM = int(os.getenv("DECODE_MAX_DIM", str(DETECT_MAX_DIM)))
+# Padding (fraksi ukuran box) area resolusi penuh tempat wajah kecil dideteksi ulang
+DETECT_ROI_PADDING = float(os.getenv("DETECT_ROI_PADDING", "0.5"))
+REDUCED_DECODE_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+
+def get_deepface():
+    """
+    Import DeepFace secara lazy: TensorFlow baru dimuat saat model benar-benar dipakai,
+    sehingga proses yang tidak melakukan inferensi (misal indexing tanpa perubahan) tetap cepat.
+    """
+    from deepface import DeepFace
+    return DeepFace
+
+
+# --- PEMANASAN MODEL (WARM-UP) ---
+
+def warmup_models():
+    """
+    Membangun dan meng-cache model MODEL_NAME serta detektor wajah, lalu menjalankan
+    satu inferensi dummy pada gambar sintetis agar request pertama tidak menanggung
+    biaya inisialisasi TensorFlow/OpenCV.
+    """
+    # 1. Model embedding (DeepFace menyimpannya di cache global)
+    get_deepface().build_model(MODEL_NAME)
+
+    # 2. Detektor wajah (API berbeda antar versi DeepFace; inferensi dummy tetap memicu build)
+    try:
+        from deepface.detectors import FaceDetector
+        FaceDetector.build_model(DETECTOR_BACKEND)
+    except ImportError:
+        pass
+
+    # 3. Inferensi dummy (jalur yang sama dengan /recognize) untuk menginisialisasi graph TensorFlow
+    dummy_img = np.random.default_rng(0).integers(0, 256, size=(224, 224, 3), dtype=np.uint8)
+    embed_faces(detect_faces(dummy_img, enforce_detection=False))
 
 
 # --- FUNGSI EKSTRAKSI FITUR ---
+# Ekstraksi dipecah menjadi dua tahap agar forward pass model bisa di-batch:
+#   1. detect_faces  : decode + deteksi + alignment (per gambar)
+#   2. embed_faces   : forward pass MODEL_NAME untuk banyak crop sekaligus
+
+def get_embedding_model():
+    """Mengembalikan model MODEL_NAME (di-cache oleh DeepFace setelah build pertama)."""
+    return get_deepface().build_model(MODEL_NAME)
+
+
+def get_target_size() -> tuple:
+    """Ukuran input model (tinggi, lebar), misal (112, 112) untuk ArcFace."""
+    input_shape = get_embedding_model().input_shape
+    return input_shape[1], input_shape[2]
+
+
+# JPEG SOF (Start Of Frame) yang memuat ukuran gambar
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
 
-def extract_face_features(image_bytes: bytes):
+
+def image_dimensions(data: bytes):
+    """(lebar, tinggi) dari header JPEG/PNG tanpa decode piksel. None jika tidak dikenali."""
+    data = memoryview(data)
+    if len(data) >= 24 and bytes(data[:8]) == b"\x89PNG\r\n\x1a\n":
+        return struct.unpack(">II", data[16:24])
+    if len(data) < 4 or bytes(data[:2]) != b"\xff\xd8":
+        return None
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF: # Byte pengisi
+            i += 1
+            continue
+        if marker in _JPEG_SOF_MARKERS:
+            height, width = struct.unpack(">HH", data[i + 5:i + 9])
+            return width, height
+        if marker == 0x01 or 0xD0 <= marker <= 0xD9: # Marker tanpa panjang segmen
+            i += 2
+            continue
+        i += 2 + struct.unpack(">H", data[i + 2:i + 4])[0]
+    return None
+
+
+def decode_image(image_bytes: bytes, max_dim: int = DECODE_MAX_DIM):
     """
-    Ekstraksi fitur wajah (embedding) menggunakan model DeepFace dari data bytes gambar.
-    Menggunakan MODEL_NAME yang didefinisikan secara global di utils.py.
-    
-    Args:
-        image_bytes (bytes): Data gambar yang diunggah dari frontend.
-        
-    Returns:
-        list of list[float]: List dari embedding wajah yang terdeteksi. 
-                             Mengembalikan list kosong ([]) jika tidak ada wajah.
+    Decode bytes gambar (JPEG/PNG) menjadi array BGR OpenCV. None jika gagal.
+    Frame besar di-decode sekali pada resolusi tereduksi (IMREAD_REDUCED_*) sehingga
+    array resolusi penuh tidak pernah dibuat. Bytes dibungkus tanpa disalin.
     """
-    
+    np_array = np.frombuffer(image_bytes, np.uint8)
+    flag = cv2.IMREAD_COLOR
+    size = image_dimensions(image_bytes) if max_dim > 0 else None
+    if size is not None:
+        longest = max(size)
+        for factor, reduced_flag in REDUCED_DECODE_FLAGS:
+            if longest // factor >= max_dim:
+                flag = reduced_flag
+                break
+    image = cv2.imdecode(np_array, flag)
+    if image is None and flag != cv2.IMREAD_COLOR:
+        image = cv2.imdecode(np_array, cv2.IMREAD_COLOR)
+    return image
+
+
+# Buffer downscale per thread (pool inferensi): dipakai ulang antar request berukuran sama
+_buffers = threading.local()
+
+
+def _downscale_reused(image: np.ndarray, max_dim: int):
+    """Mengembalikan (salinan diperkecil, skala) memakai buffer thread-local yang dipakai ulang."""
+    height, width = image.shape[:2]
+    scale = max_dim / float(max(height, width))
+    size = (max(1, int(width * scale)), max(1, int(height * scale)))
+    shape = (size[1], size[0]) + image.shape[2:]
+    buffer = getattr(_buffers, "detect", None)
+    if buffer is None or buffer.shape != shape or buffer.dtype != image.dtype:
+        buffer = np.empty(shape, dtype=image.dtype)
+        _buffers.detect = buffer
+    cv2.resize(image, size, dst=buffer, interpolation=cv2.INTER_AREA)
+    return buffer, scale
+
+
+def _extract_face_objs(image, detector_backend: str, enforce_detection: bool, align: bool = True) -> list:
+    """Pemanggilan DeepFace.extract_faces dengan penanganan error; list kosong jika gagal."""
     try:
-        # 1. Konversi bytes (dari upload FastAPI) ke array numpy mentah
-        np_array = np.frombuffer(image_bytes, np.uint8)
-        # 2. Decode array bytes menjadi array gambar yang dapat dibaca OpenCV (cv2.imdecode)
-        img_array = cv2.imdecode(np_array, cv2.IMREAD_COLOR)
-
-        if img_array is None:
-             print("❌ Gagal membaca bytes gambar. Mungkin format file tidak didukung.")
-             return []
-
-        # 3. DeepFace.represent: menerima numpy array (img_array)
-        results = DeepFace.represent(
-            img_path=img_array, # Menerima NumPy array, bukan path file
-            model_name=MODEL_NAME, # Menggunakan konstanta global
-            enforce_detection=True, 
-            detector_backend='opencv' 
+        return get_deepface().extract_faces(
+            img_path=image,
+            target_size=get_target_size(),
+            detector_backend=detector_backend,
+            enforce_detection=enforce_detection,
+            align=align
         )
     except ValueError as ve:
         # Menangani kesalahan DeepFace saat wajah tidak ditemukan
@@ -55,20 +176,191 @@ def extract_face_features(image_bytes: bytes):
              print(f"⚠️ Peringatan: DeepFace gagal memproses gambar. Detail: {ve}")
         return []
     except Exception as e:
-        # Menangani error umum lainnya
-        print(f"❌ ERROR Ekstraksi Fitur: {e}")
+        print(f"❌ ERROR Deteksi Wajah: {e}")
+        return []
+
+
+def _to_model_faces(face_objs) -> list:
+    # extract_faces mengembalikan RGB untuk tampilan; model dilatih dengan urutan BGR
+    # seperti yang dipakai DeepFace.represent, jadi kanal dibalik kembali.
+    return [np.ascontiguousarray(obj["face"][:, :, ::-1], dtype=np.float32) for obj in face_objs]
+
+
+def detect_faces(image, detector_backend: str = DETECTOR_BACKEND, enforce_detection: bool = True,
+                 allow_downscale: bool = True) -> list:
+    """
+    Mendeteksi dan meng-align semua wajah pada gambar.
+
+    Gambar yang lebih besar dari DETECT_MAX_DIM dideteksi satu kali pada salinan yang
+    diperkecil (lihat _detect_faces_downscaled).
+
+    Args:
+        image: bytes gambar, path file, atau array BGR.
+        detector_backend (str): Backend detektor DeepFace.
+        enforce_detection (bool): Jika True, gambar tanpa wajah menghasilkan list kosong.
+        allow_downscale (bool): False untuk galeri/indexing: bytes di-decode pada resolusi
+            penuh dan deteksi tidak memakai salinan yang diperkecil.
+
+    Returns:
+        list of np.ndarray: Crop wajah BGR float32 [0, 1] berukuran get_target_size(),
+                            siap dimasukkan ke embed_faces. List kosong jika tidak ada wajah.
+    """
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        image = decode_image(image, max_dim=DECODE_MAX_DIM if allow_downscale else 0)
+        if image is None:
+            print("❌ Gagal membaca bytes gambar. Mungkin format file tidak didukung.")
+            return []
+
+    if (allow_downscale and isinstance(image, np.ndarray) and detector_backend != "skip" and DETECT_MAX_DIM > 0
+            and max(image.shape[:2]) > DETECT_MAX_DIM):
+        return _detect_faces_downscaled(image, detector_backend, enforce_detection)
+    return _to_model_faces(_extract_face_objs(image, detector_backend, enforce_detection))
+
+
+def _detect_faces_downscaled(image: np.ndarray, detector_backend: str, enforce_detection: bool) -> list:
+    """
+    Detektor dijalankan SATU kali pada salinan DETECT_MAX_DIM (dengan alignment).
+
+    Wajah yang box-nya di salinan kecil sudah >= ukuran input model memakai crop ter-align
+    dari salinan tersebut: resolusi penuh tidak menambah detail karena crop tetap diperkecil
+    ke ukuran input model. Wajah yang lebih kecil dari itu dideteksi ulang (dengan alignment)
+    satu kali pada area resolusi penuh di sekitar box yang dipetakan balik (+ DETECT_ROI_PADDING);
+    jika detektor tidak menemukannya di sana, crop ter-align dari salinan kecil yang dipakai.
+    """
+    small, scale = _downscale_reused(image, DETECT_MAX_DIM)
+    face_objs = _extract_face_objs(small, detector_backend, enforce_detection)
+    min_side = min(get_target_size())
+    faces = []
+    for obj in face_objs:
+        area = obj["facial_area"]
+        if min(area["w"], area["h"]) < min_side:
+            roi_objs = _extract_face_objs(_face_roi(image, area, scale), detector_backend, True)
+            if roi_objs:
+                # Area bisa ikut memuat wajah tetangga: ambil wajah terbesar (yang di-zoom)
+                obj = max(roi_objs, key=lambda o: o["facial_area"]["w"] * o["facial_area"]["h"])
+        faces.extend(_to_model_faces([obj]))
+    return faces
+
+
+def _face_roi(image: np.ndarray, area: dict, scale: float) -> np.ndarray:
+    """Area resolusi penuh untuk box `area` dari salinan berskala `scale`, plus padding."""
+    pad_x, pad_y = area["w"] * DETECT_ROI_PADDING, area["h"] * DETECT_ROI_PADDING
+    x0 = max(0, int((area["x"] - pad_x) / scale))
+    y0 = max(0, int((area["y"] - pad_y) / scale))
+    x1 = min(image.shape[1], int(math.ceil((area["x"] + area["w"] + pad_x) / scale)))
+    y1 = min(image.shape[0], int(math.ceil((area["y"] + area["h"] + pad_y) / scale)))
+    return np.ascontiguousarray(image[y0:y1, x0:x1])
+
+
+def _detect_in_box(image: np.ndarray, box, detector_backend: str) -> list:
+    """
+    Deteksi terbatas pada area `box` (x, y, w, h): mode 'narrow' menjalankan detektor pada
+    box + padding (alignment tetap ada) dan mengembalikan list kosong jika tidak ada wajah;
+    hanya mode 'skip' (lihat FACE_HINT_MODE) yang memakai area box langsung tanpa detektor.
+    List kosong jika box tidak valid.
+    """
+    box = clamp_face_box(box, image.shape)
+    if box is None:
         return []
+    x, y, w, h = box
+    if FACE_HINT_MODE == "skip":
+        # Mode percaya penuh: box klien dipakai langsung tanpa detektor
+        region = np.ascontiguousarray(image[y:y + h, x:x + w])
+        return _to_model_faces(_extract_face_objs(region, "skip", False))
+    pad_x, pad_y = int(w * FACE_HINT_PADDING), int(h * FACE_HINT_PADDING)
+    region = image[max(0, y - pad_y):y + h + pad_y, max(0, x - pad_x):x + w + pad_x]
+    return _to_model_faces(_extract_face_objs(region, detector_backend, True))
+
 
+def embed_faces(faces) -> list:
+    """
+    Forward pass MODEL_NAME untuk satu batch crop wajah hasil detect_faces.
 
-    if not results:
+    Returns:
+        list of list[float]: Satu embedding per crop, urutan sama dengan input.
+    """
+    if len(faces) == 0:
         return []
+    batch = np.stack(faces).astype(np.float32, copy=False)
+    embeddings = get_embedding_model().predict(batch, verbose=0)
 
-    # Ambil embedding dari semua wajah yang dideteksi
-    embeddings_list = [res["embedding"] for res in results]
-    
-    # Periksa dimensi sebagai validasi tambahan (meskipun deepface harus benar)
-    if embeddings_list and len(embeddings_list[0]) != EMBEDDING_DIM:
-         print(f"❌ ERROR: Dimensi embedding ({len(embeddings_list[0])}) tidak cocok dengan EMBEDDING_DIM ({EMBEDDING_DIM})")
+    if embeddings.shape[-1] != EMBEDDING_DIM:
+         print(f"❌ ERROR: Dimensi embedding ({embeddings.shape[-1]}) tidak cocok dengan EMBEDDING_DIM ({EMBEDDING_DIM})")
          return []
-         
-    return embeddings_list
\ No newline at end of file
+    return embeddings.tolist()
+
+
+def parse_face_box(value):
+    """'x,y,w,h' (piksel, dari form kiosk) -> tuple int, atau None jika kosong/tidak valid."""
+    if not value:
+        return None
+    try:
+        x, y, w, h = (int(round(float(part))) for part in str(value).split(","))
+    except ValueError:
+        return None
+    return (x, y, w, h)
+
+
+def clamp_face_box(box, shape):
+    """Memotong box ke batas gambar; None jika box terlalu kecil atau di luar gambar."""
+    if box is None:
+        return None
+    height, width = shape[:2]
+    x, y, w, h = box
+    x0, y0 = max(0, x), max(0, y)
+    x1, y1 = min(width, x + w), min(height, y + h)
+    if x1 - x0 < FACE_HINT_MIN_SIZE or y1 - y0 < FACE_HINT_MIN_SIZE:
+        return None
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def detect_faces_hinted(image, face_box, detector_backend: str = DETECTOR_BACKEND) -> list:
+    """
+    Fast path untuk crop wajah dari kiosk: gambar sudah kecil dan `face_box` (x, y, w, h)
+    menandai posisi wajah, sehingga deteksi hanya dilakukan di sekitar box (lihat
+    _detect_in_box). Jika box tidak valid, jalur deteksi biasa pada seluruh gambar dipakai.
+    """
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        image = decode_image(image)
+        if image is None:
+            print("❌ Gagal membaca bytes gambar. Mungkin format file tidak didukung.")
+            return []
+    if clamp_face_box(face_box, image.shape) is None:
+        return detect_faces(image, detector_backend=detector_backend)
+    return _detect_in_box(image, face_box, detector_backend)
+
+
+def decode_and_detect(image_bytes: bytes, face_box=None, detector_backend: str = DETECTOR_BACKEND):
+    """
+    Satu kali decode untuk seluruh jalur /recognize: mengembalikan (gambar BGR, crop wajah).
+    Array gambar dipakai ulang oleh penyimpanan gambar absensi sehingga tidak di-decode lagi.
+    """
+    image = decode_image(image_bytes)
+    if image is None:
+        print("❌ Gagal membaca bytes gambar. Mungkin format file tidak didukung.")
+        return None, []
+    if face_box is not None:
+        return image, detect_faces_hinted(image, face_box, detector_backend)
+    return image, detect_faces(image, detector_backend=detector_backend)
+
+
+def extract_face_features(image_bytes: bytes, face_box=None):
+    """
+    Ekstraksi fitur wajah (embedding) menggunakan model DeepFace dari data bytes gambar.
+    Menggunakan MODEL_NAME yang didefinisikan secara global di utils.py.
+    
+    Args:
+        image_bytes (bytes): Data gambar yang diunggah dari frontend.
+        face_box (tuple, optional): Hint (x, y, w, h) dari kiosk; mengaktifkan fast path crop.
+        
+    Returns:
+        list of list[float]: List dari embedding wajah yang terdeteksi. 
+                             Mengembalikan list kosong ([]) jika tidak ada wajah.
+    """
+    try:
+        _, faces = decode_and_detect(image_bytes, face_box)
+        return embed_faces(faces)
+    except Exception as e:
+        # Menangani error umum lainnya
+        print(f"❌ ERROR Ekstraksi Fitur: {e}")
+        return []
@@ -0,0 +1,134 @@
+import io
+import struct
+from typing import Iterable, Sequence
+
+import numpy as np
+import psycopg2.extensions
+
+# --- CODEC VEKTOR PGVECTOR <-> NUMPY (float32) ---
+# Dipakai bersama oleh main.py dan index_data.py agar tidak ada lagi parsing
+# float(x) per komponen atau penyusunan string "[...]" manual.
+
+VECTOR_DTYPE = np.float32
+
+# Format biner pgvector (vector_send/vector_recv): int16 dim, int16 unused, float4[dim] big-endian
+_VECTOR_HEADER = struct.Struct(">hh")
+_BIG_ENDIAN_F4 = np.dtype(">f4")
+
+# Format COPY BINARY PostgreSQL
+_PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+_PGCOPY_TRAILER = struct.pack(">h", -1)
+
+
+def parse_vector_text(data: str) -> np.ndarray:
+    """Parse representasi teks pgvector '[1,2,3]' langsung ke float32 (parser C NumPy)."""
+    return np.fromstring(data.strip('{}[]'), dtype=VECTOR_DTYPE, sep=',')
+
+
+def decode_vectors_binary(buffers: Sequence) -> np.ndarray:
+    """Decode banyak bytea vector_send sekaligus menjadi matriks float32 (n, dim)."""
+    if not buffers:
+        return np.zeros((0, 0), dtype=VECTOR_DTYPE)
+    dim, _ = _VECTOR_HEADER.unpack_from(buffers[0], 0)
+    row_size = _VECTOR_HEADER.size + 4 * dim
+    raw = np.frombuffer(b"".join(buffers), dtype=np.uint8).reshape(len(buffers), row_size)
+    return raw[:, _VECTOR_HEADER.size:].copy().view(_BIG_ENDIAN_F4).astype(VECTOR_DTYPE)
+
+
+def encode_vector_binary(vector) -> bytes:
+    """Encode vektor ke format biner pgvector (input vector_recv, dipakai oleh COPY BINARY)."""
+    array = np.asarray(vector, dtype=_BIG_ENDIAN_F4).ravel()
+    return _VECTOR_HEADER.pack(array.size, 0) + array.tobytes()
+
+
+def encode_vector(vector) -> str:
+    """Encode vektor ke literal teks pgvector (untuk parameter query biasa)."""
+    return str(np.asarray(vector, dtype=VECTOR_DTYPE).ravel().tolist())
+
+
+class Vector:
+    """
+    Pembungkus parameter query bertipe vector: `cur.execute("... %s::vector", (Vector(arr),))`.
+    Adapter hanya terdaftar untuk tipe ini, sehingga np.ndarray lain tetap diadaptasi
+    psycopg2 seperti biasa.
+    """
+    __slots__ = ("array",)
+
+    def __init__(self, array):
+        self.array = array
+
+
+def _adapt_vector(vector: Vector):
+    # Literal hanya berisi angka, koma, titik, tanda minus, 'e' dan kurung siku: aman di-quote langsung
+    return psycopg2.extensions.AsIs("'" + encode_vector(vector.array) + "'")
+
+
+psycopg2.extensions.register_adapter(Vector, _adapt_vector)
+
+
+def register_vector(conn, vector_oid: int):
+    """Mendaftarkan caster tipe 'vector' -> np.ndarray float32 pada koneksi."""
+    def cast_vector(data, cur):
+        if data is None: return None
+        return parse_vector_text(data)
+
+    psycopg2.extensions.register_type(
+        psycopg2.extensions.new_type((vector_oid,), 'vector', cast_vector),
+        conn
+    )
+
+
+def lookup_vector_oid(conn) -> int:
+    """Mengambil OID tipe 'vector' (raise jika ekstensi pgvector belum aktif)."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT oid FROM pg_type WHERE typname = 'vector'")
+        row = cur.fetchone()
+    if not row:
+        raise Exception("❌ Ekstensi pgvector belum aktif di database.")
+    return row[0]
+
+
+# --- COPY BINARY (BULK INSERT TANPA INTERPOLASI TEKS) ---
+
+def _encode_field(value, kind: str) -> bytes:
+    if value is None:
+        return struct.pack(">i", -1)
+    if kind == "int4":
+        payload = struct.pack(">i", int(value))
+    elif kind == "int8":
+        payload = struct.pack(">q", int(value))
+    elif kind == "text":
+        payload = str(value).encode("utf-8")
+    elif kind == "vector":
+        payload = encode_vector_binary(value)
+    else:
+        raise ValueError(f"Tipe kolom COPY tidak didukung: {kind}")
+    return struct.pack(">i", len(payload)) + payload
+
+
+def copy_rows_binary(cursor, table: str, columns: Sequence[str], kinds: Sequence[str], rows: Iterable[Sequence]) -> int:
+    """
+    Bulk insert baris ke `table` via COPY ... FORMAT binary. Vektor dikirim dalam
+    format biner pgvector sehingga tidak ada konversi float <-> teks sama sekali.
+
+    Args:
+        kinds: Tipe tiap kolom: 'int4', 'int8', 'text', atau 'vector'.
+
+    Returns:
+        int: Jumlah baris yang dikirim.
+    """
+    buf = io.BytesIO()
+    buf.write(_PGCOPY_HEADER)
+    field_count = struct.pack(">h", len(columns))
+    count = 0
+    for row in rows:
+        buf.write(field_count)
+        for value, kind in zip(row, kinds):
+            buf.write(_encode_field(value, kind))
+        count += 1
+    buf.write(_PGCOPY_TRAILER)
+
+    if count:
+        buf.seek(0)
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT binary)", buf)
+    return count
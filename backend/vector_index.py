@@ -0,0 +1,88 @@
+"""
+Indeks ANN pgvector untuk tabel centroid.
+
+Pencocokan wajah sengaja dilakukan di memori (face_index.py): CentroidIndex maupun
+PrototypeIndex menghitung jarak ke SELURUH baris dengan satu perkalian matriks, jadi
+biayanya linear terhadap jumlah vektor (juga pada puluhan ribu embedding per gambar).
+Itu disengaja: satu matmul float32 di memori tetap lebih cepat daripada round trip DB,
+dan hasilnya eksak. Indeks ANN di sini hanya melayani fallback search_centroids_db
+selama indeks in-memory belum termuat; intern_embeddings tidak diberi indeks.
+"""
+import os
+
+# --- INDEKS ANN PGVECTOR (HNSW / IVFFLAT) ---
+# Dipakai bersama oleh setup_tables.py, main.py (initialize_db) dan index_data.py (perintah reindex)
+# agar definisi indeks dan parameter pencariannya hanya ada di satu tempat.
+
+# Jenis indeks: 'hnsw' (default, tidak butuh data awal) atau 'ivfflat'
+VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "hnsw").lower()
+# Parameter build HNSW
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "64"))
+# Jumlah list IVFFlat; 0 = otomatis dari jumlah baris saat rebuild (rows / 1000, minimal 1)
+IVFFLAT_LISTS = int(os.getenv("IVFFLAT_LISTS", "0"))
+# Parameter pencarian (per query / per sesi)
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "40"))
+IVFFLAT_PROBES = int(os.getenv("IVFFLAT_PROBES", "10"))
+
+# Tabel vektor yang diberi indeks kosinus. Hanya centroid: satu-satunya query <=> adalah
+# fallback search_centroids_db (face_index.py) saat indeks in-memory belum termuat.
+# intern_embeddings tidak diberi indeks agar COPY/INSERT saat indexing tidak melambat.
+VECTOR_TABLES = ("intern_centroids",)
+# Indeks dari versi sebelumnya yang tidak lagi dipakai query mana pun
+OBSOLETE_VECTOR_TABLES = ("intern_embeddings",)
+
+
+def vector_index_name(table: str) -> str:
+    return f"idx_{table}_embedding_ann"
+
+
+def _index_options(lists: int) -> str:
+    if VECTOR_INDEX_TYPE == "ivfflat":
+        return f"USING ivfflat (embedding vector_cosine_ops) WITH (lists = {max(1, lists)})"
+    return f"USING hnsw (embedding vector_cosine_ops) WITH (m = {HNSW_M}, ef_construction = {HNSW_EF_CONSTRUCTION})"
+
+
+def _auto_lists(cursor, table: str) -> int:
+    if IVFFLAT_LISTS > 0:
+        return IVFFLAT_LISTS
+    cursor.execute(f"SELECT COUNT(*) FROM {table}")
+    return max(1, cursor.fetchone()[0] // 1000)
+
+
+def create_vector_indexes(cursor, tables=VECTOR_TABLES):
+    """Membuat indeks ANN kosinus pada tabel vektor jika belum ada (idempoten)."""
+    for table in OBSOLETE_VECTOR_TABLES:
+        cursor.execute(f"DROP INDEX IF EXISTS {vector_index_name(table)};")
+    for table in tables:
+        lists = _auto_lists(cursor, table) if VECTOR_INDEX_TYPE == "ivfflat" else 0
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {vector_index_name(table)} ON {table} {_index_options(lists)};")
+
+
+def rebuild_vector_indexes(conn, tables=VECTOR_TABLES):
+    """
+    Membangun ulang indeks ANN setelah bulk load: indeks lama di-drop lalu dibuat ulang
+    dengan konfigurasi saat ini (termasuk pergantian hnsw <-> ivfflat dan jumlah list
+    IVFFlat yang disesuaikan dengan jumlah baris), kemudian statistik tabel diperbarui.
+    """
+    with conn.cursor() as cursor:
+        for table in tables:
+            cursor.execute(f"DROP INDEX IF EXISTS {vector_index_name(table)};")
+        create_vector_indexes(cursor, tables)
+    conn.commit()
+
+    # ANALYZE tidak boleh berjalan di dalam blok transaksi yang sama dengan DDL di atas
+    with conn.cursor() as cursor:
+        for table in tables:
+            cursor.execute(f"ANALYZE {table};")
+    conn.commit()
+
+
+def apply_search_params(cursor, ef_search: int = HNSW_EF_SEARCH, probes: int = IVFFLAT_PROBES, local: bool = True):
+    """
+    Mengatur parameter pencarian ANN. Dengan local=True berlaku hanya untuk transaksi
+    berjalan (SET LOCAL, per query); local=False untuk seluruh sesi koneksi.
+    """
+    scope = "SET LOCAL" if local else "SET"
+    cursor.execute(f"{scope} hnsw.ef_search = {int(ef_search)};")
+    cursor.execute(f"{scope} ivfflat.probes = {int(probes)};")
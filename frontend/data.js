@@ -4,6 +4,13 @@ const attendanceTableBody = document.getElementById("attendanceTableBody");
 const refreshDataBtn = document.getElementById("refreshDataBtn");
 const photoUrlInfo = document.getElementById("photoUrlInfo");
 
+// Interval polling cadangan (ms) jika EventSource tidak tersedia / terputus
+const POLL_INTERVAL_MS = 15000;
+let attendanceRows = [];
+let attendanceEtag = null;
+let attendanceStream = null;
+let pollTimer = null;
+
 function updateStatus(message, type = "info") {
   const map = {
     success: "status-area bg-green-100 text-green-700",
@@ -15,36 +22,80 @@ function updateStatus(message, type = "info") {
   statusArea.innerHTML = message;
 }
 
-async function fetchAttendanceData() {
-  updateStatus("Memuat data absensi terbaru...", "loading");
-  attendanceTableBody.innerHTML = '<tr><td colspan="8">Memuat...</td></tr>';
+function showAttendance(data) {
+  attendanceRows = data;
+  renderTable(data);
 
-  photoUrlInfo.classList.add("hidden");
-  photoUrlInfo.innerHTML = '';
+  if (data.length > 0) {
+    updateStatus(`Berhasil memuat ${data.length} entri absensi hari ini.`, "success");
 
-  try {
-    const response = await fetch(`${API_BASE_URL}/attendance/today`);
-    if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+    const firstEntryUrl = data[0].image_path;
+    if (firstEntryUrl) {
+      photoUrlInfo.innerHTML = `URL Foto (Contoh): <a href="${firstEntryUrl}" target="_blank">${API_BASE_URL}${firstEntryUrl}</a>`;
+      photoUrlInfo.classList.remove("hidden");
+    }
+  } else {
+    photoUrlInfo.classList.add("hidden");
+    photoUrlInfo.innerHTML = '';
+    updateStatus("Belum ada data absensi yang tercatat hari ini.", "info");
+  }
+}
 
-    const data = await response.json();
-    renderTable(data);
+async function fetchAttendanceData(silent = false) {
+  if (!silent) {
+    updateStatus("Memuat data absensi terbaru...", "loading");
+    attendanceTableBody.innerHTML = '<tr><td colspan="8">Memuat...</td></tr>';
+    photoUrlInfo.classList.add("hidden");
+    photoUrlInfo.innerHTML = '';
+  }
 
-    if (data.length > 0) {
-      updateStatus(`Berhasil memuat ${data.length} entri absensi hari ini.`, "success");
+  try {
+    // If-None-Match: server membalas 304 tanpa body jika data belum berubah
+    const headers = silent && attendanceEtag ? { "If-None-Match": attendanceEtag } : {};
+    const response = await fetch(`${API_BASE_URL}/attendance/today`, { headers, cache: "no-cache" });
+    if (response.status === 304) return;
+    if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
 
-      const firstEntryUrl = data[0].image_path;
-      if (firstEntryUrl) {
-        photoUrlInfo.innerHTML = `URL Foto (Contoh): <a href="${firstEntryUrl}" target="_blank">${API_BASE_URL}${firstEntryUrl}</a>`;
-        photoUrlInfo.classList.remove("hidden");
-      }
-    } else {
-      updateStatus("Belum ada data absensi yang tercatat hari ini.", "info");
-    }
+    attendanceEtag = response.headers.get("ETag");
+    showAttendance(await response.json());
   } catch (error) {
     console.error("Error:", error);
     updateStatus(`Gagal terhubung ke server API atau memuat data: ${error.message}`, "error");
-    attendanceTableBody.innerHTML = '<tr><td colspan="8" class="text-red-500">Gagal memuat data.</td></tr>';
+    if (!silent) {
+      attendanceTableBody.innerHTML = '<tr><td colspan="8" class="text-red-500">Gagal memuat data.</td></tr>';
+    }
+  }
+}
+
+function applyAttendanceDelta(row) {
+  // Satu baris per intern: ganti baris lama lalu taruh di paling atas (terbaru dulu)
+  showAttendance([row, ...attendanceRows.filter((item) => item.name !== row.name)]);
+}
+
+function startPolling() {
+  if (!pollTimer) pollTimer = setInterval(() => fetchAttendanceData(true), POLL_INTERVAL_MS);
+}
+
+function stopPolling() {
+  clearInterval(pollTimer);
+  pollTimer = null;
+}
+
+function startAttendanceStream() {
+  if (!window.EventSource) {
+    startPolling();
+    return;
   }
+  attendanceStream = new EventSource(`${API_BASE_URL}/attendance/stream`);
+  attendanceStream.addEventListener("snapshot", (event) => {
+    stopPolling();
+    showAttendance(JSON.parse(event.data).rows);
+  });
+  attendanceStream.addEventListener("delta", (event) => {
+    applyAttendanceDelta(JSON.parse(event.data).row);
+  });
+  // EventSource menyambung ulang sendiri; selama terputus, pakai polling bersyarat (ETag)
+  attendanceStream.onerror = startPolling;
 }
 
 function renderTable(attendanceData) {
@@ -81,7 +132,9 @@ function renderTable(attendanceData) {
                 <td>N/A</td>
                 <td>
                   ${
-                    item.image_path
+                    item.thumbnail_path
+                      ? `<a href="${photoUrl}" target="_blank"><img src="${API_BASE_URL}${item.thumbnail_path}" alt="Foto ${item.name}" loading="lazy" width="48" class="rounded"></a>`
+                      : item.image_path
                       ? `<a href="${photoUrl}" target="_blank" class="text-blue-500 hover:text-blue-700">Lihat</a>`
                       : "N/A"
                   }
@@ -93,5 +146,6 @@ function renderTable(attendanceData) {
 
 window.onload = () => {
   fetchAttendanceData();
-  refreshDataBtn.addEventListener("click", fetchAttendanceData);
+  startAttendanceStream();
+  refreshDataBtn.addEventListener("click", () => fetchAttendanceData());
 };
\ No newline at end of file
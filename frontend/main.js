@@ -26,6 +26,17 @@ const EYE_CLOSED_FRAMES = 0; // Cukup 1 frame tertutup
 let closedFramesCounter = 0;
 // ---------------------------------
 
+// --- PRE-CROP WAJAH SEBELUM UPLOAD ---
+// Hanya area wajah (+ padding) yang dikirim, diperkecil, beserta bounding box hint
+const CROP_PADDING = 0.5; // Padding di sekitar box landmark (fraksi ukuran box)
+const CROP_MAX_DIM = 320; // Sisi terpanjang crop yang diunggah (piksel)
+const FACE_BOX_MAX_AGE_MS = 500; // Box yang lebih tua dari ini dianggap basi
+// Mode multi-wajah: frame penuh dikirim tanpa crop, semua wajah dicatat sekaligus
+const MULTI_FACE_MODE = false;
+const MULTI_FACE_MAX_DIM = 1280; // Sisi terpanjang frame penuh pada mode multi-wajah
+let lastFaceBox = null; // {x, y, w, h} ternormalisasi (0..1) pada frame video
+let lastFaceBoxAt = 0;
+
 function updateStatus(message, type = "info") {
   const map = {
     success: "status-area bg-green-100 text-green-700",
@@ -120,6 +131,7 @@ async function onFaceMeshResults(results) {
 
   if (results.multiFaceLandmarks && results.multiFaceLandmarks.length > 0) {
     const landmarks = results.multiFaceLandmarks[0];
+    updateFaceBox(landmarks);
 
     if (livenessCheckActive) {
       const leftEAR = getEAR(landmarks, LEFT_EYE_INDICES);
@@ -162,21 +174,78 @@ async function onFaceMeshResults(results) {
   }
 }
 
+function updateFaceBox(landmarks) {
+  let minX = 1, minY = 1, maxX = 0, maxY = 0;
+  for (const point of landmarks) {
+    if (point.x < minX) minX = point.x;
+    if (point.y < minY) minY = point.y;
+    if (point.x > maxX) maxX = point.x;
+    if (point.y > maxY) maxY = point.y;
+  }
+  lastFaceBox = { x: minX, y: minY, w: maxX - minX, h: maxY - minY };
+  lastFaceBoxAt = performance.now();
+}
+
+// Area sumber (piksel video) untuk crop: box wajah + padding, dibatasi tepi frame
+function getCropRegion() {
+  if (!lastFaceBox || performance.now() - lastFaceBoxAt > FACE_BOX_MAX_AGE_MS) return null;
+  const vw = videoElement.videoWidth;
+  const vh = videoElement.videoHeight;
+  const face = {
+    x: lastFaceBox.x * vw,
+    y: lastFaceBox.y * vh,
+    w: lastFaceBox.w * vw,
+    h: lastFaceBox.h * vh,
+  };
+  if (face.w < 1 || face.h < 1) return null;
+  const sx = Math.max(0, Math.floor(face.x - face.w * CROP_PADDING));
+  const sy = Math.max(0, Math.floor(face.y - face.h * CROP_PADDING));
+  const ex = Math.min(vw, Math.ceil(face.x + face.w * (1 + CROP_PADDING)));
+  const ey = Math.min(vh, Math.ceil(face.y + face.h * (1 + CROP_PADDING)));
+  return { sx, sy, sw: ex - sx, sh: ey - sy, face };
+}
+
 function captureImage() {
   if (!stream) {
     updateStatus("Kamera tidak aktif.", "error");
     return null;
   }
+  const vw = videoElement.videoWidth;
+  const vh = videoElement.videoHeight;
+  // Tanpa box wajah yang segar: kirim frame penuh seperti sebelumnya
+  const region = (!MULTI_FACE_MODE && getCropRegion()) || { sx: 0, sy: 0, sw: vw, sh: vh, face: null };
+  const maxDim = MULTI_FACE_MODE ? MULTI_FACE_MAX_DIM : CROP_MAX_DIM;
+  const scale = Math.min(1, maxDim / Math.max(region.sw, region.sh));
+  canvasElement.width = Math.round(region.sw * scale);
+  canvasElement.height = Math.round(region.sh * scale);
+
   const context = canvasElement.getContext("2d");
   context.translate(canvasElement.width, 0);
   context.scale(-1, 1);
-  context.drawImage(videoElement, 0, 0, canvasElement.width, canvasElement.height);
+  context.drawImage(
+    videoElement,
+    region.sx, region.sy, region.sw, region.sh,
+    0, 0, canvasElement.width, canvasElement.height
+  );
   context.setTransform(1, 0, 0, 1, 0, 0);
+
+  // Box wajah dalam koordinat crop (sudah di-mirror) sebagai hint untuk server
+  let faceBox = null;
+  if (region.face) {
+    const f = region.face;
+    faceBox = [
+      (region.sx + region.sw - (f.x + f.w)) * scale,
+      (f.y - region.sy) * scale,
+      f.w * scale,
+      f.h * scale,
+    ].map(Math.round).join(",");
+  }
+
   return new Promise((resolve, reject) => {
     canvasElement.toBlob(
       (blob) => {
         if (blob) {
-          resolve(blob);
+          resolve({ blob, faceBox });
         } else {
           reject(new Error("Gagal membuat Blob dari Canvas."));
         }
@@ -199,18 +268,25 @@ async function performAbsensi(typeAbsensi) {
   );
 
   try {
-    const imageBlob = await captureImage();
-    if (!imageBlob) {
+    const capture = await captureImage();
+    if (!capture) {
       throw new Error("Gagal mengambil gambar setelah liveness check.");
     }
     const formData = new FormData();
-    formData.append("file", imageBlob, "capture.jpg");
+    formData.append("file", capture.blob, "capture.jpg");
     formData.append("type_absensi", typeAbsensi);
+    if (capture.faceBox) formData.append("face_box", capture.faceBox);
+    if (MULTI_FACE_MODE) formData.append("multi_face", "true");
 
     const response = await fetch(`${API_BASE_URL}/recognize`, {
       method: "POST",
       body: formData,
     });
+    if (response.status === 503) {
+      // Antrean inferensi server penuh (admission control)
+      const retryAfter = response.headers.get("Retry-After") || "beberapa";
+      throw new Error(`Server sedang sibuk. Silakan coba lagi dalam ${retryAfter} detik.`);
+    }
     if (!response.ok) {
       throw new Error(`HTTP error! status: ${response.status}`);
     }
@@ -314,6 +390,27 @@ function handleAbsensiResult(data) {
             <tr><td>Waktu Log Terakhir</td><td>:</td><td>${data.log_time} WIB</td></tr>
             <tr><td>Pesan</td><td>:</td><td>Anda sudah Absen ${typeDisplay} hari ini.</td></tr>
           `;
+  } else if (data.status === "multi") {
+    resultTitle.textContent = `Absensi ${typeDisplay}: ${data.recognized}/${data.count} Wajah Dikenali`;
+    resultTitle.className = data.recognized
+      ? "result-header text-green-700"
+      : "result-header text-red-700";
+    updateStatus(
+      `${data.recognized} dari ${data.count} wajah dikenali.`,
+      data.recognized ? "success" : "error"
+    );
+    const labels = { success: "Berhasil", duplicate: "Duplikat", unrecognized: "Tidak Dikenal" };
+    resultCardBody.innerHTML = data.faces
+      .map((face) => {
+        const detail =
+          face.status === "success"
+            ? `${face.log_time} WIB (${face.attendance_status})`
+            : face.status === "duplicate"
+            ? `Sudah absen ${face.log_time} WIB`
+            : "";
+        return `<tr><td class="font-semibold">${face.name || `Wajah ${face.index + 1}`}</td><td>:</td><td>${labels[face.status]} ${detail}</td></tr>`;
+      })
+      .join("");
   } else if (data.status === "unrecognized") {
     resultTitle.textContent = "Gagal: Wajah Tidak Dikenal";
     resultTitle.className = "result-header text-red-700";
@@ -331,10 +428,20 @@ function handleAbsensiResult(data) {
     resultTitle.className = "result-header text-red-700";
     updateStatus(data.message || "Kesalahan server terjadi.", "error");
   }
-  if (data.track_id) {
-    audioPlayer.src = `${API_BASE_URL}/audio/${data.track_id}`;
+  // Pesan per intern dikirim sebagai playlist klip (frasa + nama), diputar berurutan
+  const playlist = data.playlist || (data.track_id ? [data.track_id] : []);
+  playAudioPlaylist(audioPlayer, playlist);
+}
+
+function playAudioPlaylist(audioPlayer, playlist) {
+  let index = 0;
+  const playNext = () => {
+    if (index >= playlist.length) return;
+    audioPlayer.src = `${API_BASE_URL}/audio/${playlist[index++]}`;
     audioPlayer.play().catch((e) => console.error("Gagal memutar audio:", e));
-  }
+  };
+  audioPlayer.onended = playNext;
+  playNext();
 }
 
 window.onload = () => {
@@ -123,6 +123,9 @@ function renderTable(faces, facesTableBody) {
     .join("");
 }
 
+// Interval polling status job indexing (ms)
+const INDEX_POLL_INTERVAL_MS = 1500;
+
 async function runIndexing(indexingButton) { // Terima tombol sebagai argumen
   if (!indexingButton) return;
 
@@ -140,29 +143,57 @@ async function runIndexing(indexingButton) { // Terima tombol sebagai argumen
   updateStatus("Mengirim permintaan indexing ke server...", "warning");
 
   try {
-    const res = await fetch(`${API_BASE_URL}/run_indexing`, { method: "POST" });
+    const res = await fetch(`${API_BASE_URL}/index_jobs`, { method: "POST" });
 
     if (!res.ok) {
       const errData = await res.json();
       throw new Error(errData.detail || `HTTP Error ${res.status}`);
     }
 
-    const data = await res.json();
+    let job = await res.json();
+    if (job.deduplicated) {
+      updateStatus("Indexing sudah berjalan, menampilkan progres job yang ada...", "warning");
+    }
 
-    updateStatus(
-      data.message +
-        " Silakan tunggu beberapa menit, lalu klik 'Sinkronisasi Database' untuk memuat hasil baru.",
-      "success"
-    );
+    // Pantau progres job sampai selesai
+    while (job.status === "queued" || job.status === "running") {
+      await new Promise((resolve) => setTimeout(resolve, INDEX_POLL_INTERVAL_MS));
+      const statusRes = await fetch(`${API_BASE_URL}/index_jobs/${job.id}`);
+      if (!statusRes.ok) throw new Error(`HTTP Error ${statusRes.status}`);
+      job = await statusRes.json();
+      updateStatus(formatIndexProgress(job), "warning");
+    }
+
+    if (job.status === "succeeded") {
+      const result = job.result || {};
+      updateStatus(
+        `Indexing selesai: ${result.embedded || 0} embedding baru, ${result.copied || 0} disalin, ` +
+          `${result.skipped || 0} gambar dilewati. Indeks wajah sudah dimuat ulang.`,
+        "success"
+      );
+      fetchRegisteredFaces(document.getElementById("facesTableBody"));
+    } else if (job.status === "cancelled") {
+      updateStatus("Indexing dibatalkan.", "warning");
+    } else {
+      throw new Error(job.error || "Job indexing gagal.");
+    }
   } catch (error) {
-    console.error("Error starting indexing:", error);
-    updateStatus(`Gagal memulai indexing: ${error.message}`, "error");
+    console.error("Error running indexing:", error);
+    updateStatus(`Gagal menjalankan indexing: ${error.message}`, "error");
   } finally {
     indexingButton.disabled = false;
     indexingButton.textContent = originalButtonText;
   }
 }
 
+function formatIndexProgress(job) {
+  const p = job.progress || {};
+  if (job.status === "queued") return "Job indexing menunggu giliran...";
+  if (p.phase === "embed") return `Indexing: ${p.processed || 0}/${p.to_embed || 0} gambar diproses...`;
+  if (p.phase === "centroid") return "Indexing: menghitung ulang centroid...";
+  return `Indexing: memindai dataset (${p.files || 0} file)...`;
+}
+
 // --- EKSEKUSI UTAMA (SETELAH HALAMAN SIAP) ---
 window.onload = () => {
   // 1. Ambil semua elemen penting SEKARANG (setelah HTML ada)